@@ -6,6 +6,12 @@ from api.routes.optimize import router as optimize_router
 from api.routes.k8s_deploy import router as k8s_deploy_router
 from api.routes.correct import router as correct_router
 from api.routes.detect import router as detect_router
+from api.routes.cache import router as cache_router
+from api.routes.scheduler import router as scheduler_router
+from api.routes.batch import router as batch_router
+from api.routes.tokens import router as tokens_router
+from api.routes.metrics import router as metrics_router
+from api.routes.traces import router as traces_router
 
 api_router = APIRouter()
 api_router.include_router(upgrade_router)
@@ -14,4 +20,10 @@ api_router.include_router(optimize_router)
 api_router.include_router(k8s_deploy_router)
 api_router.include_router(correct_router)
 api_router.include_router(detect_router)
+api_router.include_router(cache_router)
+api_router.include_router(scheduler_router)
+api_router.include_router(batch_router)
+api_router.include_router(tokens_router)
+api_router.include_router(metrics_router)
+api_router.include_router(traces_router)
 
@@ -0,0 +1,114 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from typing import Optional, List, Literal
+from api.routes.convert import CodeConvertRequest, run_conversion
+from api.routes.optimize import CodeOptimizeRequest, run_optimization
+from api.routes.upgrade import CodeUpgradeRequest, run_upgrade
+from api.routes.correct import CodeCorrectRequest, run_correction
+from api.routes.detect import CodeDetectRequest, run_detection
+from utils.tokens import TokenUsage, token_usage, policy_for_path
+import asyncio
+import json
+import os
+import time
+
+router = APIRouter()
+
+# operation -> (request model, 對應 route 的處理函數)；operation 名稱與 route 路徑相同 (/convert ...)
+OPERATIONS = {
+    "convert": (CodeConvertRequest, run_conversion),
+    "optimize": (CodeOptimizeRequest, run_optimization),
+    "upgrade": (CodeUpgradeRequest, run_upgrade),
+    "correct": (CodeCorrectRequest, run_correction),
+    "detect": (CodeDetectRequest, run_detection),
+}
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+
+
+class BatchItem(BaseModel):
+    operation: Literal["convert", "optimize", "upgrade", "correct", "detect"]
+    code: str
+    # 不填則使用該 route 的預設 prompt
+    prompt: Optional[str] = None
+    # 呼叫端自訂的識別字 (例如檔名)，原樣放回結果
+    id: Optional[str] = None
+
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    concurrency: Optional[int] = None
+
+
+async def run_item(item: BatchItem):
+    """
+    執行一個項目 (在自己的 task 中呼叫)
+
+    每個項目有自己的 token 用量與預算，並使用對應 route 的壓縮設定
+    (例如 detect 保留註解)，與單獨呼叫該 route 的行為相同
+    """
+    token_usage.set(TokenUsage("/batch", policy_for_path(f"/{item.operation}")))
+    model, run = OPERATIONS[item.operation]
+    fields = {"code": item.code}
+    if item.prompt is not None:
+        fields["prompt"] = item.prompt
+    return await run(model(**fields))
+
+
+async def batch_results(items: List[BatchItem], concurrency: int):
+    """
+    以最多 concurrency 個並行執行所有項目，依完成順序產生 NDJSON 行
+
+    每一行:
+        {"index": int, "id": str | null, "operation": str, "status": "ok" | "error",
+         "elapsed": float, "result": {...}} 或 {..., "error": str}
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def guarded(index: int, item: BatchItem):
+        async with semaphore:
+            start = time.perf_counter()
+            line = {"index": index, "id": item.id, "operation": item.operation}
+            try:
+                result = await run_item(item)
+                line.update(status="ok", result=result.model_dump())
+            except Exception as e:
+                # 單一項目失敗只影響自己那一行
+                detail = e.detail if isinstance(e, HTTPException) else str(e)
+                line.update(status="error", error=detail)
+            line["elapsed"] = round(time.perf_counter() - start, 3)
+            return line
+
+    tasks = [asyncio.ensure_future(guarded(i, item)) for i, item in enumerate(items)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            line = await next_done
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+    finally:
+        # client 中途斷線時取消還沒跑完的項目
+        for task in tasks:
+            task.cancel()
+
+
+@router.post("/batch")
+async def batch_endpoint(request: BatchRequest):
+    """
+    一次送出多個 convert / optimize / upgrade / correct / detect 項目，
+    結果以 NDJSON (application/x-ndjson) 依完成順序串流回傳
+    """
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many items: {len(request.items)} (max {BATCH_MAX_ITEMS})",
+        )
+    concurrency = request.concurrency or BATCH_CONCURRENCY
+    concurrency = max(1, min(concurrency, BATCH_MAX_CONCURRENCY))
+
+    return StreamingResponse(
+        batch_results(request.items, concurrency),
+        media_type="application/x-ndjson",
+        headers={"X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,31 @@
+from fastapi import APIRouter
+import asyncio
+from utils.cache import get_response_cache, get_execution_cache
+from utils.chat import reset_runtime_versions
+
+router = APIRouter()
+
+
+@router.get("/cache/stats")
+async def cache_stats():
+    """LLM 回應快取與執行結果快取的命中率與容量統計"""
+    # stats() 會對 SQLite 做 COUNT(*)，在 thread 中執行
+    return {
+        **await asyncio.to_thread(get_response_cache().stats),
+        "execution": get_execution_cache().stats(),
+    }
+
+
+@router.delete("/cache")
+async def clear_cache():
+    """清空 LLM 回應快取 (記憶體與 SQLite)"""
+    await asyncio.to_thread(get_response_cache().clear)
+    return {"status": "cleared"}
+
+
+@router.delete("/cache/execution")
+async def clear_execution_cache():
+    """清空執行結果快取並重新偵測 runtime 版本 (升級 python / JDK 後呼叫)"""
+    get_execution_cache().clear()
+    reset_runtime_versions()
+    return {"status": "cleared"}
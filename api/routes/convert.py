@@ -1,9 +1,16 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from utils.chat import chat
+from utils.chat import achat
+from utils.streaming import run_graph, sse_response
+from utils.graphs import register_graph, get_graph
+from utils.metrics import timed_node
+from utils.lang_detect import classify_language
+from utils.tokens import TokenBudgetExceeded
 import json
+import os
+import re
 from enum import Enum
-from typing import Dict, Any, TypedDict
+from typing import Dict, Any, TypedDict, Optional, Tuple
 from langgraph.graph import StateGraph
 
 router = APIRouter()
@@ -70,6 +77,93 @@ class ProgrammingLanguage(str, Enum):
     FORTRAN = "fortran"
 
 
+# 提示詞中常見的別名 -> ProgrammingLanguage (enum 本身的值也會自動加入)
+LANGUAGE_ALIASES = {
+    "js": ProgrammingLanguage.JAVASCRIPT,
+    "ecmascript": ProgrammingLanguage.JAVASCRIPT,
+    "ts": ProgrammingLanguage.TYPESCRIPT,
+    "py": ProgrammingLanguage.PYTHON,
+    "python3": ProgrammingLanguage.PYTHON,
+    "c#": ProgrammingLanguage.CSHARP,
+    "c sharp": ProgrammingLanguage.CSHARP,
+    "golang": ProgrammingLanguage.GO,
+    "node": ProgrammingLanguage.NODE,
+    "node.js": ProgrammingLanguage.NODE,
+    "c++": ProgrammingLanguage.CPP,
+    "cplusplus": ProgrammingLanguage.CPP,
+    "kt": ProgrammingLanguage.KOTLIN,
+    "rb": ProgrammingLanguage.RUBY,
+    "react native": ProgrammingLanguage.REACT_NATIVE,
+    "asm": ProgrammingLanguage.ASSEMBLY,
+    "pl/sql": ProgrammingLanguage.PLSQL,
+    "mongo": ProgrammingLanguage.MONGODB,
+    "shell": ProgrammingLanguage.BASH,
+    "sh": ProgrammingLanguage.BASH,
+    "k8s": ProgrammingLanguage.KUBERNETES,
+    "dockerfile": ProgrammingLanguage.DOCKER,
+}
+for _lang in ProgrammingLanguage:
+    LANGUAGE_ALIASES.setdefault(_lang.value, _lang)
+    LANGUAGE_ALIASES.setdefault(_lang.value.replace("_", " "), _lang)
+
+# 也是常見英文單字的語言名稱，後面必須接句尾或 code / language 等字才算數
+AMBIGUOUS_ALIASES = {"go", "c", "r", "sh", "ts", "js", "py", "rb", "kt", "node", "shell", "swift", "rust", "dart"}
+
+
+def _alias_pattern() -> str:
+    parts = []
+    # 長的別名先比對，避免 "c++" 被當成 "c"
+    for alias in sorted(LANGUAGE_ALIASES, key=len, reverse=True):
+        part = re.escape(alias).replace(r"\ ", r"\s+")
+        if alias in AMBIGUOUS_ALIASES:
+            part += r"(?=\s*(?:$|[.,;:!?)]|(?:code|language|lang|program|version|script)\b|\d))"
+        parts.append(part)
+    # 不用 \b，因為 "c++" / "c#" 結尾不是 word 字元
+    return r"(?<![\w+#/.])(" + "|".join(parts) + r")(?![\w+#/])"
+
+
+LANGUAGE = _alias_pattern()
+# "to / into X" 比 "in / as X" 可靠 ("written in Python, convert to Java")，依序嘗試
+TARGET_PATTERNS = [
+    re.compile(r"\b(?:to|into)\s+(?:the\s+)?(?:idiomatic\s+|modern\s+)?" + LANGUAGE, re.I),
+    re.compile(r"\b(?:in|as)\s+(?:idiomatic\s+|modern\s+)?" + LANGUAGE, re.I),
+]
+SOURCE_PATTERN = re.compile(r"\bfrom\s+(?:the\s+)?" + LANGUAGE, re.I)
+
+
+def resolve_language(name: str) -> Optional[ProgrammingLanguage]:
+    """把語言名稱或別名 (例如 "C#"、"golang"、"c++") 轉成 ProgrammingLanguage"""
+    return LANGUAGE_ALIASES.get(re.sub(r"\s+", " ", name.strip().lower()))
+
+
+def resolve_languages(prompt: str, code: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    不呼叫 LLM，從 prompt 找出目標語言 ("to Java"、"into C#")，
+    來源語言優先看 prompt 的 "from X"，否則由程式碼判斷
+
+    Returns:
+        (source_language, target_language)，判斷不出來的為 None
+    """
+    target = None
+    for pattern in TARGET_PATTERNS:
+        match = pattern.search(prompt)
+        if match:
+            target = resolve_language(match.group(1))
+            break
+
+    source = SOURCE_PATTERN.search(prompt)
+    source = resolve_language(source.group(1)) if source else None
+    if source is None:
+        language, confidence = classify_language(code)
+        if language != "unknown" and confidence >= float(os.getenv("LANG_DETECT_THRESHOLD", "0.6")):
+            source = ProgrammingLanguage(language)
+
+    return (
+        source.value if source else None,
+        target.value if target else None,
+    )
+
+
 class CodeConvertRequest(BaseModel):
     code: str = "print('string')"
     prompt: str = "Convert the code to Java."
@@ -88,7 +182,22 @@ class ConversionState(TypedDict):
     result: Dict[str, Any]
 
 
-def extract_languages(state: ConversionState) -> ConversionState:
+async def resolve_languages_locally(state: ConversionState) -> ConversionState:
+    """Resolve source and target languages from the prompt and code without the LLM"""
+    source, target = resolve_languages(state["prompt"], state["code"])
+    state["source_language"] = source or ""
+    state["target_language"] = target or ""
+    return state
+
+
+def route_after_resolve(state: ConversionState) -> str:
+    # 兩個語言都判斷出來才跳過 extract_languages 的 LLM 呼叫
+    if state["source_language"] and state["target_language"]:
+        return "convert_code"
+    return "extract_languages"
+
+
+async def extract_languages(state: ConversionState) -> ConversionState:
     """Extract source and target languages from the prompt"""
     prompt = f"""
     Analyze the following prompt and identify the source and target programming languages.
@@ -104,7 +213,7 @@ def extract_languages(state: ConversionState) -> ConversionState:
     ```
     """
 
-    response = chat(
+    response = await achat(
         prompt=prompt,
         temperature=0,
         response_format={
@@ -135,7 +244,7 @@ def extract_languages(state: ConversionState) -> ConversionState:
     return state
 
 
-def convert_code(state: ConversionState) -> ConversionState:
+async def convert_code(state: ConversionState) -> ConversionState:
     """Convert the code using the extracted languages"""
     full_prompt = f"""
     {"if java code then need 'public static void main' make it a runable class." if state["source_language"] == "java" else ""}
@@ -154,7 +263,7 @@ def convert_code(state: ConversionState) -> ConversionState:
     4️⃣ Provide any language-specific considerations or modifications
     """
 
-    response = chat(
+    response = await achat(
         prompt=full_prompt,
         temperature=0.3,
         response_format={
@@ -186,12 +295,18 @@ def build_chain():
     workflow = StateGraph(ConversionState)
 
     # Add nodes
-    workflow.add_node("extract_languages", extract_languages)
-    workflow.add_node("convert_code", convert_code)
+    workflow.add_node("resolve_languages", timed_node("convert", "resolve_languages", resolve_languages_locally))
+    workflow.add_node("extract_languages", timed_node("convert", "extract_languages", extract_languages))
+    workflow.add_node("convert_code", timed_node("convert", "convert_code", convert_code))
 
     # Add edges
+    workflow.add_conditional_edges(
+        "resolve_languages",
+        route_after_resolve,
+        {"convert_code": "convert_code", "extract_languages": "extract_languages"},
+    )
     workflow.add_edge("extract_languages", "convert_code")
-    workflow.set_entry_point("extract_languages")
+    workflow.set_entry_point("resolve_languages")
     workflow.set_finish_point("convert_code")
 
     # Compile the graph
@@ -200,31 +315,50 @@ def build_chain():
     return chain
 
 
+register_graph("convert", build_chain)
+
+
+async def run_conversion(request: CodeConvertRequest) -> CodeConvertResponse:
+    """執行轉換流程 (/convert 與 /convert/stream 共用)"""
+    # Initialize the state
+    initial_state = ConversionState(
+        code=request.code,
+        prompt=request.prompt,
+        source_language="",
+        target_language="",
+        result={},
+    )
+
+    chain = get_graph("convert")
+
+    # Execute the chain
+    final_state = await run_graph(chain, initial_state)
+
+    # Return the result
+    return CodeConvertResponse(
+        code=final_state["result"]["code"],
+        target_language=final_state["target_language"],
+    )
+
+
 @router.post("/convert", response_model=CodeConvertResponse)
 async def convert_code_endpoint(request: CodeConvertRequest):
     """
     Convert code from one programming language to another based on the prompt
     """
     try:
-        # Initialize the state
-        initial_state = ConversionState(
-            code=request.code,
-            prompt=request.prompt,
-            source_language="",
-            target_language="",
-            result={},
-        )
-
-        chain = build_chain()
-
-        # Execute the chain
-        final_state = chain.invoke(initial_state)
-
-        # Return the result
-        return CodeConvertResponse(
-            code=final_state["result"]["code"],
-            target_language=final_state["target_language"],
-        )
+        return await run_conversion(request)
 
+    except TokenBudgetExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Code conversion failed: {str(e)}")
+
+
+@router.post("/convert/stream")
+async def convert_code_stream_endpoint(request: CodeConvertRequest):
+    """
+    Same as /convert, but streams progress as Server-Sent Events
+    (start / token / node / execution / result / error)
+    """
+    return sse_response(lambda: run_conversion(request))
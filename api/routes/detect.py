@@ -1,11 +1,20 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from utils.chat import chat
+from utils.chat import achat
+from utils.lang_detect import classify_language
+from utils.static_analysis import analyze
+from utils.chunking import Chunk, split_code
+from utils.tokens import TokenBudgetExceeded
+import asyncio
 import json
-from typing import List, Literal
+import os
+from typing import List, Literal, Dict, Any
 
 router = APIRouter()
 
+# 超過這個行數的檔案切塊分析
+DETECT_CHUNK_LINES = int(os.getenv("DETECT_CHUNK_LINES", "200"))
+
 
 class CodeDetectRequest(BaseModel):
     code: str
@@ -15,7 +24,8 @@ class CodeDetectRequest(BaseModel):
 class CodeIssue(BaseModel):
     start_line: int
     end_line: int
-    tag: Literal["error", "optimize"]
+    # warning 只來自編譯器的 lint 警告 (靜態分析)，LLM 只回報 error / optimize
+    tag: Literal["error", "optimize", "warning"]
     description: str
 
 
@@ -23,80 +33,200 @@ class CodeDetectResponse(BaseModel):
     issues: List[CodeIssue]
 
 
-@router.post("/detect", response_model=CodeDetectResponse)
-async def detect(request: CodeDetectRequest):
+# (類別, 給 LLM 的檢查項目)；靜態分析已完整檢查過的類別不再交給 LLM
+CHECKS = [
+    ("syntax", "Syntax errors"),
+    ("compilation", "Compilation errors"),
+    ("runtime", "Runtime errors"),
+    ("logical", "Logical errors"),
+    ("performance", "Performance optimization opportunities"),
+]
+
+
+def number_lines(code: str, first_line: int = 1) -> str:
+    """每行前面加上 (絕對) 行號，讓 LLM 回報的行號對得上"""
+    lines = code.splitlines()
+    width = len(str(first_line + len(lines) - 1))
+    return "\n".join(
+        f"{number:>{width}} | {line}" for number, line in enumerate(lines, first_line)
+    )
+
+
+def merge_issues(static_issues: List[Dict[str, Any]], llm_issues: List[Dict[str, Any]], line_count: int):
     """
-    Detect code issues and optimization opportunities
+    合併靜態分析與 LLM 的結果: LLM 行號限制在檔案範圍內，
+    與靜態分析同一行同一類的重複項目丟掉，最後依行號排序
     """
-    try:
-        prompt = f"""
-        Analyze the following code and identify lines that need improvement or contain errors:
-        ```
-        {request.code}        ```
-
-        {request.prompt}
-
-        Check for:
-        1. Syntax errors
-        2. Compilation errors
-        3. Runtime errors
-        4. Logical errors
-        5. Performance optimization opportunities
-
-        Return a JSON array containing:
-        [
-            {{
-                "start_line": <starting line number>,
-                "end_line": <ending line number>,
-                "tag": "error" or "optimize",
-                "description": "Issue description"
-            }}
-        ]
-
-        Be specific about line numbers and provide clear descriptions.
-        For each issue, indicate whether it's an error or optimization opportunity.
-        """
-
-        response = chat(
-            prompt=prompt,
-            temperature=0,
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "CodeDetectResponse",
-                    "schema": {
+    seen = {(issue["start_line"], issue["tag"]) for issue in static_issues}
+    merged = list(static_issues)
+    for issue in llm_issues:
+        start = min(max(1, int(issue["start_line"])), max(1, line_count))
+        end = min(max(start, int(issue["end_line"])), max(1, line_count))
+        if (start, issue["tag"]) in seen:
+            continue
+        seen.add((start, issue["tag"]))
+        merged.append({**issue, "start_line": start, "end_line": end})
+    return sorted(merged, key=lambda issue: (issue["start_line"], issue["end_line"]))
+
+
+DETECT_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "CodeDetectResponse",
+        "schema": {
+            "type": "object",
+            "properties": {
+                "issues": {
+                    "type": "array",
+                    "items": {
                         "type": "object",
                         "properties": {
-                            "issues": {
-                                "type": "array",
-                                "items": {
-                                    "type": "object",
-                                    "properties": {
-                                        "start_line": {"type": "integer"},
-                                        "end_line": {"type": "integer"},
-                                        "tag": {
-                                            "type": "string",
-                                            "enum": ["error", "optimize"],
-                                        },
-                                        "description": {"type": "string"},
-                                    },
-                                    "required": [
-                                        "start_line",
-                                        "end_line",
-                                        "tag",
-                                        "description",
-                                    ],
-                                },
-                            }
+                            "start_line": {"type": "integer"},
+                            "end_line": {"type": "integer"},
+                            "tag": {
+                                "type": "string",
+                                "enum": ["error", "optimize"],
+                            },
+                            "description": {"type": "string"},
                         },
+                        "required": [
+                            "start_line",
+                            "end_line",
+                            "tag",
+                            "description",
+                        ],
                     },
-                },
+                }
             },
+        },
+    },
+}
+
+
+async def detect_chunk(
+    request: CodeDetectRequest, chunk: Chunk, header: str, static: Dict[str, Any]
+) -> List[Dict[str, Any]]:
+    """
+    用 LLM 分析檔案的其中一塊，回傳的行號已換算成整個檔案的絕對行號
+
+    Args:
+        chunk (Chunk): 要分析的區塊 (整個檔案時就是唯一的一塊)
+        header (str): 檔案其他部分的 import 與簽名 (只當脈絡，不分析)
+        static (Dict[str, Any]): analyze() 的結果
+    """
+    checks = "\n    ".join(
+        f"{number}. {text}"
+        for number, text in enumerate(
+            [text for key, text in CHECKS if key not in static["checked"]], 1
         )
+    )
+    known = "\n    ".join(
+        f"- lines {issue['start_line']}-{issue['end_line']} ({issue['tag']}): {issue['description']}"
+        for issue in static["issues"]
+        if chunk.start_line <= issue["start_line"] <= chunk.end_line
+    ) or "(none)"
+    context = (
+        f"""
+    This is lines {chunk.start_line}-{chunk.end_line} of a larger file. Imports and signatures
+    from the rest of the file, for reference only (do not report issues in them):
+    ```
+    {header}
+    ```
+    """
+        if header
+        else ""
+    )
+
+    prompt = f"""
+    Analyze the following code and identify lines that need improvement or contain errors.
+    Every line is prefixed with its line number and " | "; use these numbers in your answer.
+    ```
+    {number_lines(chunk.text, chunk.start_line)}
+    ```
+    {context}
+    {request.prompt}
+
+    Check for:
+    {checks}
+
+    These issues were already found by static analysis; do not report them again:
+    {known}
+
+    Return a JSON array containing:
+    [
+        {{
+            "start_line": <starting line number>,
+            "end_line": <ending line number>,
+            "tag": "error" or "optimize",
+            "description": "Issue description"
+        }}
+    ]
+
+    Be specific about line numbers and provide clear descriptions.
+    For each issue, indicate whether it's an error or optimization opportunity.
+    """
+
+    response = await achat(
+        prompt=prompt,
+        temperature=0,
+        response_format=DETECT_RESPONSE_FORMAT,
+    )
+
+    issues = []
+    for issue in json.loads(response).get("issues", []):
+        start, end = int(issue["start_line"]), int(issue["end_line"])
+        if start < chunk.start_line:
+            # LLM 偶爾回報區塊內的相對行號，換回絕對行號
+            start += chunk.start_line - 1
+            end += chunk.start_line - 1
+        start = min(max(start, chunk.start_line), chunk.end_line)
+        end = min(max(end, start), chunk.end_line)
+        issues.append({**issue, "start_line": start, "end_line": end})
+    return issues
+
+
+async def run_detection(request: CodeDetectRequest) -> CodeDetectResponse:
+    """執行問題偵測 (/detect 與 /batch 共用)"""
+    # 只用本地判斷語言 (不多花一次 LLM)，不確定時跳過靜態分析
+    language, confidence = classify_language(request.code)
+    if confidence < float(os.getenv("LANG_DETECT_THRESHOLD", "0.6")):
+        language = "unknown"
+    static = await analyze(request.code, language)
+
+    # 大檔案依函數 / class 邊界切塊平行分析，延遲取決於最大的一塊而不是整個檔案
+    line_count = len(request.code.splitlines())
+    if line_count > DETECT_CHUNK_LINES:
+        header, chunks = split_code(request.code, language, DETECT_CHUNK_LINES)
+    else:
+        header, chunks = "", [Chunk(1, max(1, line_count), request.code)]
+
+    results = await asyncio.gather(
+        *(detect_chunk(request, chunk, header, static) for chunk in chunks),
+        return_exceptions=True,
+    )
+    failures = [result for result in results if isinstance(result, BaseException)]
+    if len(failures) == len(results):
+        raise failures[0]
+    for failure in failures:
+        print(f"Chunk detection failed: {failure}")
+
+    llm_issues = [
+        issue for result in results if not isinstance(result, BaseException) for issue in result
+    ]
+    issues = merge_issues(static["issues"], llm_issues, line_count)
+    print(issues)
+    return CodeDetectResponse(issues=issues)
+
 
-        result = json.loads(response)
-        print(result["issues"])
-        return CodeDetectResponse(issues=result["issues"])
+@router.post("/detect", response_model=CodeDetectResponse)
+async def detect(request: CodeDetectRequest):
+    """
+    Detect code issues and optimization opportunities
+    """
+    try:
+        return await run_detection(request)
 
+    except TokenBudgetExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Code detection failed: {str(e)}")
@@ -1,11 +1,11 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from typing import Literal
-import json
-from utils.k8s.job import create_configmap_from_file, deploy_job, delete_configmap, load_kube_config
-import random
-import os
+from typing import Literal, Optional
+import asyncio
+from utils.k8s.job import get_job_manager, K8S_JOB_TIMEOUT
+from utils.k8s.resources import ResourceLimits, resolve_limits
 from utils.chat import detect_code_language
+from utils.streaming import sse, sse_stream
 
 router = APIRouter()
 
@@ -13,38 +13,157 @@ router = APIRouter()
 class K8sRequest(BaseModel):
     code: str
     language: Literal["python3", "java21"] = None
+    # 資源限制，不給時使用伺服器預設值；超過伺服器上限回傳 400
+    cpu: Optional[str] = None  # e.g. "500m"
+    memory: Optional[str] = None  # e.g. "256Mi"
+    timeout: Optional[float] = None  # 程式本身的執行秒數上限
+
+class K8sMetrics(BaseModel):
+    """容器內由 cgroup 量測的資源使用量 (記憶體峰值為整個容器，Java 包含 javac)"""
+    wall_time: Optional[float] = None  # 秒
+    cpu_time: Optional[float] = None  # 秒
+    peak_memory_kb: Optional[int] = None  # 重複使用的 runner pod 無法單獨量測，為 None
+    exit_code: Optional[int] = None
+    timed_out: bool = False
 
 class K8sResponse(BaseModel):
     status: str
     log: str
     description: str
+    metrics: Optional[K8sMetrics] = None
 
-@router.post("/k8s", response_model=K8sResponse)
-def run_code(request: K8sRequest):
-    """Runs user-provided code in a Kubernetes job and fetches logs."""
-
-    if not request.language:
-        detected_language = detect_code_language(request.code)
-        if detected_language.startswith("python"):
-            request.language = "python3"
-        elif detected_language.startswith("java"):
-            request.language = "java21"
-        else:
-            raise HTTPException(status_code=400, detail="Language not supported")
-
-    load_kube_config()
-    configmap_name = f"configmap-{random.randint(1, 1000000000)}"
-    
+class K8sJobStatus(BaseModel):
+    id: str
+    language: str
+    status: str  # Submitted / Pending / Running / Succeeded / Failed / Error
+    backend: Optional[str] = None  # local / k8s，開始執行前為 None
+    pod: Optional[str] = None
+    finished: bool
+    exit_code: Optional[int] = None
+    error: Optional[str] = None
+    created_at: float
+    finished_at: Optional[float] = None
+    limits: Optional[dict] = None
+    metrics: Optional[K8sMetrics] = None
+
+class K8sJobResult(K8sJobStatus):
+    log: Optional[str] = None
+
+
+async def resolve_language(request: K8sRequest) -> str:
+    if request.language:
+        return request.language
+    detected_language = await detect_code_language(request.code)
+    if detected_language.startswith("python"):
+        return "python3"
+    if detected_language.startswith("java"):
+        return "java21"
+    raise HTTPException(status_code=400, detail="Language not supported")
+
+
+def resolve_request_limits(request: K8sRequest) -> ResourceLimits:
     try:
-        filename = create_configmap_from_file(configmap_name, request.code, request.language)
+        return resolve_limits(request.cpu, request.memory, request.timeout)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def find_job(job_id: str):
+    job = get_job_manager().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+def log_stream_response(job):
+    """把 job 的狀態與 log 以 Server-Sent Events 送出，最後一個事件為 result"""
+    async def events():
+        async for event, data in job.events():
+            yield sse(event, data)
+
+    return sse_stream(events())
+
+
+@router.post("/k8s", response_model=K8sResponse)
+async def run_code(request: K8sRequest):
+    """
+    Runs user-provided code in a Kubernetes job and fetches logs.
+
+    小的程式可能直接在本機 sandbox 執行 (見 EXECUTION_BACKEND)，回傳格式相同
+    """
+    limits = resolve_request_limits(request)
+    language = await resolve_language(request)
+
+    # pod 的狀態由 watch 事件推進，等待期間不佔 threadpool
+    job = await get_job_manager().run(request.code, language, limits)
+    if job.status == "Error":
+        raise HTTPException(status_code=500, detail=f"Job failed: {job.error}")
+
+    return K8sResponse(
+        status=job.status, log=job.log, description=f"Job executed with status: {job.status}", metrics=job.metrics
+    )
+
+
+@router.get("/k8s/pool/stats")
+async def pool_stats():
+    """runner pod pool 各語言的閒置 / 執行中 / 啟動中 pod 數、排隊數與改走 Job 的次數"""
+    return {language: pool.stats() for language, pool in get_job_manager().pools.items()}
+
+
+@router.get("/k8s/gc/stats")
+async def gc_stats():
+    """reaper 執行次數與累計刪除的 Job / ConfigMap / pod 數"""
+    return get_job_manager().reaper.stats()
+
+
+@router.post("/k8s/jobs", response_model=K8sJobStatus, status_code=202)
+async def submit_job(request: K8sRequest):
+    """
+    非同步版的 /k8s: 立即回傳 job ID，
+    之後以 GET /k8s/jobs/{id} 查狀態、GET /k8s/jobs/{id}/result 取結果
+    """
+    limits = resolve_request_limits(request)
+    language = await resolve_language(request)
+    return get_job_manager().submit(request.code, language, limits).to_dict()
+
+
+@router.post("/k8s/stream")
+async def run_code_stream(request: K8sRequest):
+    """
+    Same as /k8s, but streams the program output as Server-Sent Events while it runs
+
+    事件: status (pod phase)、log (輸出片段)、result (最後的 phase 與 exit_code)
+    """
+    limits = resolve_request_limits(request)
+    language = await resolve_language(request)
+    return log_stream_response(get_job_manager().submit(request.code, language, limits))
+
+
+@router.get("/k8s/jobs/{job_id}/logs")
+async def job_logs(job_id: str):
+    """以 Server-Sent Events 跟著讀 job 的 log (先送出已產生的部分)，job 結束時送出 result"""
+    return log_stream_response(find_job(job_id))
+
+
+@router.get("/k8s/jobs/{job_id}", response_model=K8sJobStatus)
+async def job_status(job_id: str):
+    return find_job(job_id).to_dict()
 
 
-        base_dir = os.path.dirname(os.path.abspath(__file__))  # Get current file's directory
-        yaml_file = os.path.join(base_dir, "../../utils/k8s", 
-                         "python3-job.yaml" if request.language == "python3" else "java21-job.yaml")
+@router.get("/k8s/jobs/{job_id}/result", response_model=K8sJobResult)
+async def job_result(job_id: str, wait: float = 0):
+    """
+    取得 job 的執行結果
 
-        logs, status = deploy_job(yaml_file, configmap_name, filename, request.language) 
-    finally:
-        delete_configmap(configmap_name)
-    
-    return K8sResponse(status=status, log=logs, description=f"Job executed with status: {status}")
+    Args:
+        wait (float): job 還沒結束時最多等待的秒數，0 代表不等；仍未結束回傳 409
+    """
+    job = find_job(job_id)
+    if not job.finished and wait > 0:
+        try:
+            await asyncio.wait_for(job.done.wait(), min(wait, K8S_JOB_TIMEOUT))
+        except asyncio.TimeoutError:
+            pass
+    if not job.finished:
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is still {job.status}")
+    return {**job.to_dict(), "log": job.log}
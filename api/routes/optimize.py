@@ -1,17 +1,32 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from utils.chat import chat
+from utils.chat import achat, detect_code_language
+from utils.benchmark import compare, tournament, BenchmarkError
+from utils.streaming import run_graph, sse_response, event_tags
+from utils.graphs import register_graph, get_graph
+from utils.metrics import timed_node
+from utils.tokens import TokenBudgetExceeded
+import asyncio
 import json
-from typing import Dict, Any, TypedDict, List
-from langgraph.graph import StateGraph
+import os
+from typing import Dict, Any, TypedDict, List, Optional, Literal
+from langgraph.graph import StateGraph, END
 
 
 router = APIRouter()
 
+OPTIMIZE_MAX_CANDIDATES = int(os.getenv("OPTIMIZE_MAX_CANDIDATES", "5"))
+
 
 class CodeOptimizeRequest(BaseModel):
     code: str
     prompt: str = "Optimize the code for better performance."
+    # 在 sandbox 實際執行原始與優化後的程式碼並量測
+    benchmark: bool = False
+    benchmark_trials: int = 5
+    # 同時產生幾個候選，>1 時在 sandbox 比賽後回傳最好的
+    candidates: int = 1
+    rank_by: Literal["time", "memory"] = "time"
 
 
 class Complexity(BaseModel):
@@ -19,12 +34,81 @@ class Complexity(BaseModel):
     space: str
 
 
+class RunMetrics(BaseModel):
+    wall_time: float
+    cpu_time: Optional[float] = None
+    max_rss_kb: Optional[int] = None
+
+
+class BenchmarkResult(BaseModel):
+    language: Optional[str] = None
+    trials: int = 0
+    original: Optional[RunMetrics] = None
+    optimized: Optional[RunMetrics] = None
+    output_matches: Optional[bool] = None
+    speedup: Optional[float] = None
+    cpu_speedup: Optional[float] = None
+    memory_delta_kb: Optional[int] = None
+    error: Optional[str] = None
+
+
+class CandidateRanking(BaseModel):
+    index: int
+    status: Literal["ok", "output_mismatch", "failed"]
+    wall_time: Optional[float] = None
+    cpu_time: Optional[float] = None
+    max_rss_kb: Optional[int] = None
+    speedup: Optional[float] = None
+    memory_delta_kb: Optional[int] = None
+    error: Optional[str] = None
+
+
 class CodeOptimizeResponse(BaseModel):
     code: str
     original_complexity: Complexity
     optimized_complexity: Complexity
     improvements: List[str]
     potential_tradeoffs: List[str]
+    benchmark: Optional[BenchmarkResult] = None
+    # candidates > 1 時才有: 選中的候選編號與所有候選的排名
+    selected_candidate: Optional[int] = None
+    ranking: Optional[List[CandidateRanking]] = None
+    # ranked: 選出輸出正確且最好的候選；
+    # unverified: 原始程式碼無法量測，回傳第一個候選但未經驗證；
+    # no_valid_candidate: 所有候選都執行失敗或輸出不同，回傳第一個候選但 selected_candidate 為 null
+    selection_status: Optional[Literal["ranked", "unverified", "no_valid_candidate"]] = None
+
+
+OPTIMIZATION_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "CodeOptimizationResponse",
+        "schema": {
+            "type": "object",
+            "properties": {
+                "code": {
+                    "type": "string",
+                    "description": "The optimized code",
+                },
+                "new_complexity": {
+                    "type": "object",
+                    "properties": {
+                        "time": {"type": "string"},
+                        "space": {"type": "string"},
+                    },
+                },
+                "improvements": {"type": "array", "items": {"type": "string"}},
+                "tradeoffs": {"type": "array", "items": {"type": "string"}},
+            },
+            "required": [
+                "code",
+                "new_complexity",
+                "improvements",
+                "tradeoffs",
+            ],
+        },
+    },
+}
 
 
 class OptimizationState(TypedDict):
@@ -32,9 +116,18 @@ class OptimizationState(TypedDict):
     prompt: str
     result: Dict[str, Any]
     complexity_analysis: Dict[str, Any]
-
-
-def analyze_complexity(state: OptimizationState) -> OptimizationState:
+    benchmark: bool
+    benchmark_trials: int
+    benchmark_result: Dict[str, Any]
+    candidates: int
+    rank_by: str
+    candidate_results: List[Dict[str, Any]]
+    ranking: List[Dict[str, Any]]
+    selected_candidate: Optional[int]
+    selection_status: Optional[str]
+
+
+async def analyze_complexity(state: OptimizationState) -> OptimizationState:
     """Analyze the time and space complexity of the code"""
     prompt = f"""
     Analyze the following code and determine its time and space complexity:
@@ -48,7 +141,7 @@ def analyze_complexity(state: OptimizationState) -> OptimizationState:
     2. Current space complexity
     """
 
-    response = chat(
+    response = await achat(
         prompt=prompt,
         temperature=0,
         response_format={
@@ -80,7 +173,7 @@ def analyze_complexity(state: OptimizationState) -> OptimizationState:
     return state
 
 
-def optimize_code(state: OptimizationState) -> OptimizationState:
+async def optimize_code(state: OptimizationState) -> OptimizationState:
     """Optimize the code based on the analysis and requirements"""
     full_prompt = f"""
     Please optimize the following code focusing on "time" and "memory" space optimization:
@@ -112,92 +205,196 @@ def optimize_code(state: OptimizationState) -> OptimizationState:
     5. Potential tradeoffs
     """
 
-    response = chat(
-        prompt=full_prompt,
-        temperature=0.3,
-        response_format={
-            "type": "json_schema",
-            "json_schema": {
-                "name": "CodeOptimizationResponse",
-                "schema": {
-                    "type": "object",
-                    "properties": {
-                        "code": {
-                            "type": "string",
-                            "description": "The optimized code",
-                        },
-                        "new_complexity": {
-                            "type": "object",
-                            "properties": {
-                                "time": {"type": "string"},
-                                "space": {"type": "string"},
-                            },
-                        },
-                        "improvements": {"type": "array", "items": {"type": "string"}},
-                        "tradeoffs": {"type": "array", "items": {"type": "string"}},
-                    },
-                    "required": [
-                        "code",
-                        "new_complexity",
-                        "improvements",
-                        "tradeoffs",
-                    ],
-                },
-            },
-        },
-    )
+    count = max(1, min(state["candidates"], OPTIMIZE_MAX_CANDIDATES))
+
+    async def generate(i: int) -> str:
+        if count > 1:
+            # 串流時各候選的 token 交錯送出，標上編號讓 client 分開重組 (gather 讓每個候選在自己的 task)
+            event_tags.set({"candidate": i})
+        return await achat(
+            prompt=full_prompt,
+            temperature=min(1.0, 0.3 + 0.2 * i),
+            response_format=OPTIMIZATION_RESPONSE_FORMAT,
+            use_cache=i == 0,
+        )
+
+    # 多個候選同時產生；第一個與單一候選時相同 (可用快取)，其餘提高 temperature 以取得不同解法
+    responses = await asyncio.gather(*(generate(i) for i in range(count)), return_exceptions=True)
+    candidates = [candidate for candidate in map(parse_candidate, responses) if candidate is not None]
+    if not candidates:
+        errors = [r for r in responses if isinstance(r, BaseException)]
+        if errors:
+            raise errors[0]
+        raise ValueError("no optimization candidate contained code")
+
+    state["candidate_results"] = candidates
+    state["result"] = candidates[0]
+    return state
+
+
+def parse_candidate(response) -> Optional[Dict[str, Any]]:
+    """LLM 的回應轉成候選；失敗或沒有 code 的回應 (例如重試後仍不是 JSON) 回傳 None"""
+    if isinstance(response, BaseException):
+        return None
+    try:
+        candidate = json.loads(response)
+    except json.JSONDecodeError:
+        candidate = None
+    if not isinstance(candidate, dict) or not isinstance(candidate.get("code"), str):
+        print(f"Dropping malformed optimization candidate: {str(response)[:200]}")
+        return None
+    return candidate
+
+
+async def select_candidate(state: OptimizationState) -> OptimizationState:
+    """Run every candidate in the sandbox and keep the fastest one with the original output"""
+    language = await detect_code_language(state["code"])
+    candidates = state["candidate_results"]
+    try:
+        ranking = await tournament(
+            state["code"],
+            [candidate["code"] for candidate in candidates],
+            language,
+            state["benchmark_trials"],
+            state["rank_by"],
+        )
+    except BenchmarkError as e:
+        # 原始程式碼無法量測，無從比較，保留第一個候選
+        state["ranking"] = [
+            {"index": i, "status": "failed", "error": f"original code: {e}"}
+            for i in range(len(candidates))
+        ]
+        state["selected_candidate"] = 0
+        state["selection_status"] = "unverified"
+        return state
+
+    state["ranking"] = ranking
+    if ranking[0]["status"] == "ok":
+        state["result"] = candidates[ranking[0]["index"]]
+        state["selected_candidate"] = ranking[0]["index"]
+        state["selection_status"] = "ranked"
+    else:
+        # 沒有候選通過，不把第一個候選當成選出的結果
+        state["selected_candidate"] = None
+        state["selection_status"] = "no_valid_candidate"
+    return state
 
-    state["result"] = json.loads(response)
+
+async def benchmark_code(state: OptimizationState) -> OptimizationState:
+    """Run the original and optimized code in the sandbox and measure both"""
+    language = await detect_code_language(state["code"])
+    try:
+        state["benchmark_result"] = await compare(
+            state["code"], state["result"]["code"], language, state["benchmark_trials"]
+        )
+    except BenchmarkError as e:
+        # 量測失敗不影響優化結果，只在 benchmark 欄位回報原因
+        state["benchmark_result"] = {"language": language, "error": str(e)}
     return state
 
 
+def route_after_optimize(state: OptimizationState) -> str:
+    if len(state["candidate_results"]) > 1:
+        return "select_candidate"
+    return route_after_select(state)
+
+
+def route_after_select(state: OptimizationState) -> str:
+    return "benchmark_code" if state.get("benchmark") else END
+
+
 def build_chain():
     # Create the optimization workflow
     workflow = StateGraph(OptimizationState)
 
     # Add nodes
-    workflow.add_node("analyze_complexity", analyze_complexity)
-    workflow.add_node("optimize_code", optimize_code)
+    workflow.add_node("analyze_complexity", timed_node("optimize", "analyze_complexity", analyze_complexity))
+    workflow.add_node("optimize_code", timed_node("optimize", "optimize_code", optimize_code))
+    workflow.add_node("select_candidate", timed_node("optimize", "select_candidate", select_candidate))
+    workflow.add_node("benchmark_code", timed_node("optimize", "benchmark_code", benchmark_code))
 
     # Add edges
     workflow.add_edge("analyze_complexity", "optimize_code")
+    workflow.add_conditional_edges(
+        "optimize_code",
+        route_after_optimize,
+        {"select_candidate": "select_candidate", "benchmark_code": "benchmark_code", END: END},
+    )
+    workflow.add_conditional_edges(
+        "select_candidate",
+        route_after_select,
+        {"benchmark_code": "benchmark_code", END: END},
+    )
     workflow.set_entry_point("analyze_complexity")
-    workflow.set_finish_point("optimize_code")
+    workflow.set_finish_point("benchmark_code")
 
     return workflow.compile()
 
 
+register_graph("optimize", build_chain)
+
+
+async def run_optimization(request: CodeOptimizeRequest) -> CodeOptimizeResponse:
+    """執行優化流程 (/optimize 與 /optimize/stream 共用)"""
+    # Initialize the state
+    initial_state = OptimizationState(
+        code=request.code,
+        prompt=request.prompt,
+        result={},
+        benchmark=request.benchmark,
+        benchmark_trials=request.benchmark_trials,
+        benchmark_result={},
+        candidates=request.candidates,
+        rank_by=request.rank_by,
+        candidate_results=[],
+        ranking=[],
+        selected_candidate=None,
+        selection_status=None,
+    )
+
+    # Execute the optimization chain
+    chain = get_graph("optimize")
+    final_state = await run_graph(chain, initial_state)
+
+    # Return the optimization results
+    return CodeOptimizeResponse(
+        code=final_state["result"]["code"],
+        original_complexity=Complexity(
+            time=final_state["complexity_analysis"]["time_complexity"],
+            space=final_state["complexity_analysis"]["space_complexity"],
+        ),
+        optimized_complexity=Complexity(
+            time=final_state["result"]["new_complexity"]["time"],
+            space=final_state["result"]["new_complexity"]["space"],
+        ),
+        improvements=final_state["result"]["improvements"],
+        potential_tradeoffs=final_state["result"]["tradeoffs"],
+        benchmark=final_state["benchmark_result"] or None,
+        selected_candidate=final_state["selected_candidate"],
+        ranking=final_state["ranking"] or None,
+        selection_status=final_state["selection_status"],
+    )
+
+
 @router.post("/optimize", response_model=CodeOptimizeResponse)
 async def optimize_code_endpoint(request: CodeOptimizeRequest):
     """
     優化程式碼的效能，考慮時間和空間複雜度
     """
     try:
-        # Initialize the state
-        initial_state = OptimizationState(
-            code=request.code, prompt=request.prompt, result={}
-        )
-
-        # Execute the optimization chain
-        chain = build_chain()
-        final_state = chain.invoke(initial_state)
-
-        # Return the optimization results
-        return CodeOptimizeResponse(
-            code=final_state["result"]["code"],
-            original_complexity=Complexity(
-                time=final_state["complexity_analysis"]["time_complexity"],
-                space=final_state["complexity_analysis"]["space_complexity"],
-            ),
-            optimized_complexity=Complexity(
-                time=final_state["result"]["new_complexity"]["time"],
-                space=final_state["result"]["new_complexity"]["space"],
-            ),
-            improvements=final_state["result"]["improvements"],
-            potential_tradeoffs=final_state["result"]["tradeoffs"],
-        )
+        return await run_optimization(request)
 
+    except TokenBudgetExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Code optimization failed: {str(e)}"
         )
+
+
+@router.post("/optimize/stream")
+async def optimize_code_stream_endpoint(request: CodeOptimizeRequest):
+    """
+    Same as /optimize, but streams progress as Server-Sent Events
+    """
+    return sse_response(lambda: run_optimization(request))
@@ -0,0 +1,10 @@
+from fastapi import APIRouter
+from utils.scheduler import get_scheduler
+
+router = APIRouter()
+
+
+@router.get("/scheduler/stats")
+async def scheduler_stats():
+    """LLM 排程器的排隊深度、重試與剩餘配額"""
+    return get_scheduler().stats()
@@ -0,0 +1,10 @@
+from fastapi import APIRouter
+from utils.tokens import get_token_metrics
+
+router = APIRouter()
+
+
+@router.get("/tokens/stats")
+async def token_stats():
+    """各 route 累計的 LLM token 用量、壓縮省下的 token 與預算拒絕次數"""
+    return get_token_metrics().stats()
@@ -0,0 +1,24 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+from typing import Literal
+from utils.tracing import get_trace_store
+
+router = APIRouter()
+
+
+@router.get("/traces/{trace_id}")
+async def get_trace(trace_id: str, format: Literal["json", "collapsed"] = "json"):
+    """
+    取得以 `X-Profile: 1` 或 `?profile=1` 記錄的請求 (ID 在回應的 X-Trace-Id header)
+
+    Args:
+        format (str): json 為 span 樹與取樣結果；collapsed 為 flamegraph 用的 collapsed stack
+    """
+    trace = get_trace_store().get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail=f"Trace {trace_id} not found")
+    if format == "collapsed":
+        if trace.profiler is None:
+            raise HTTPException(status_code=404, detail=f"Trace {trace_id} has no profile samples")
+        return PlainTextResponse(trace.profiler.collapsed())
+    return trace.to_dict()
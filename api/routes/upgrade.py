@@ -1,6 +1,8 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from utils.chat import chat
+from utils.chat import achat
+from utils.streaming import sse_response
+from utils.tokens import TokenBudgetExceeded
 import json
 
 router = APIRouter()
@@ -17,78 +19,95 @@ class CodeUpgradeResponse(BaseModel):
     potential_issues: list[str]
 
 
-@router.post("/upgrade", response_model=CodeUpgradeResponse)
-async def upgrade_code_endpoint(request: CodeUpgradeRequest):
-    try:
-        full_prompt = f"""
-            Please analyze the following code and provide version upgrade recommendations:
-
-            ---
-            ### **📌 Original Code**
-            {request.code}
-
-            ---
-            ### **🔍 Specified Version Description**
-            {request.prompt}
-
-            **Ensure the response meets the following requirements:**
-            1️⃣ Detect the programming language used and apply "best practices" for that language at that version.  
-            2️⃣ If no version upgrade is specified, return the original code without modifications.
-
-            ---
-            ### **🔹 Output Requirements**
-            Return the result in **JSON format**, ensuring consistency and detailed content:
-            ```json
-            {{
-                "code": "The improved code with clear formatting",
-                "improvements": "List of all improvements made",
-                "potential_issues": "List of potential issues found in the original code"
-            }}
-            ```
-        """
-
-        response = chat(
-            prompt=full_prompt,
-            temperature=0.3,
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "CodeUpgradeResponse",
-                    "schema": {
-                        "type": "object",
-                        "properties": {
-                            "code": {
-                                "type": "string",
-                                "description": "improved_code",
-                            },
-                            "improvements": {
-                                "type": "array",
-                                "items": {"type": "string"},
-                                "description": " list_of_improvements",
-                            },
-                            "potential_issues": {
-                                "type": "array",
-                                "items": {"type": "string"},
-                                "description": "list_of_potential_issues",
-                            },
+async def run_upgrade(request: CodeUpgradeRequest) -> CodeUpgradeResponse:
+    """執行程式碼升級 (/upgrade 與 /upgrade/stream 共用)"""
+    full_prompt = f"""
+        Please analyze the following code and provide version upgrade recommendations:
+
+        ---
+        ### **📌 Original Code**
+        ```
+        {request.code}
+        ```
+
+        ---
+        ### **🔍 Specified Version Description**
+        {request.prompt}
+
+        **Ensure the response meets the following requirements:**
+        1️⃣ Detect the programming language used and apply "best practices" for that language at that version.  
+        2️⃣ If no version upgrade is specified, return the original code without modifications.
+
+        ---
+        ### **🔹 Output Requirements**
+        Return the result in **JSON format**, ensuring consistency and detailed content:
+        ```json
+        {{
+            "code": "The improved code with clear formatting",
+            "improvements": "List of all improvements made",
+            "potential_issues": "List of potential issues found in the original code"
+        }}
+        ```
+    """
+
+    response = await achat(
+        prompt=full_prompt,
+        temperature=0.3,
+        response_format={
+            "type": "json_schema",
+            "json_schema": {
+                "name": "CodeUpgradeResponse",
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "code": {
+                            "type": "string",
+                            "description": "improved_code",
+                        },
+                        "improvements": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": " list_of_improvements",
+                        },
+                        "potential_issues": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "list_of_potential_issues",
                         },
-                        "required": [
-                            "code",
-                            "improvements",
-                            "potential_issues",
-                        ],
                     },
+                    "required": [
+                        "code",
+                        "improvements",
+                        "potential_issues",
+                    ],
                 },
             },
-        )
+        },
+    )
+
+    result = json.loads(response)
 
-        result = json.loads(response)
+    return CodeUpgradeResponse(
+        code=result["code"],
+        improvements=result["improvements"],
+        potential_issues=result["potential_issues"],
+    )
 
-        return CodeUpgradeResponse(
-            code=result["code"],
-            improvements=result["improvements"],
-            potential_issues=result["potential_issues"],
-        )
 
+@router.post("/upgrade", response_model=CodeUpgradeResponse)
+async def upgrade_code_endpoint(request: CodeUpgradeRequest):
+    try:
+        return await run_upgrade(request)
+
+    except TokenBudgetExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"程式碼升級失敗: {str(e)}")
+
+
+@router.post("/upgrade/stream")
+async def upgrade_code_stream_endpoint(request: CodeUpgradeRequest):
+    """
+    Same as /upgrade, but streams progress as Server-Sent Events
+    """
+    return sse_response(lambda: run_upgrade(request))
@@ -1,11 +1,47 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from api.main import api_router
+from utils.chat import close_llm_client
+from utils.cache import cache_bypass
+from utils.scheduler import llm_priority, priority_for_path
+from utils.sandbox import get_python_pool
+from utils.java_runner import get_java_pool
+from utils.graphs import build_graphs
+from utils.k8s.job import get_job_manager, close_job_manager
+from utils.k8s.pool import K8S_POOL_SIZE
+from utils.tokens import TokenUsage, token_usage, policy_for_path
+from utils.metrics import observe_request
+from utils.tracing import profiling_requested, start_trace
+import asyncio
 import os
+import time
 from dotenv import load_dotenv
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # LangGraph pipeline 只在啟動時編譯一次，之後所有請求共用
+    build_graphs()
+    # 預先啟動 Python sandbox workers，第一個請求就不用等直譯器啟動
+    if get_python_pool().size > 0:
+        await get_python_pool().start()
+    # JVM 啟動較慢，在背景暖機即可
+    if get_java_pool().available:
+        asyncio.ensure_future(get_java_pool().ready(""))
+    # 有設定 K8S_POOL_SIZE 才在啟動時連線 Kubernetes 並預熱 runner pod
+    if K8S_POOL_SIZE > 0:
+        await get_job_manager().start()
+    yield
+    # 關閉共用的 LLM connection pool、sandbox workers、Java daemon 與 k8s pod watcher
+    await close_llm_client()
+    await get_python_pool().close()
+    await get_java_pool().close()
+    await close_job_manager()
+
+
 # FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 load_dotenv()
 
@@ -21,4 +57,37 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    # `Cache-Control: no-cache` 讓這個請求略過 LLM 回應快取
+    cache_bypass.set("no-cache" in request.headers.get("cache-control", "").lower())
+    # 互動式的 route 在 LLM 排程器裡優先放行
+    llm_priority.set(priority_for_path(request.url.path))
+    # 累加這個請求所有 LLM 呼叫的 token 用量，回傳在 X-LLM-* header
+    # (串流回應的 header 先送出，只會反映送出當下的用量)
+    usage = TokenUsage(request.url.path, policy_for_path(request.url.path))
+    token_usage.set(usage)
+    # `X-Profile: 1` 或 `?profile=1` 記錄這個請求的 span 與取樣結果，之後以 GET /traces/{id} 取得
+    profile = profiling_requested(request.headers, request.query_params)
+    trace = start_trace(f"{request.method} {request.url.path}", profile) if profile else None
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        # 以 route 樣板 (例如 /k8s/jobs/{job_id}) 當 label，避免 ID 讓 label 數量無限增加
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        observe_request(request.method, route, status, time.perf_counter() - start)
+        if trace is not None and status == 500:
+            trace.finish(status=status)
+    response.headers.update(usage.headers())
+    if trace is not None:
+        trace.root.set("status", status)
+        response.headers["X-Trace-Id"] = trace.id
+        response.body_iterator = trace.wrap(response.body_iterator)
+    return response
+
+
 app.include_router(api_router)
\ No newline at end of file
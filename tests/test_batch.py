@@ -0,0 +1,48 @@
+import asyncio
+import json
+
+from api.routes import batch
+from utils.tokens import token_usage, TokenBudgetExceeded
+
+
+class Result:
+    def __init__(self, **fields):
+        self.fields = fields
+
+    def model_dump(self):
+        return self.fields
+
+
+def run_batch(monkeypatch, items):
+    async def run(request):
+        usage = token_usage.get()
+        # 用掉的 token 數寫在 code 裡
+        tokens = int(request.code)
+        try:
+            usage.check(tokens)
+        except TokenBudgetExceeded as e:
+            raise RuntimeError(str(e))
+        usage.add(tokens, 0, 0)
+        return Result(strip_comments=usage.policy.strip_comments, used=usage.total)
+
+    monkeypatch.setattr(batch, "OPERATIONS", {name: (model, run) for name, (model, _) in batch.OPERATIONS.items()})
+
+    async def main():
+        return [json.loads(line) async for line in batch.batch_results(items, 4)]
+
+    return {line["index"]: line for line in asyncio.run(main())}
+
+
+def test_items_use_the_policy_of_their_operation(monkeypatch):
+    items = [batch.BatchItem(operation=op, code="1") for op in ("detect", "convert", "upgrade", "optimize")]
+    lines = run_batch(monkeypatch, items)
+    assert [lines[i]["result"]["strip_comments"] for i in range(4)] == [False, False, False, True]
+
+
+def test_each_item_has_its_own_budget(monkeypatch):
+    monkeypatch.setenv("LLM_REQUEST_TOKEN_BUDGET", "100")
+    items = [batch.BatchItem(operation="detect", code=code) for code in ("500", "60", "60")]
+    lines = run_batch(monkeypatch, items)
+    assert lines[0]["status"] == "error"
+    assert "token budget exceeded" in lines[0]["error"]
+    assert [lines[i]["result"]["used"] for i in (1, 2)] == [60, 60]
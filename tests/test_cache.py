@@ -0,0 +1,32 @@
+import asyncio
+import threading
+
+from utils.cache import LRUCache, SQLiteCache, ResponseCache
+
+
+def test_async_access_runs_sqlite_off_the_event_loop(tmp_path):
+    disk = SQLiteCache(str(tmp_path / "cache.sqlite3"))
+    threads = []
+    for name in ("get", "set"):
+        method = getattr(disk, name)
+
+        def record(*args, _method=method):
+            threads.append(threading.get_ident())
+            return _method(*args)
+
+        setattr(disk, name, record)
+
+    async def main():
+        cache = ResponseCache(memory=LRUCache(16), disk=disk)
+        assert await cache.aget("k") is None
+        await cache.aset("k", "v")
+        cache.memory.clear()
+        assert await cache.aget("k") == "v"
+        # 第二次從記憶體命中，不碰 SQLite
+        assert await cache.aget("k") == "v"
+        return threading.get_ident(), cache.stats()
+
+    loop_thread, stats = asyncio.run(main())
+    assert len(threads) == 3
+    assert loop_thread not in threads
+    assert (stats["memory_hits"], stats["disk_hits"], stats["misses"]) == (1, 1, 1)
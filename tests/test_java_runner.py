@@ -0,0 +1,75 @@
+import asyncio
+import shutil
+
+import pytest
+
+from utils.java_runner import JavaRunnerPool
+
+pytestmark = pytest.mark.skipif(shutil.which("java") is None, reason="java is not installed")
+
+WORKER_THREAD = """
+public class Main {
+    public static void main(String[] args) {
+        new Thread(() -> {
+            try { Thread.sleep(200); } catch (InterruptedException e) { }
+            System.out.println("from worker thread");
+        }).start();
+        System.out.println("from main");
+    }
+}
+"""
+
+DAEMON_THREAD = """
+public class Main {
+    public static void main(String[] args) {
+        Thread t = new Thread(() -> {
+            while (true) {
+                System.out.println("stray output");
+                try { Thread.sleep(10); } catch (InterruptedException e) { return; }
+            }
+        });
+        t.setDaemon(true);
+        t.start();
+        System.out.println("done");
+    }
+}
+"""
+
+HELLO = """
+public class Main {
+    public static void main(String[] args) {
+        System.out.println("hello");
+    }
+}
+"""
+
+
+def run(*programs, compile_timeout: float = 10):
+    async def main():
+        pool = JavaRunnerPool(1)
+        try:
+            return [await pool.run(code, "Main", compile_timeout=compile_timeout, timeout=5) for code in programs]
+        finally:
+            await pool.close()
+
+    return asyncio.run(main())
+
+
+def test_run_waits_for_non_daemon_threads():
+    result, = run(WORKER_THREAD)
+    assert result["status"] == "OK"
+    assert result["stdout"] == "from main\nfrom worker thread\n"
+
+
+def test_leftover_daemon_thread_output_does_not_leak():
+    first, second = run(DAEMON_THREAD, HELLO)
+    assert first["status"] == "OK"
+    assert first["stdout"].startswith("done\n")
+    assert second["status"] == "OK"
+    assert second["stdout"] == "hello\n"
+
+
+def test_compile_timeout_is_enforced():
+    result, = run(HELLO, compile_timeout=0.001)
+    assert result["status"] == "TIMEOUT"
+    assert "compilation timed out" in result["stderr"]
@@ -0,0 +1,208 @@
+import asyncio
+import queue
+import threading
+import time
+from types import SimpleNamespace as NS
+
+from utils.k8s.job import JobManager
+from utils.k8s.resources import METRICS_MARKER
+
+NAMESPACE = "sandbox"
+METRICS_LINE = f"\n{METRICS_MARKER} wall_ns=20000000 cpu_usec=15000 peak_bytes=2097152 exit_code=0\n"
+
+
+class FakeWatch:
+    def __init__(self):
+        self.events: "queue.Queue" = queue.Queue()
+        self.stopped = False
+
+    def stream(self, func, namespace, **kwargs):
+        while not self.stopped:
+            try:
+                yield self.events.get(timeout=0.05)
+            except queue.Empty:
+                pass
+
+    def stop(self):
+        self.stopped = True
+
+
+class FakeCluster:
+    """
+    假的 CoreV1Api / BatchV1Api: 建立 Job 或 pod 後依 script 依序送出 pod 事件給 watch
+
+    script 的每一項為 (event type, pod name, phase)，送給所有開著的 watch；
+    calls 記錄每個呼叫使用的 namespace
+    """
+
+    def __init__(self, job_script=(), pod_script=(), log="hello\n"):
+        self.job_script = job_script
+        self.pod_script = pod_script
+        self.log = log
+        self.watches = []
+        self.configmaps = {}
+        self.calls = []
+        self.resource_version = 0
+
+    def watch_factory(self):
+        fake = FakeWatch()
+        self.watches.append(fake)
+        return fake
+
+    def _emit(self, script, labels):
+        def run():
+            for event_type, name, phase in script:
+                time.sleep(0.02)
+                self.resource_version += 1
+                metadata = NS(name=name, labels=labels, resource_version=str(self.resource_version))
+                for fake in self.watches:
+                    fake.events.put({"type": event_type, "object": NS(metadata=metadata, status=NS(phase=phase))})
+
+        threading.Thread(target=run, daemon=True).start()
+
+    # CoreV1Api
+    def create_namespaced_config_map(self, namespace, body):
+        self.calls.append(("create_configmap", namespace))
+        self.configmaps[body.metadata.name] = body.data
+
+    def patch_namespaced_config_map(self, name, namespace, body):
+        self.calls.append(("patch_configmap", namespace))
+
+    def delete_namespaced_config_map(self, name, namespace):
+        self.calls.append(("delete_configmap", namespace))
+        self.configmaps.pop(name, None)
+
+    def list_namespaced_pod(self, namespace, **kwargs):
+        self.calls.append(("list_pods", namespace))
+        return NS(items=[], metadata=NS(resource_version=str(self.resource_version)))
+
+    def read_namespaced_pod_log(self, name, namespace, follow=False, _preload_content=True):
+        self.calls.append(("read_log", namespace))
+        data = (self.log + METRICS_LINE).encode()
+
+        class Response:
+            def stream(self, amount):
+                yield data[:3]
+                yield data[3:]
+
+            def close(self):
+                pass
+
+        return Response() if follow else data.decode()
+
+    def read_namespaced_pod(self, name, namespace):
+        self.calls.append(("read_pod", namespace))
+        terminated = NS(exit_code=0)
+        return NS(status=NS(container_statuses=[NS(state=NS(terminated=terminated))]))
+
+    def create_namespaced_pod(self, namespace, body):
+        self.calls.append(("create_pod", namespace))
+        name = body["metadata"]["name"]
+        self._emit([(event_type, name, phase) for event_type, phase in self.pod_script], body["metadata"]["labels"])
+
+    def delete_namespaced_pod(self, name, namespace, **kwargs):
+        self.calls.append(("delete_pod", namespace))
+
+    # BatchV1Api
+    def create_namespaced_job(self, body, namespace):
+        self.calls.append(("create_job", namespace))
+        name = body["metadata"]["name"]
+        self._emit(self.job_script, {"job-name": name})
+        return NS(metadata=NS(name=name, uid="uid-1"))
+
+
+def run_job(cluster: FakeCluster, timeout: float = 5, **kwargs):
+    async def main():
+        manager = JobManager(
+            core_api=cluster,
+            batch_api=cluster,
+            namespace=NAMESPACE,
+            watch_factory=cluster.watch_factory,
+            timeout=timeout,
+            backend="k8s",
+            **kwargs,
+        )
+        await manager.start()
+        try:
+            job = manager.submit("print('hello')\n", "python3")
+            statuses = []
+
+            async def collect():
+                async for kind, data in job.events():
+                    if kind == "status":
+                        statuses.append(data["status"])
+
+            await asyncio.wait_for(collect(), timeout + 5)
+            # job 結束後還會清理 ConfigMap，等背景 task 跑完
+            await asyncio.gather(*manager._tasks)
+            return job, statuses
+        finally:
+            await manager.close()
+
+    return asyncio.run(main())
+
+
+def test_job_runs_through_pending_running_succeeded():
+    cluster = FakeCluster(job_script=[
+        ("ADDED", "pod-a", "Pending"),
+        ("MODIFIED", "pod-a", "Running"),
+        ("MODIFIED", "pod-a", "Succeeded"),
+    ])
+    job, statuses = run_job(cluster, pool_size=0)
+
+    assert job.status == "Succeeded"
+    assert statuses == ["Submitted", "Pending", "Running", "Succeeded"]
+    assert job.backend == "k8s"
+    assert job.pod == "pod-a"
+    assert job.log == "hello\n"
+    assert job.exit_code == 0
+    assert job.metrics["cpu_time"] == 0.015
+    assert job.metrics["peak_memory_kb"] == 2048
+    # ConfigMap 與 Job、pod 使用同一個 namespace，結束後清掉
+    assert {namespace for _, namespace in cluster.calls} == {NAMESPACE}
+    assert ("patch_configmap", NAMESPACE) in cluster.calls
+    assert cluster.configmaps == {}
+
+
+def test_deleted_pod_is_replaced_by_job_controller():
+    cluster = FakeCluster(job_script=[
+        ("ADDED", "pod-a", "Pending"),
+        ("DELETED", "pod-a", "Pending"),
+        ("ADDED", "pod-b", "Pending"),
+        ("MODIFIED", "pod-b", "Running"),
+        ("MODIFIED", "pod-b", "Succeeded"),
+    ])
+    job, _ = run_job(cluster, pool_size=0)
+
+    assert job.status == "Succeeded"
+    assert job.pod == "pod-b"
+    assert job.log == "hello\n"
+
+
+def test_job_times_out_when_pod_never_finishes():
+    cluster = FakeCluster(job_script=[("ADDED", "pod-a", "Pending")])
+    job, _ = run_job(cluster, timeout=0.3, pool_size=0)
+
+    assert job.status == "Error"
+    assert "did not finish within 0.3 seconds" in job.error
+    assert ("delete_configmap", NAMESPACE) in cluster.calls
+    assert cluster.configmaps == {}
+
+
+def test_job_runs_in_warm_runner_pod():
+    commands = []
+
+    def executor(core_api, pod, namespace, command, stdin, timeout, on_output):
+        commands.append((pod, namespace, stdin))
+        on_output("hi\n")
+        return 0, "hi\n" + METRICS_LINE, False
+
+    cluster = FakeCluster(pod_script=[("ADDED", "Pending"), ("MODIFIED", "Running")])
+    job, _ = run_job(cluster, pool_size=1, executor=executor)
+
+    assert job.status == "Succeeded"
+    assert job.pod.startswith("python3-runner-")
+    assert job.log == "hi\n"
+    assert commands == [(job.pod, NAMESPACE, "print('hello')\n")]
+    # 沒有走 Job
+    assert ("create_job", NAMESPACE) not in cluster.calls
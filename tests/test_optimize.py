@@ -0,0 +1,89 @@
+import asyncio
+import json
+
+from api.routes import optimize
+from utils.benchmark import BenchmarkError
+from utils.streaming import emit, stream_queue
+
+CANDIDATES = [{"code": "print(1)"}, {"code": "print(2)"}]
+
+
+def select(monkeypatch, ranking):
+    async def detect(code):
+        return "python"
+
+    async def tournament(original, codes, language, trials, rank_by):
+        if isinstance(ranking, Exception):
+            raise ranking
+        return ranking
+
+    monkeypatch.setattr(optimize, "detect_code_language", detect)
+    monkeypatch.setattr(optimize, "tournament", tournament)
+    state = {"code": "print(1)", "candidate_results": CANDIDATES, "result": CANDIDATES[0],
+             "benchmark_trials": 1, "rank_by": "time"}
+    return asyncio.run(optimize.select_candidate(state))
+
+
+def test_parse_candidate_drops_responses_without_code():
+    assert optimize.parse_candidate(json.dumps({"code": "x = 1"})) == {"code": "x = 1"}
+    assert optimize.parse_candidate(json.dumps({"response": "sorry"})) is None
+    assert optimize.parse_candidate("not json") is None
+    assert optimize.parse_candidate(RuntimeError("llm failed")) is None
+
+
+def test_optimize_code_keeps_only_candidates_with_code(monkeypatch):
+    responses = iter([json.dumps({"response": "no code"}), json.dumps({"code": "print(2)"})])
+
+    async def achat(**kwargs):
+        return next(responses)
+
+    monkeypatch.setattr(optimize, "achat", achat)
+    state = {"code": "print(1)", "prompt": "", "candidates": 2,
+             "complexity_analysis": {"time_complexity": "O(1)", "space_complexity": "O(1)"}}
+    state = asyncio.run(optimize.optimize_code(state))
+    assert state["candidate_results"] == [{"code": "print(2)"}]
+    assert state["result"] == {"code": "print(2)"}
+
+
+def test_select_candidate_picks_best_ok_candidate(monkeypatch):
+    state = select(monkeypatch, [{"index": 1, "status": "ok"}, {"index": 0, "status": "failed"}])
+    assert state["selected_candidate"] == 1
+    assert state["selection_status"] == "ranked"
+    assert state["result"] == CANDIDATES[1]
+
+
+def test_select_candidate_reports_when_no_candidate_passes(monkeypatch):
+    state = select(monkeypatch, [{"index": 0, "status": "output_mismatch"}, {"index": 1, "status": "failed"}])
+    assert state["selected_candidate"] is None
+    assert state["selection_status"] == "no_valid_candidate"
+
+
+def test_select_candidate_reports_unverified_when_original_fails(monkeypatch):
+    state = select(monkeypatch, BenchmarkError("original crashed"))
+    assert state["selected_candidate"] == 0
+    assert state["selection_status"] == "unverified"
+    assert all(entry["status"] == "failed" for entry in state["ranking"])
+
+
+def test_streamed_tokens_are_tagged_with_their_candidate(monkeypatch):
+    async def achat(temperature, **kwargs):
+        # 兩個候選的 token 交錯送出
+        for part in ("a", "b"):
+            emit("token", {"content": f"{temperature}:{part}"})
+            await asyncio.sleep(0)
+        return json.dumps({"code": "print(1)"})
+
+    async def main():
+        queue = asyncio.Queue()
+        stream_queue.set(queue)
+        state = {"code": "print(1)", "prompt": "", "candidates": 2,
+                 "complexity_analysis": {"time_complexity": "O(1)", "space_complexity": "O(1)"}}
+        await optimize.optimize_code(state)
+        return [queue.get_nowait()[1] for _ in range(queue.qsize())]
+
+    monkeypatch.setattr(optimize, "achat", achat)
+    tokens = asyncio.run(main())
+    assert len(tokens) == 4
+    for token in tokens:
+        temperature = min(1.0, 0.3 + 0.2 * token["candidate"])
+        assert token["content"].startswith(f"{temperature}:")
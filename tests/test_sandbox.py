@@ -0,0 +1,101 @@
+import asyncio
+import sys
+
+import pytest
+
+from utils.sandbox import WorkerPool, SandboxError
+
+
+class FakeWorker:
+    def __init__(self, pool: "FakePool"):
+        self.pool = pool
+        self.runs = 0
+        self.alive = False
+
+    async def start(self):
+        if self.pool.failing:
+            raise SandboxError("worker failed to start")
+        self.alive = True
+        self.pool.started += 1
+
+    async def stop(self):
+        self.alive = False
+
+
+class FakePool(WorkerPool):
+    def __init__(self, size: int, **kwargs):
+        super().__init__(size, **kwargs)
+        self.failing = False
+        self.started = 0
+
+    def _new_worker(self):
+        return FakeWorker(self)
+
+
+def test_acquire_times_out_when_all_workers_are_busy():
+    async def main():
+        pool = FakePool(1, acquire_timeout=0.05)
+        await pool.acquire()
+        with pytest.raises(SandboxError):
+            await pool.acquire()
+
+    asyncio.run(main())
+
+
+def test_acquire_respawns_after_failed_replacement():
+    async def main():
+        pool = FakePool(1, acquire_timeout=0.05)
+        worker = await pool.acquire()
+        pool.failing = True
+        pool.release(worker, broken=True)
+        await asyncio.sleep(0)
+        assert pool.stats()["workers"] == 0
+
+        # 補位失敗且沒有任何 worker 時直接回報錯誤，不必等到逾時
+        with pytest.raises(SandboxError, match="no sandbox worker available"):
+            await pool.acquire()
+
+        pool.failing = False
+        worker = await pool.acquire()
+        assert worker.alive
+        assert pool.started == 2
+        assert pool.stats()["workers"] == 1
+
+    asyncio.run(main())
+
+
+def test_cancelled_run_replaces_worker():
+    from utils.sandbox import PythonSandboxPool
+
+    async def main():
+        pool = PythonSandboxPool(1)
+        try:
+            task = asyncio.ensure_future(pool.run("import time; time.sleep(5)", timeout=5))
+            await asyncio.sleep(0.5)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+            result = await pool.run("print('again')")
+            assert result["stdout"] == "again\n"
+            assert pool.recycled == 1
+        finally:
+            await pool.close()
+
+    asyncio.run(main())
+
+
+
+def test_java_daemon_start_timeout_disables_pool(monkeypatch):
+    from utils import java_runner
+
+    # 代替 JVM 的 process，不會印出 READY
+    monkeypatch.setattr(java_runner, "JAVA_RUNNER_START_TIMEOUT", 0.2)
+    pool = java_runner.JavaRunnerPool(1, java=sys.executable, options=["-c", "import time; time.sleep(5)"])
+
+    async def main():
+        return await pool.ready("")
+
+    assert asyncio.run(main()) is False
+    assert pool.available is False
+    assert not pool._workers
@@ -0,0 +1,19 @@
+import asyncio
+import subprocess
+
+from utils import static_analysis
+
+JAVAC_OUTPUT = """\
+/tmp/x/Main.java:3: warning: [rawtypes] found raw type: List
+/tmp/x/Main.java:5: error: ';' expected
+"""
+
+
+def test_javac_lint_warnings_are_not_tagged_optimize(monkeypatch):
+    async def run_subprocess(args, timeout):
+        return subprocess.CompletedProcess(args, 1, "", JAVAC_OUTPUT)
+
+    monkeypatch.setattr(static_analysis.shutil, "which", lambda name: name)
+    monkeypatch.setattr(static_analysis, "run_subprocess", run_subprocess)
+    issues = asyncio.run(static_analysis.analyze_java_javac("public class Main {}"))
+    assert [(issue["start_line"], issue["tag"]) for issue in issues] == [(3, "warning"), (5, "error")]
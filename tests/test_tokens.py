@@ -0,0 +1,52 @@
+from utils.tokens import compact_prompt
+
+SNIPPET = '''import os
+
+
+def square(x):
+    # keep this comment
+    return x ** 2
+
+
+class Config:
+    """**not** markdown"""
+
+    def path(self):
+        # a comment-only line inside a block
+        return os.path.join("a", "b")
+'''
+
+
+def test_unfenced_python_passes_through_unchanged():
+    assert compact_prompt(SNIPPET) == SNIPPET.strip()
+
+
+def test_unfenced_python_inside_prompt_is_preserved():
+    prompt = f"""
+        Please analyze the following code:
+
+        ---
+        ### **📌 Original Code**
+{SNIPPET}
+        ---
+        **Ensure the response meets the following requirements:**
+        1️⃣ Detect the programming language.
+    """
+    compacted = compact_prompt(prompt)
+    assert SNIPPET.strip() in compacted
+    assert "Original Code" in compacted and "📌" not in compacted
+    assert "1. Detect the programming language." in compacted
+
+
+def test_fenced_code_keeps_indentation_and_prose_is_compacted():
+    prompt = """
+        ### **🔹 Output Requirements**
+        Return the result in **JSON format**.
+        ```
+    def f():
+        return 1 ** 2
+        ```
+    """
+    assert compact_prompt(prompt) == (
+        "Output Requirements\nReturn the result in JSON format.\n```\n    def f():\n        return 1 ** 2\n```"
+    )
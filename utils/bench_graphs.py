@@ -0,0 +1,105 @@
+"""
+LangGraph 每個請求的額外開銷 microbenchmark
+
+比較「每個請求都 build_chain()」與「啟動時編譯一次 (utils.graphs)」的差異。
+LLM 呼叫以立即回傳的假回應取代，量到的只有 graph 本身的成本。
+
+    python -m utils.bench_graphs [--requests 200]
+"""
+from typing import Callable, Any
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+os.environ.setdefault("LANGSMITH_TRACING", "false")
+
+import api.routes.convert as convert  # noqa: E402
+import api.routes.optimize as optimize  # noqa: E402
+from utils.graphs import get_graph  # noqa: E402
+from utils.streaming import run_graph  # noqa: E402
+
+FAKE_RESPONSES = {
+    "source and target": {"source_language": "python", "target_language": "java"},
+    "time and space complexity": {"time_complexity": "O(n)", "space_complexity": "O(1)"},
+}
+FAKE_RESULT = {
+    "code": "class Main {}",
+    "new_complexity": {"time": "O(1)", "space": "O(1)"},
+    "improvements": [],
+    "tradeoffs": [],
+}
+
+
+async def fake_achat(prompt: str, **kwargs) -> str:
+    for marker, response in FAKE_RESPONSES.items():
+        if marker in prompt:
+            return json.dumps(response)
+    return json.dumps(FAKE_RESULT)
+
+
+async def measure(get_chain: Callable[[], Any], state: dict, requests: int):
+    """回傳每個請求的耗時 (ms)"""
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        await run_graph(get_chain(), dict(state))
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(label: str, timings):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"  {label:<22} mean {statistics.mean(timings):7.3f} ms   p95 {p95:7.3f} ms")
+
+
+async def main(requests: int):
+    convert.achat = fake_achat
+    optimize.achat = fake_achat
+
+    pipelines = [
+        (
+            "convert",
+            convert.build_chain,
+            dict(code="print(1)", prompt="to java", source_language="", target_language="", result={}),
+        ),
+        (
+            "optimize",
+            optimize.build_chain,
+            dict(
+                code="print(1)",
+                prompt="",
+                result={},
+                benchmark=False,
+                benchmark_trials=0,
+                benchmark_result={},
+                candidates=1,
+                rank_by="time",
+                candidate_results=[],
+                ranking=[],
+                selected_candidate=None,
+                selection_status=None,
+            ),
+        ),
+    ]
+    for name, build_chain, state in pipelines:
+        # 暖機: import、第一次編譯的成本不算進去
+        await measure(build_chain, state, 5)
+        await measure(lambda: get_graph(name), state, 5)
+
+        per_request = await measure(build_chain, state, requests)
+        compiled_once = await measure(lambda: get_graph(name), state, requests)
+        print(f"{name} ({requests} requests)")
+        report("build per request", per_request)
+        report("compiled at startup", compiled_once)
+        saved = statistics.mean(per_request) - statistics.mean(compiled_once)
+        print(f"  saved per request      {saved:7.3f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    asyncio.run(main(parser.parse_args().requests))
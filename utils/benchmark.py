@@ -0,0 +1,212 @@
+from typing import Optional, Dict, Any, List
+import asyncio
+import os
+import re
+import statistics
+from utils.sandbox import get_python_pool, SandboxError
+from utils.java_runner import get_java_pool
+
+BENCHMARK_TIMEOUT = float(os.getenv("BENCHMARK_TIMEOUT", "5"))
+BENCHMARK_MAX_TRIALS = int(os.getenv("BENCHMARK_MAX_TRIALS", "20"))
+
+
+class BenchmarkError(Exception):
+    """無法量測 (語言不支援、sandbox 停用或程式執行失敗)"""
+
+
+async def run_once(code: str, language: str, timeout: float) -> Dict[str, Any]:
+    """
+    在 sandbox 執行一次並回傳量測值
+
+    Returns:
+        {"ok": bool, "stdout": str, "stderr": str, "wall_time": float,
+         "cpu_time": Optional[float], "max_rss_kb": Optional[int]}
+    """
+    if language == "python":
+        if get_python_pool().size <= 0:
+            raise BenchmarkError("python sandbox pool is disabled (SANDBOX_POOL_SIZE=0)")
+        result = await get_python_pool().run(code, timeout=timeout)
+        return {
+            "ok": result["returncode"] == 0 and not result["timed_out"],
+            "stdout": result["stdout"],
+            "stderr": "timed out" if result["timed_out"] else result["stderr"],
+            "wall_time": result["wall_time"],
+            "cpu_time": result["cpu_time"],
+            "max_rss_kb": result["max_rss_kb"],
+        }
+
+    if language == "java":
+        match = re.search(r"public\s+class\s+(\w+)", code)
+        if not match:
+            raise BenchmarkError("cant find class name")
+        if not await get_java_pool().ready(code):
+            raise BenchmarkError("java runner daemon is not available")
+        result = await get_java_pool().run(code, match.group(1), compile_timeout=3, timeout=timeout)
+        # daemon 內的程式共用同一個 JVM，無法取得單次執行的 CPU 與記憶體
+        return {
+            "ok": result["status"] == "OK",
+            "stdout": result["stdout"],
+            "stderr": result["stderr"] or result["status"],
+            "wall_time": result["wall_time"],
+            "cpu_time": None,
+            "max_rss_kb": None,
+        }
+
+    raise BenchmarkError(f"benchmark is not supported for language: {language}")
+
+
+def summarize(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """時間取中位數 (降低雜訊)，記憶體取所有 trial 的峰值"""
+    cpu_times = [run["cpu_time"] for run in runs if run["cpu_time"] is not None]
+    rss = [run["max_rss_kb"] for run in runs if run["max_rss_kb"] is not None]
+    return {
+        "wall_time": statistics.median(run["wall_time"] for run in runs),
+        "cpu_time": statistics.median(cpu_times) if cpu_times else None,
+        "max_rss_kb": max(rss) if rss else None,
+    }
+
+
+def _ratio(before: Optional[float], after: Optional[float]) -> Optional[float]:
+    if before is None or after is None or after <= 0:
+        return None
+    return round(before / after, 3)
+
+
+async def compare(original: str, optimized: str, language: str, trials: int = 5) -> Dict[str, Any]:
+    """
+    重複執行原始與優化後的程式碼並比較
+
+    兩邊交錯執行 (原始、優化、原始、...)，讓機器負載的變化平均落在兩邊；
+    第一輪當作暖機不列入 (Java 會在這輪編譯並快取 bytecode)。
+
+    Args:
+        original (str): 原始程式碼
+        optimized (str): 優化後的程式碼
+        language (str): "python" 或 "java"
+        trials (int): 每邊量測次數
+
+    Returns:
+        {
+            "language": str,
+            "trials": int,
+            "original": {"wall_time", "cpu_time", "max_rss_kb"},
+            "optimized": {"wall_time", "cpu_time", "max_rss_kb"},
+            "output_matches": bool,
+            "speedup": Optional[float],      # 原始 / 優化 的 wall time
+            "cpu_speedup": Optional[float],
+            "memory_delta_kb": Optional[int]  # 優化 - 原始，負數代表省記憶體
+        }
+
+    Raises:
+        BenchmarkError: 無法量測或任一邊執行失敗
+    """
+    trials = max(1, min(trials, BENCHMARK_MAX_TRIALS))
+    runs = {"original": [], "optimized": []}
+    try:
+        for trial in range(trials + 1):
+            for name, code in (("original", original), ("optimized", optimized)):
+                run = await run_once(code, language, BENCHMARK_TIMEOUT)
+                if not run["ok"]:
+                    raise BenchmarkError(f"{name} code failed: {run['stderr'][-500:]}")
+                if trial > 0:
+                    runs[name].append(run)
+    except SandboxError as e:
+        raise BenchmarkError(f"sandbox error: {e}")
+
+    before = summarize(runs["original"])
+    after = summarize(runs["optimized"])
+    memory_delta = None
+    if before["max_rss_kb"] is not None and after["max_rss_kb"] is not None:
+        memory_delta = after["max_rss_kb"] - before["max_rss_kb"]
+
+    return {
+        "language": language,
+        "trials": trials,
+        "original": before,
+        "optimized": after,
+        "output_matches": runs["original"][0]["stdout"].rstrip() == runs["optimized"][0]["stdout"].rstrip(),
+        "speedup": _ratio(before["wall_time"], after["wall_time"]),
+        "cpu_speedup": _ratio(before["cpu_time"], after["cpu_time"]),
+        "memory_delta_kb": memory_delta,
+    }
+
+
+async def measure(code: str, language: str, trials: int) -> Dict[str, Any]:
+    """
+    暖機一次後執行 trials 次，回傳 summarize() 的結果加上 stdout
+
+    Raises:
+        BenchmarkError: 無法量測或程式執行失敗
+    """
+    runs = []
+    try:
+        for trial in range(trials + 1):
+            run = await run_once(code, language, BENCHMARK_TIMEOUT)
+            if not run["ok"]:
+                raise BenchmarkError(run["stderr"][-500:])
+            if trial > 0:
+                runs.append(run)
+    except SandboxError as e:
+        raise BenchmarkError(f"sandbox error: {e}")
+    return {**summarize(runs), "stdout": runs[0]["stdout"]}
+
+
+async def tournament(
+    original: str, candidates: List[str], language: str, trials: int = 3, rank_by: str = "time"
+) -> List[Dict[str, Any]]:
+    """
+    在 sandbox 裡平行量測所有候選程式碼並排名
+
+    輸出與原始程式碼不同、或執行失敗的候選會被淘汰；
+    其餘依 rank_by ("time": wall time，"memory": 峰值 RSS) 由好到壞排序。
+    同時執行的數量受 sandbox pool 大小限制。
+
+    Returns:
+        排好順序的 list，每個元素:
+        {"index": int, "status": "ok" | "output_mismatch" | "failed",
+         "wall_time", "cpu_time", "max_rss_kb", "speedup", "memory_delta_kb", "error"}
+        (status 為 "ok" 的排在前面)
+
+    Raises:
+        BenchmarkError: 原始程式碼本身無法量測
+    """
+    trials = max(1, min(trials, BENCHMARK_MAX_TRIALS))
+    # 原始程式碼與候選在同一批平行執行，彼此承受相同的機器負載
+    results = await asyncio.gather(
+        measure(original, language, trials),
+        *(measure(code, language, trials) for code in candidates),
+        return_exceptions=True,
+    )
+    baseline = results[0]
+    if isinstance(baseline, BaseException):
+        raise baseline
+
+    def rank_entry(index: int, result) -> Dict[str, Any]:
+        entry = {"index": index, "status": "ok", "error": None}
+        if isinstance(result, BenchmarkError):
+            entry.update(status="failed", error=str(result))
+            return entry
+        if isinstance(result, BaseException):
+            raise result
+        entry.update(
+            wall_time=result["wall_time"],
+            cpu_time=result["cpu_time"],
+            max_rss_kb=result["max_rss_kb"],
+            speedup=_ratio(baseline["wall_time"], result["wall_time"]),
+        )
+        if baseline["max_rss_kb"] is not None and result["max_rss_kb"] is not None:
+            entry["memory_delta_kb"] = result["max_rss_kb"] - baseline["max_rss_kb"]
+        if result["stdout"].rstrip() != baseline["stdout"].rstrip():
+            entry.update(status="output_mismatch", error="output differs from the original code")
+        return entry
+
+    ranking = [rank_entry(i, result) for i, result in enumerate(results[1:])]
+
+    def sort_key(entry: Dict[str, Any]):
+        if entry["status"] != "ok":
+            return (1, 0, entry["index"])
+        if rank_by == "memory" and entry.get("max_rss_kb") is not None:
+            return (0, entry["max_rss_kb"], entry["wall_time"])
+        return (0, entry["wall_time"], entry.get("max_rss_kb") or 0)
+
+    return sorted(ranking, key=sort_key)
@@ -0,0 +1,377 @@
+from typing import Optional, Dict, Any
+from collections import OrderedDict
+from contextvars import ContextVar
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# 單一請求可透過 `Cache-Control: no-cache` header 略過快取 (由 middleware 設定)
+cache_bypass: ContextVar[bool] = ContextVar("cache_bypass", default=False)
+
+
+class LRUCache:
+    """
+    有容量上限與 TTL 的 in-memory LRU cache (thread-safe)
+
+    Args:
+        max_entries (int): 最多保留的項目數，超過時淘汰最久未使用的項目
+        ttl (float): 項目存活秒數，0 代表不過期
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self._data: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at and expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any):
+        if self.max_entries <= 0:
+            return
+        expires_at = time.time() + self.ttl if self.ttl else 0
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache:
+    """
+    持久化在 SQLite 的 key/value cache，重啟後仍可命中
+
+    Args:
+        path (str): 資料庫檔案路徑
+        max_entries (int): 最多保留的項目數，超過時淘汰最久未存取的項目
+        ttl (float): 項目存活秒數，0 代表不過期
+    """
+
+    # 每寫入幾次才檢查一次容量，避免每次 set 都 COUNT(*)
+    EVICT_EVERY = 64
+
+    def __init__(self, path: str, max_entries: int = 100000, ttl: float = 0):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if self.ttl and created_at + self.ttl < now:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute(
+                "UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            return value
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._writes += 1
+            if self._writes % self.EVICT_EVERY == 0:
+                self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        if self.ttl:
+            cursor = self._conn.execute(
+                "DELETE FROM cache WHERE created_at < ?", (now - self.ttl,)
+            )
+            self.evictions += max(cursor.rowcount, 0)
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            cursor = self._conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at LIMIT ?)",
+                (overflow,),
+            )
+            self.evictions += max(cursor.rowcount, 0)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+        return count
+
+
+class ResponseCache:
+    """
+    LLM 回應的兩層快取: in-memory LRU 在前，SQLite 在後
+
+    key 為 prompt / response_format / temperature / model 的 sha256，
+    只有 temperature <= max_temperature 的請求會被快取 (預設只快取 temperature 0)
+    """
+
+    def __init__(
+        self,
+        memory: LRUCache,
+        disk: Optional[SQLiteCache] = None,
+        max_temperature: float = 0,
+        enabled: bool = True,
+    ):
+        self.memory = memory
+        self.disk = disk
+        self.max_temperature = max_temperature
+        self.enabled = enabled
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(
+        prompt: str,
+        response_format: Optional[Dict[str, Any]],
+        temperature: float,
+        model: str,
+    ) -> str:
+        payload = json.dumps(
+            {
+                "prompt": prompt,
+                "response_format": response_format,
+                "temperature": temperature,
+                "model": model,
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def accepts(self, temperature: float) -> bool:
+        return self.enabled and temperature <= self.max_temperature
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.disk_hits += 1
+                self.memory.set(key, value)
+                return value
+
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value: str):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    async def aget(self, key: str) -> Optional[str]:
+        """get() 的 async 版本: 記憶體命中直接回傳，SQLite 的讀取 (與 commit) 在 thread 中執行"""
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+        if self.disk is None:
+            self.misses += 1
+            return None
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, value: str):
+        """set() 的 async 版本: SQLite 的寫入與 fsync 不佔住 event loop"""
+        if self.disk is None:
+            self.memory.set(key, value)
+            return
+        await asyncio.to_thread(self.set, key, value)
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "memory_evictions": self.memory.evictions,
+            "disk_entries": len(self.disk) if self.disk is not None else 0,
+            "disk_evictions": self.disk.evictions if self.disk is not None else 0,
+        }
+
+
+_response_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> ResponseCache:
+    """
+    取得 process 內共用的 LLM 回應快取，第一次呼叫時依環境變數建立:
+        LLM_CACHE_ENABLED: 是否啟用 (預設 true)
+        LLM_CACHE_SIZE: in-memory LRU 項目上限 (預設 1024)
+        LLM_CACHE_TTL: 存活秒數，0 代表不過期 (預設 86400)
+        LLM_CACHE_DB: SQLite 檔案路徑，空字串代表只用記憶體 (預設 .cache/llm_cache.sqlite3)
+        LLM_CACHE_DB_MAX_ENTRIES: SQLite 項目上限 (預設 100000)
+        LLM_CACHE_MAX_TEMPERATURE: 會被快取的最高 temperature (預設 0)
+    """
+    global _response_cache
+    if _response_cache is None:
+        enabled = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+        ttl = float(os.getenv("LLM_CACHE_TTL", "86400"))
+        db_path = os.getenv("LLM_CACHE_DB", ".cache/llm_cache.sqlite3")
+        disk = None
+        if enabled and db_path:
+            disk = SQLiteCache(
+                db_path, int(os.getenv("LLM_CACHE_DB_MAX_ENTRIES", "100000")), ttl
+            )
+        _response_cache = ResponseCache(
+            memory=LRUCache(int(os.getenv("LLM_CACHE_SIZE", "1024")), ttl),
+            disk=disk,
+            max_temperature=float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", "0")),
+            enabled=enabled,
+        )
+    return _response_cache
+
+
+# 結果可能每次不同的程式 (亂數、時間、輸入) 不快取
+NONDETERMINISTIC_PATTERN = re.compile(
+    r"\b(random|secrets|uuid|datetime|time\.|urandom|input\s*\(|Random|Math\.random|"
+    r"currentTimeMillis|nanoTime|LocalDate|LocalDateTime|Instant|UUID|Scanner)"
+)
+
+
+class ExecutionCache:
+    """
+    wet_run() 執行結果的快取
+
+    key 為正規化後的程式碼、語言與 runtime 版本的 sha256，
+    runtime 升級後版本字串改變，舊結果自然不會再被命中；也可呼叫 clear() 手動清空
+    """
+
+    def __init__(self, memory: LRUCache, enabled: bool = True):
+        self.memory = memory
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(code: str) -> str:
+        lines = [line.rstrip() for line in code.replace("\r\n", "\n").split("\n")]
+        return "\n".join(lines).strip("\n")
+
+    def make_key(self, code: str, language: str, runtime: str) -> str:
+        payload = "\0".join([language, runtime, self.normalize(code)])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def accepts(self, code: str) -> bool:
+        return self.enabled and not NONDETERMINISTIC_PATTERN.search(code)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self.memory.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return dict(value)
+
+    def set(self, key: str, value: Dict[str, Any]):
+        self.memory.set(key, dict(value))
+
+    def clear(self):
+        self.memory.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.memory),
+            "evictions": self.memory.evictions,
+        }
+
+
+_execution_cache: Optional[ExecutionCache] = None
+
+
+def get_execution_cache() -> ExecutionCache:
+    """
+    取得 process 內共用的執行結果快取，依環境變數設定:
+        EXEC_CACHE_ENABLED: 是否啟用 (預設 true)
+        EXEC_CACHE_SIZE: 項目上限 (預設 2048)
+        EXEC_CACHE_TTL: 存活秒數，0 代表不過期 (預設 3600)
+    """
+    global _execution_cache
+    if _execution_cache is None:
+        _execution_cache = ExecutionCache(
+            memory=LRUCache(
+                int(os.getenv("EXEC_CACHE_SIZE", "2048")),
+                float(os.getenv("EXEC_CACHE_TTL", "3600")),
+            ),
+            enabled=os.getenv("EXEC_CACHE_ENABLED", "true").lower() == "true",
+        )
+    return _execution_cache
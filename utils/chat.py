@@ -1,58 +1,191 @@
 from typing import Optional, Dict, Any
 import os
+import asyncio
 import tempfile
 import subprocess
 import json
+import time
+import httpx
 from langchain_openai import ChatOpenAI
 import re
+from utils.cache import get_response_cache, get_execution_cache, cache_bypass
+from utils.lang_detect import classify_language
+from utils.sandbox import get_python_pool, SandboxError
+from utils.java_runner import get_java_pool
+from utils.scheduler import get_scheduler
+from utils.streaming import streaming, emit
+from utils.metrics import LLM_DURATION, EXECUTION_DURATION, CHAT_EXECUTION_RETRIES
+from utils.tracing import span, traced, annotate
+from utils.tokens import (
+    count_tokens,
+    compact_prompt,
+    policy_for_path,
+    token_usage,
+    get_token_metrics,
+    TokenBudgetExceeded,
+)
 
-def chat(
+TIMEOUT_MESSAGE = "Execution timed out: The program took more than 1 seconds to run"
+
+# 長駐的 LLM client，所有請求共用同一個 HTTP connection pool (keep-alive)
+_llm_client: Optional[ChatOpenAI] = None
+
+
+def get_llm_client() -> ChatOpenAI:
+    """
+    取得 process 內共用的 LLM client，第一次呼叫時才建立
+
+    Connection pool 大小可透過環境變數調整:
+        LLM_MAX_CONNECTIONS: 同時開啟的連線上限 (預設 200)
+        LLM_MAX_KEEPALIVE_CONNECTIONS: 保持 keep-alive 的閒置連線數 (預設 50)
+        LLM_KEEPALIVE_EXPIRY: 閒置連線保留秒數 (預設 30)
+        LLM_TIMEOUT: 單次請求逾時秒數 (預設 60)
+    """
+    global _llm_client
+    if _llm_client is None:
+        limits = httpx.Limits(
+            max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "200")),
+            max_keepalive_connections=int(
+                os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "50")
+            ),
+            keepalive_expiry=float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30")),
+        )
+        _llm_client = ChatOpenAI(
+            model_name=os.getenv("LLM_MODEL", "gemini-2.0-flash"),
+            base_url="https://generativelanguage.googleapis.com/v1beta/openai/",
+            api_key=os.getenv("GEMINI_API_KEY"),
+            http_async_client=httpx.AsyncClient(
+                limits=limits,
+                timeout=float(os.getenv("LLM_TIMEOUT", "60")),
+            ),
+            # 重試交給 utils/scheduler.py 統一處理 (含 backoff 與配額)
+            max_retries=0,
+        )
+    return _llm_client
+
+
+async def close_llm_client():
+    """關閉共用的 LLM client 與其 connection pool (application shutdown 時呼叫)"""
+    global _llm_client
+    if _llm_client is not None:
+        await _llm_client.http_async_client.aclose()
+        _llm_client = None
+
+
+@traced("chat")
+async def achat(
     prompt: str,
     response_format: Optional[Dict[str, Any]] = None,
     temperature: float = 0,
     reties: int = 0,
+    use_cache: bool = True,
 ) -> str:
     """
-    與 llm 互動的函數
+    與 llm 互動的函數 (非同步)
 
     Args:
         prompt (str): 要發送給 AI 的提示詞
         response_format (Optional[Dict[str, Any]]): 期望的回應格式
         temperature (float): 控制回應的創造性程度 (0-1)
+        use_cache (bool): 是否使用回應快取 (只對低 temperature 的請求生效)
 
     Returns:
         str: AI 的回應
     """
+    cache = get_response_cache()
+    cache_key = None
+    if use_cache and reties == 0 and not cache_bypass.get() and cache.accepts(temperature):
+        cache_key = cache.make_key(
+            prompt, response_format, temperature, get_llm_client().model_name
+        )
+        cached = await cache.aget(cache_key)
+        if cached is not None:
+            annotate("cache", "hit")
+            return cached
+
+    result = await _achat(prompt, response_format, temperature, reties)
+
+    if cache_key is not None:
+        await cache.aset(cache_key, result)
+    return result
+
+
+async def _achat(
+    prompt: str,
+    response_format: Optional[Dict[str, Any]],
+    temperature: float,
+    reties: int,
+) -> str:
+    """achat() 實際呼叫 LLM 的部分 (不經過快取)"""
 
     try:
-        client = ChatOpenAI(
-            model_name="gemini-2.0-flash",
-            temperature=temperature,
-            response_format=response_format,
-            base_url="https://generativelanguage.googleapis.com/v1beta/openai/",
-            api_key=os.getenv("GEMINI_API_KEY"),
-        )
+        # temperature / response_format 依每次呼叫傳入，client 本身可共用
+        invoke_kwargs: Dict[str, Any] = {"temperature": temperature}
+        if response_format is not None:
+            invoke_kwargs["response_format"] = response_format
 
-        response = client.invoke(
-            prompt
-            + "\nPlease provide response in valid JSON format following the OpenAPI schema.",
+        # 依 route 的設定壓縮提示詞，並在送出前檢查這個請求的 token 預算
+        usage_tracker = token_usage.get()
+        policy = usage_tracker.policy if usage_tracker is not None else policy_for_path("")
+        compacted = compact_prompt(prompt, policy.strip_comments) if policy.compact else prompt
+        full_prompt = (
+            compacted
+            + "\nPlease provide response in valid JSON format following the OpenAPI schema."
         )
+        prompt_tokens = count_tokens(full_prompt)
+        saved_tokens = count_tokens(prompt) - count_tokens(compacted) if policy.compact else 0
+        if usage_tracker is not None:
+            usage_tracker.check(prompt_tokens)
+        # 粗估 token 數供 TPM 配額使用，回應後再以實際用量修正
+        estimated_tokens = prompt_tokens + 1024
+        scheduler = get_scheduler()
+        if streaming():
+            call = lambda: _astream_message(full_prompt, invoke_kwargs)
+        else:
+            call = lambda: get_llm_client().ainvoke(full_prompt, **invoke_kwargs)
+        route = usage_tracker.route if usage_tracker is not None else "unknown"
+        start = time.perf_counter()
+        try:
+            with span("llm", retry=reties, prompt_tokens=prompt_tokens, streaming=streaming()):
+                response = await scheduler.run(call, tokens=estimated_tokens)
+        except Exception:
+            LLM_DURATION.labels(route, "error").observe(time.perf_counter() - start)
+            raise
+        LLM_DURATION.labels(route, "ok").observe(time.perf_counter() - start)
+        usage = getattr(response, "usage_metadata", None)
+        if usage:
+            scheduler.record_usage(estimated_tokens, usage.get("total_tokens", estimated_tokens))
+            input_tokens = usage.get("input_tokens", prompt_tokens)
+            output_tokens = usage.get("output_tokens", 0)
+        else:
+            input_tokens = prompt_tokens
+            output_tokens = count_tokens(str(response.content))
+        if usage_tracker is not None:
+            usage_tracker.add(input_tokens, output_tokens, saved_tokens)
+        else:
+            get_token_metrics().record("", input_tokens, output_tokens, saved_tokens)
         print("\nAPI Response:", response)
 
         try:
-            if isinstance(response.content, str):
-                content = json.loads(response.content)
-            elif isinstance(response.content, dict):
-                content = response.content
-            else:
-                content = {"response": str(response.content)}
+            with span("parse_response"):
+                if isinstance(response.content, str):
+                    content = json.loads(response.content)
+                elif isinstance(response.content, dict):
+                    content = response.content
+                else:
+                    content = {"response": str(response.content)}
 
             if "code" in content:
-                res = wet_run(content["code"])
+                res = await wet_run(content["code"])
                 print("\nExecution result:", res)
+                emit("execution", res)
                 if not res["success"] and (reties < 2):
-                    return chat(
-                        prompt=f"The code execution failed. Please provide a valid and runable code. {content['code']}, {res['message']}",
+                    CHAT_EXECUTION_RETRIES.labels(route).inc()
+                    return await achat(
+                        prompt=(
+                            "The code execution failed. Please provide a valid and runable code.\n"
+                            f"```\n{content['code']}\n```\n{res['message']}"
+                        ),
                         response_format=response_format,
                         temperature=temperature,
                         reties=reties + 1,
@@ -64,13 +197,33 @@ def chat(
             print(f"JSON parsing error: {e}")
             return json.dumps({"response": str(response.content)})
 
+    except TokenBudgetExceeded:
+        raise
     except Exception as e:
         print(f"Error details: {str(e)}")
         raise Exception(f"與 Vertex AI API 互動時發生錯誤: {str(e)}")
 
 
-def detect_code_language(code: str) -> str:
-    """Use LLM to detect programming language"""
+async def _astream_message(prompt: str, invoke_kwargs: Dict[str, Any]):
+    """串流呼叫 LLM，每個片段都送出 token 事件，回傳合併後的完整訊息"""
+    message = None
+    async for chunk in get_llm_client().astream(prompt, **invoke_kwargs):
+        if chunk.content:
+            emit("token", {"content": chunk.content})
+        message = chunk if message is None else message + chunk
+    return message
+
+
+@traced("detect_code_language")
+async def detect_code_language(code: str) -> str:
+    """
+    Detect programming language locally, falling back to the LLM only when
+    the local classifier's confidence is below LANG_DETECT_THRESHOLD (default 0.6)
+    """
+    language, confidence = classify_language(code)
+    if confidence >= float(os.getenv("LANG_DETECT_THRESHOLD", "0.6")):
+        return language
+
     schema = {
         "type": "object",
         "properties": {
@@ -87,7 +240,7 @@ def detect_code_language(code: str) -> str:
     Analyze the following code and determine its programming language.
     Return only "python" or "java".
     If uncertain or if it's another language, return "unknown".
-    
+
     Code:
     ```
     {code}
@@ -95,7 +248,7 @@ def detect_code_language(code: str) -> str:
     """
 
     try:
-        response = chat(
+        response = await achat(
             prompt=prompt,
             response_format=schema,
             temperature=0,
@@ -111,7 +264,65 @@ def detect_code_language(code: str) -> str:
         return "unknown"
 
 
-def wet_run(code: str):
+async def run_subprocess(args, timeout: float):
+    """
+    以非同步方式執行外部指令，不阻塞 event loop
+
+    Returns:
+        subprocess.CompletedProcess (stdout / stderr 為 str)
+
+    Raises:
+        subprocess.TimeoutExpired: 超過 timeout 秒數 (process 會被 kill)
+    """
+    with span("subprocess", command=os.path.basename(str(args[0]))):
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise subprocess.TimeoutExpired(args, timeout)
+
+    return subprocess.CompletedProcess(
+        args,
+        proc.returncode,
+        stdout.decode(errors="replace"),
+        stderr.decode(errors="replace"),
+    )
+
+
+_runtime_versions: Dict[str, str] = {}
+
+
+async def runtime_version(language: str) -> str:
+    """
+    回傳執行該語言的 runtime 版本字串 (每個 process 只查一次)，作為執行結果快取 key 的一部分
+    """
+    if language not in _runtime_versions:
+        if language == "python":
+            args = [get_python_pool().python if get_python_pool().size > 0 else "python3", "--version"]
+        else:
+            args = [get_java_pool().java, "-version"]
+        try:
+            result = await run_subprocess(args, timeout=10)
+            # java -version 印在 stderr
+            _runtime_versions[language] = (result.stdout + result.stderr).strip()
+        except (OSError, subprocess.TimeoutExpired):
+            _runtime_versions[language] = "unknown"
+    return _runtime_versions[language]
+
+
+def reset_runtime_versions():
+    """toolchain 升級後呼叫，下次執行會重新查詢版本"""
+    _runtime_versions.clear()
+
+
+@traced("wet_run")
+async def wet_run(code: str):
     """
     Args:
         code (str): 要執行的程式碼
@@ -125,7 +336,7 @@ def wet_run(code: str):
     """
     try:
         # 檢測程式碼語言
-        detected_lang = detect_code_language(code)
+        detected_lang = await detect_code_language(code)
 
         if detected_lang == "unknown":
             return {
@@ -134,74 +345,24 @@ def wet_run(code: str):
                 "detected_lang": detected_lang,
             }
 
-        # 根據語言選擇執行方式
-        if detected_lang == "python":
-            with tempfile.TemporaryDirectory() as temp_dir:
-                py_file = os.path.join(temp_dir, "script.py")
-                with open(py_file, "w") as f:
-                    f.write(code)
-                try:
-                    run_result = subprocess.run(
-                        ["python3", py_file], 
-                        capture_output=True, 
-                        text=True,
-                        timeout=2
-                    )
-                    success = run_result.returncode == 0
-                    message = (
-                        run_result.stdout if success else f"執行失敗:\n{run_result.stderr}"
-                    )
-                except subprocess.TimeoutExpired:
-                    success = False
-                    message = "Execution timed out: The program took more than 1 seconds to run"
-
-        elif detected_lang == "java":
-            with tempfile.TemporaryDirectory() as temp_dir:
-                class_pattern = r"public\s+class\s+(\w+)"
-                match = re.search(class_pattern, code)
-                if not match:
-                    return {
-                        "message": "cant find class name",
-                        "success": False,
-                        "detected_lang": detected_lang,
-                    }
-                
-                class_name = match.group(1)
-                java_file = os.path.join(temp_dir, f"{class_name}.java")
-
-                with open(java_file, "w") as f:
-                    f.write(code)
-
-                try:
-                    compile_result = subprocess.run(
-                        ["javac", java_file], 
-                        capture_output=True, 
-                        text=True,
-                        timeout=3
-                    )
-                    if compile_result.returncode != 0:
-                        print("\nCompile result: ", compile_result)
-                        return {
-                            "message": f"編譯失敗:\n{compile_result.stderr}",
-                            "success": False,
-                            "detected_lang": detected_lang,
-                        }
-
-                    run_result = subprocess.run(
-                        ["java", "-cp", temp_dir, class_name], 
-                        capture_output=True, 
-                        text=True,
-                        timeout=1
-                    )
-                    success = run_result.returncode == 0
-                    message = (
-                        run_result.stdout if success else f"執行失敗:\n{run_result.stderr}"
-                    )
-                except subprocess.TimeoutExpired:
-                    success = False
-                    message = "Execution timed out: The program took more than 1 seconds to run"
+        # 相同的程式碼在同一個 runtime 上結果相同，不必再執行一次
+        cache = get_execution_cache()
+        cache_key = None
+        if cache.accepts(code):
+            cache_key = cache.make_key(code, detected_lang, await runtime_version(detected_lang))
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return cached
 
-        return {"message": message, "success": success, "detected_lang": detected_lang}
+        start = time.perf_counter()
+        result, cacheable = await execute_code(code, detected_lang)
+        EXECUTION_DURATION.labels(detected_lang, "success" if result["success"] else "failure").observe(
+            time.perf_counter() - start
+        )
+
+        if cache_key is not None and cacheable:
+            cache.set(cache_key, result)
+        return result
 
     except Exception as e:
         return {
@@ -209,3 +370,115 @@ def wet_run(code: str):
             "success": False,
             "detected_lang": "unknown",
         }
+
+
+async def execute_code(code: str, detected_lang: str):
+    """
+    依語言執行程式碼
+
+    Returns:
+        (result, cacheable): result 與 wet_run() 的回傳格式相同；
+        timeout 與 sandbox 故障跟機器狀態有關，cacheable 為 False
+    """
+    cacheable = True
+
+    # 根據語言選擇執行方式
+    if detected_lang == "python" and get_python_pool().size > 0:
+        try:
+            run_result = await get_python_pool().run(code, timeout=2)
+            success = run_result["returncode"] == 0 and not run_result["timed_out"]
+            if run_result["timed_out"]:
+                cacheable = False
+                message = TIMEOUT_MESSAGE
+            else:
+                message = (
+                    run_result["stdout"] if success else f"執行失敗:\n{run_result['stderr']}"
+                )
+        except SandboxError as e:
+            cacheable = False
+            success = False
+            message = f"執行失敗:\n{str(e)}"
+
+    elif detected_lang == "python":
+        with tempfile.TemporaryDirectory() as temp_dir:
+            py_file = os.path.join(temp_dir, "script.py")
+            with open(py_file, "w") as f:
+                f.write(code)
+            try:
+                run_result = await run_subprocess(["python3", py_file], timeout=2)
+                success = run_result.returncode == 0
+                message = (
+                    run_result.stdout if success else f"執行失敗:\n{run_result.stderr}"
+                )
+            except subprocess.TimeoutExpired:
+                cacheable = False
+                success = False
+                message = TIMEOUT_MESSAGE
+
+    elif detected_lang == "java":
+        class_pattern = r"public\s+class\s+(\w+)"
+        match = re.search(class_pattern, code)
+        if not match:
+            return {
+                "message": "cant find class name",
+                "success": False,
+                "detected_lang": detected_lang,
+            }, True
+
+        class_name = match.group(1)
+
+        # 常駐的 Java daemon 可用時，省掉 javac + java 兩次冷啟動
+        if await get_java_pool().ready(code):
+            try:
+                run_result = await get_java_pool().run(
+                    code, class_name, compile_timeout=3, timeout=1
+                )
+            except SandboxError as e:
+                cacheable = False
+                run_result = {"status": "RUNTIME_ERROR", "stderr": str(e)}
+
+            if run_result["status"] == "COMPILE_ERROR":
+                return {
+                    "message": f"編譯失敗:\n{run_result['stderr']}",
+                    "success": False,
+                    "detected_lang": detected_lang,
+                }, True
+            success = run_result["status"] == "OK"
+            if run_result["status"] == "TIMEOUT":
+                cacheable = False
+                message = TIMEOUT_MESSAGE
+            else:
+                message = (
+                    run_result["stdout"] if success else f"執行失敗:\n{run_result['stderr']}"
+                )
+            return {"message": message, "success": success, "detected_lang": detected_lang}, cacheable
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            java_file = os.path.join(temp_dir, f"{class_name}.java")
+
+            with open(java_file, "w") as f:
+                f.write(code)
+
+            try:
+                compile_result = await run_subprocess(["javac", java_file], timeout=3)
+                if compile_result.returncode != 0:
+                    print("\nCompile result: ", compile_result)
+                    return {
+                        "message": f"編譯失敗:\n{compile_result.stderr}",
+                        "success": False,
+                        "detected_lang": detected_lang,
+                    }, True
+
+                run_result = await run_subprocess(
+                    ["java", "-cp", temp_dir, class_name], timeout=1
+                )
+                success = run_result.returncode == 0
+                message = (
+                    run_result.stdout if success else f"執行失敗:\n{run_result.stderr}"
+                )
+            except subprocess.TimeoutExpired:
+                cacheable = False
+                success = False
+                message = TIMEOUT_MESSAGE
+
+    return {"message": message, "success": success, "detected_lang": detected_lang}, cacheable
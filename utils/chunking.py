@@ -0,0 +1,167 @@
+from typing import List, Tuple, NamedTuple
+import ast
+import re
+
+
+class Chunk(NamedTuple):
+    start_line: int  # 1-based，在原始檔案中的行號
+    end_line: int
+    text: str
+
+
+MAX_HEADER_LINES = 60
+
+
+def _group(lines: List[str], starts: List[int], max_lines: int) -> List[Chunk]:
+    """
+    依切點把檔案分段，再把相鄰的小段合併到不超過 max_lines
+    (單一段本身超過 max_lines 時就自成一塊)
+
+    Args:
+        starts: 每一段的起始行號 (1-based，遞增)
+    """
+    starts = sorted({1, *[s for s in starts if 1 <= s <= len(lines)]})
+    units = [(start, end - 1) for start, end in zip(starts, starts[1:] + [len(lines) + 1])]
+
+    chunks = []
+    begin, finish = units[0]
+    for start, end in units[1:]:
+        if end - begin + 1 <= max_lines:
+            finish = end
+        else:
+            chunks.append((begin, finish))
+            begin, finish = start, end
+    chunks.append((begin, finish))
+    return [Chunk(start, end, "\n".join(lines[start - 1:end])) for start, end in chunks]
+
+
+def _node_start(node) -> int:
+    decorators = getattr(node, "decorator_list", [])
+    return min([node.lineno] + [d.lineno for d in decorators])
+
+
+def _python_header(tree: ast.Module, lines: List[str]) -> List[str]:
+    header = []
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            header.extend(lines[node.lineno - 1:node.end_lineno])
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            header.append(lines[node.lineno - 1].rstrip() + " ...")
+        elif isinstance(node, ast.ClassDef):
+            header.append(lines[node.lineno - 1].rstrip())
+            for member in node.body:
+                if isinstance(member, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    header.append(lines[member.lineno - 1].rstrip() + " ...")
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)) and node.end_lineno == node.lineno:
+            # 單行的全域常數
+            header.append(lines[node.lineno - 1].rstrip())
+    return header
+
+
+def split_python(code: str, max_lines: int) -> Tuple[str, List[Chunk]]:
+    lines = code.splitlines()
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return "", split_lines(code, max_lines)
+
+    starts = []
+    for node in tree.body:
+        starts.append(_node_start(node))
+        # 太大的 class 再依 method 切開
+        if isinstance(node, ast.ClassDef) and node.end_lineno - _node_start(node) + 1 > max_lines:
+            starts.extend(_node_start(member) for member in node.body[1:])
+
+    # 緊接在定義前的註解跟著那個定義走
+    adjusted = []
+    for start in starts:
+        while start > 1 and lines[start - 2].lstrip().startswith("#"):
+            start -= 1
+        adjusted.append(start)
+
+    return "\n".join(_python_header(tree, lines)[:MAX_HEADER_LINES]), _group(lines, adjusted, max_lines)
+
+
+JAVA_STRIP = re.compile(r"\"(\\.|[^\"\\])*\"|'(\\.|[^'\\])*'|//.*$")
+
+
+def split_java(code: str, max_lines: int) -> Tuple[str, List[Chunk]]:
+    """以 top-level 型別與其成員 (大括號深度 0 / 1) 的邊界切開"""
+    lines = code.splitlines()
+    header = []
+    starts = []
+    depth = 0
+    at_boundary = True
+    annotated = False
+    in_comment = False
+    for number, raw in enumerate(lines, 1):
+        line = raw
+        if in_comment:
+            if "*/" not in line:
+                continue
+            line = line.split("*/", 1)[1]
+            in_comment = False
+        line = JAVA_STRIP.sub("", line)
+        if "/*" in line:
+            before, _, after = line.partition("/*")
+            in_comment = "*/" not in after
+            line = before if in_comment else before + after.split("*/", 1)[1]
+        stripped = line.strip()
+        if not stripped:
+            continue
+
+        if depth <= 1 and (at_boundary or annotated) and not stripped.startswith("}"):
+            # 新的 top-level 型別或成員；annotation 與後面的宣告算同一段
+            if at_boundary:
+                starts.append(number)
+            at_boundary = False
+            annotated = stripped.startswith("@")
+            if not annotated:
+                header.append(raw.rstrip() if depth == 0 or stripped.endswith(";") else raw.rstrip() + " ...")
+
+        depth += line.count("{") - line.count("}")
+        if depth <= 1 and (stripped.endswith((";", "}")) or (depth == 1 and stripped.endswith("{"))):
+            at_boundary = True
+
+    # 緊接在宣告前的註解跟著那個宣告走
+    adjusted = []
+    for start in starts:
+        while start > 1 and lines[start - 2].strip().startswith(("//", "*", "/*")):
+            start -= 1
+        adjusted.append(start)
+
+    return "\n".join(header[:MAX_HEADER_LINES]), _group(lines, adjusted, max_lines)
+
+
+def split_lines(code: str, max_lines: int) -> List[Chunk]:
+    """不認得的語言: 在空白行附近切成固定大小"""
+    lines = code.splitlines()
+    starts = []
+    last = 1
+    for number, line in enumerate(lines, 1):
+        if number - last >= max_lines // 2 and not line.strip():
+            starts.append(number + 1)
+            last = number + 1
+        elif number - last >= max_lines:
+            starts.append(number)
+            last = number
+    return _group(lines, starts, max_lines) if lines else []
+
+
+def split_code(code: str, language: str, max_lines: int = 200) -> Tuple[str, List[Chunk]]:
+    """
+    把大檔案依 top-level function / class 邊界切成數塊
+
+    Args:
+        code (str): 原始程式碼
+        language (str): "python" / "java" / 其他
+        max_lines (int): 每塊的目標行數上限 (單一函數過大時會超過)
+
+    Returns:
+        (header, chunks): header 為 import 與函數簽名等共用脈絡，每塊都會附上
+    """
+    if language == "python":
+        return split_python(code, max_lines)
+    if language == "java":
+        return split_java(code, max_lines)
+    return "", split_lines(code, max_lines)
@@ -0,0 +1,29 @@
+from typing import Callable, Dict, Any
+
+# 名稱 -> build_chain()；各 route 在 import 時註冊
+_builders: Dict[str, Callable[[], Any]] = {}
+# 名稱 -> 編譯好的 graph，整個 process 共用 (compiled graph 本身不保存請求狀態)
+_graphs: Dict[str, Any] = {}
+
+
+def register_graph(name: str, builder: Callable[[], Any]):
+    """註冊一個 LangGraph pipeline 的 build 函數"""
+    _builders[name] = builder
+
+
+def get_graph(name: str):
+    """
+    取得編譯好的 graph；啟動時已由 build_graphs() 建好，
+    沒經過 lifespan (例如 script 直接呼叫) 時第一次使用才編譯
+    """
+    graph = _graphs.get(name)
+    if graph is None:
+        graph = _graphs[name] = _builders[name]()
+    return graph
+
+
+def build_graphs():
+    """編譯所有已註冊的 graph (application 啟動時呼叫)"""
+    for name in _builders:
+        get_graph(name)
+    return list(_graphs)
@@ -0,0 +1,445 @@
+import javax.tools.Diagnostic;
+import javax.tools.DiagnosticCollector;
+import javax.tools.FileObject;
+import javax.tools.ForwardingJavaFileManager;
+import javax.tools.JavaCompiler;
+import javax.tools.JavaFileObject;
+import javax.tools.SimpleJavaFileObject;
+import javax.tools.StandardJavaFileManager;
+import javax.tools.ToolProvider;
+import java.io.BufferedReader;
+import java.io.ByteArrayInputStream;
+import java.io.ByteArrayOutputStream;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.OutputStream;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.net.URI;
+import java.nio.charset.StandardCharsets;
+import java.security.MessageDigest;
+import java.util.ArrayList;
+import java.util.Base64;
+import java.util.HashMap;
+import java.util.LinkedHashMap;
+import java.util.List;
+import java.util.Map;
+
+/**
+ * Long-lived compile-and-run daemon used by utils/java_runner.py.
+ *
+ * Launched with the single-file source launcher ({@code java RunnerDaemon.java}), so no
+ * build step is needed. Compiles with the in-process javax.tools compiler, caches bytecode
+ * by source hash and runs every request in a fresh classloader.
+ *
+ * Protocol (one line each, UTF-8):
+ *   startup:  READY <exitTrap 0|1>   or   NO_COMPILER
+ *   request:  <timeoutMs> <compileTimeoutMs> <className> <base64 source>
+ *   response: <status> <exitCode> <cached 0|1> <wallMs> <base64 stdout> <base64 stderr>
+ * status is one of OK, COMPILE_ERROR, RUNTIME_ERROR, TIMEOUT.
+ * Like the java launcher, a run ends when every non-daemon thread it started has finished.
+ * After a TIMEOUT (compile or run) the daemon halts itself, because the thread cannot be
+ * stopped safely.
+ */
+public class RunnerDaemon {
+    static final int MAX_OUTPUT = Integer.getInteger("runner.maxOutput", 1024 * 1024);
+    static final int CACHE_SIZE = Integer.getInteger("runner.cacheSize", 256);
+
+    static final PrintStream PROTOCOL = new PrintStream(new FileOutputStream(FileDescriptor.out), true);
+    static final RoutingOutputStream STDOUT = new RoutingOutputStream(null);
+    static final RoutingOutputStream STDERR = new RoutingOutputStream(System.err);
+
+    static final JavaCompiler COMPILER = ToolProvider.getSystemJavaCompiler();
+    static StandardJavaFileManager standardFileManager;
+
+    static final Map<String, Map<String, byte[]>> CLASS_CACHE =
+            new LinkedHashMap<String, Map<String, byte[]>>(16, 0.75f, true) {
+                @Override
+                protected boolean removeEldestEntry(Map.Entry<String, Map<String, byte[]>> eldest) {
+                    return size() > CACHE_SIZE;
+                }
+            };
+
+    static volatile ThreadGroup userGroup;
+    /** Status of a System.exit() trapped during the current run, from any of its threads. */
+    static volatile Integer trappedExit;
+
+    /** Thrown instead of exiting the JVM when user code calls System.exit(). */
+    static class ExitTrapped extends SecurityException {
+        final int status;
+
+        ExitTrapped(int status) {
+            super("System.exit(" + status + ")");
+            this.status = status;
+        }
+    }
+
+    static class Source extends SimpleJavaFileObject {
+        final String code;
+
+        Source(String className, String code) {
+            super(URI.create("string:///" + className + Kind.SOURCE.extension), Kind.SOURCE);
+            this.code = code;
+        }
+
+        @Override
+        public CharSequence getCharContent(boolean ignoreEncodingErrors) {
+            return code;
+        }
+    }
+
+    static class ClassOutput extends SimpleJavaFileObject {
+        final ByteArrayOutputStream bytes = new ByteArrayOutputStream();
+
+        ClassOutput(String className, Kind kind) {
+            super(URI.create("mem:///" + className.replace('.', '/') + kind.extension), kind);
+        }
+
+        @Override
+        public OutputStream openOutputStream() {
+            return bytes;
+        }
+    }
+
+    static class MemoryFileManager extends ForwardingJavaFileManager<StandardJavaFileManager> {
+        final Map<String, ClassOutput> outputs = new HashMap<>();
+
+        MemoryFileManager(StandardJavaFileManager fileManager) {
+            super(fileManager);
+        }
+
+        @Override
+        public JavaFileObject getJavaFileForOutput(
+                Location location, String className, JavaFileObject.Kind kind, FileObject sibling) {
+            ClassOutput output = new ClassOutput(className, kind);
+            outputs.put(className, output);
+            return output;
+        }
+
+        Map<String, byte[]> classBytes() {
+            Map<String, byte[]> classes = new HashMap<>();
+            for (Map.Entry<String, ClassOutput> entry : outputs.entrySet()) {
+                classes.put(entry.getKey(), entry.getValue().bytes.toByteArray());
+            }
+            return classes;
+        }
+    }
+
+    /** Isolated loader: only sees the platform classes and this request's bytecode. */
+    static class BytesClassLoader extends ClassLoader {
+        final Map<String, byte[]> classes;
+
+        BytesClassLoader(Map<String, byte[]> classes) {
+            super(ClassLoader.getPlatformClassLoader());
+            this.classes = classes;
+        }
+
+        @Override
+        protected Class<?> findClass(String name) throws ClassNotFoundException {
+            byte[] bytes = classes.get(name);
+            if (bytes == null) {
+                throw new ClassNotFoundException(name);
+            }
+            return defineClass(name, bytes, 0, bytes.length);
+        }
+    }
+
+    /** Keeps the first MAX_OUTPUT bytes and silently drops the rest. */
+    static class LimitedOutputStream extends OutputStream {
+        final ByteArrayOutputStream buffer = new ByteArrayOutputStream();
+        final ThreadGroup group;
+
+        LimitedOutputStream(ThreadGroup group) {
+            this.group = group;
+        }
+
+        @Override
+        public synchronized void write(int b) {
+            if (buffer.size() < MAX_OUTPUT) {
+                buffer.write(b);
+            }
+        }
+
+        @Override
+        public synchronized void write(byte[] b, int off, int len) {
+            int room = MAX_OUTPUT - buffer.size();
+            if (room > 0) {
+                buffer.write(b, off, Math.min(room, len));
+            }
+        }
+    }
+
+    /**
+     * Installed once as System.out / System.err, so they never point at the protocol stream.
+     * Writes from the current run's threads go to its buffer; writes from any other thread
+     * (e.g. one left over from an earlier run) go to the fallback, or nowhere.
+     */
+    static class RoutingOutputStream extends OutputStream {
+        final OutputStream fallback;
+        volatile LimitedOutputStream target;
+
+        RoutingOutputStream(OutputStream fallback) {
+            this.fallback = fallback;
+        }
+
+        OutputStream current() {
+            LimitedOutputStream run = target;
+            if (run != null && run.group.parentOf(Thread.currentThread().getThreadGroup())) {
+                return run;
+            }
+            return fallback;
+        }
+
+        @Override
+        public void write(int b) throws IOException {
+            OutputStream out = current();
+            if (out != null) {
+                out.write(b);
+            }
+        }
+
+        @Override
+        public void write(byte[] b, int off, int len) throws IOException {
+            OutputStream out = current();
+            if (out != null) {
+                out.write(b, off, len);
+            }
+        }
+    }
+
+    @SuppressWarnings("removal")
+    static boolean installExitTrap() {
+        try {
+            System.setSecurityManager(new SecurityManager() {
+                @Override
+                public void checkExit(int status) {
+                    ThreadGroup group = userGroup;
+                    if (group != null && group.parentOf(Thread.currentThread().getThreadGroup())) {
+                        trappedExit = status;
+                        throw new ExitTrapped(status);
+                    }
+                }
+
+                @Override
+                public void checkPermission(java.security.Permission perm) {
+                }
+
+                @Override
+                public void checkPermission(java.security.Permission perm, Object context) {
+                }
+            });
+            return true;
+        } catch (UnsupportedOperationException | SecurityException e) {
+            // JDK 18+ needs -Djava.security.manager=allow; JDK 24+ has no SecurityManager at all
+            return false;
+        }
+    }
+
+    static String sha256(String className, String source) throws Exception {
+        MessageDigest digest = MessageDigest.getInstance("SHA-256");
+        digest.update(className.getBytes(StandardCharsets.UTF_8));
+        digest.update((byte) 0);
+        digest.update(source.getBytes(StandardCharsets.UTF_8));
+        StringBuilder hex = new StringBuilder();
+        for (byte b : digest.digest()) {
+            hex.append(String.format("%02x", b));
+        }
+        return hex.toString();
+    }
+
+    /** Returns the compiled classes, or null with javac-style messages appended to errors. */
+    static Map<String, byte[]> compile(String className, String source, StringBuilder errors) {
+        DiagnosticCollector<JavaFileObject> diagnostics = new DiagnosticCollector<>();
+        MemoryFileManager fileManager = new MemoryFileManager(standardFileManager);
+        List<String> options = new ArrayList<>();
+        options.add("-proc:none");
+        boolean ok = COMPILER.getTask(
+                null, fileManager, diagnostics, options, null, List.of(new Source(className, source))).call();
+        if (ok) {
+            return fileManager.classBytes();
+        }
+        for (Diagnostic<? extends JavaFileObject> d : diagnostics.getDiagnostics()) {
+            errors.append(className).append(".java:").append(d.getLineNumber()).append(": ")
+                    .append(d.getKind().toString().toLowerCase()).append(": ")
+                    .append(d.getMessage(null)).append('\n');
+        }
+        return null;
+    }
+
+    /**
+     * Compiles on a separate thread so a pathological source cannot hold the daemon past
+     * compileTimeoutMs. Returns false on timeout.
+     */
+    static boolean compileWithin(long compileTimeoutMs, String className, String source,
+                                 Map<String, byte[]>[] result, StringBuilder errors) throws InterruptedException {
+        Thread compiler = new Thread(() -> result[0] = compile(className, source, errors), "compiler");
+        compiler.setDaemon(true);
+        compiler.start();
+        compiler.join(Math.max(compileTimeoutMs, 1));
+        return !compiler.isAlive();
+    }
+
+    /**
+     * Waits until every non-daemon thread in the group has finished, or one of them called
+     * System.exit(); false if the deadline passes first.
+     */
+    static boolean awaitThreads(ThreadGroup group, long deadline) throws InterruptedException {
+        while (trappedExit == null) {
+            Thread[] threads = new Thread[group.activeCount() + 1];
+            int count = group.enumerate(threads, true);
+            Thread pending = null;
+            for (int i = 0; i < count; i++) {
+                if (!threads[i].isDaemon() && threads[i].isAlive()) {
+                    pending = threads[i];
+                    break;
+                }
+            }
+            if (pending == null) {
+                return true;
+            }
+            long remainingMs = (deadline - System.nanoTime()) / 1_000_000;
+            if (remainingMs <= 0) {
+                return false;
+            }
+            // wake up now and then to notice a System.exit() from another thread
+            pending.join(Math.min(remainingMs, 50));
+        }
+        return true;
+    }
+
+    static void respond(String status, int exitCode, boolean cached, long wallMs, byte[] out, byte[] err) {
+        Base64.Encoder b64 = Base64.getEncoder();
+        PROTOCOL.println(status + " " + exitCode + " " + (cached ? 1 : 0) + " " + wallMs + " "
+                + b64.encodeToString(out) + " " + b64.encodeToString(err));
+    }
+
+    static void handle(String line) throws Exception {
+        String[] parts = line.split(" ", 4);
+        long timeoutMs = Long.parseLong(parts[0]);
+        long compileTimeoutMs = Long.parseLong(parts[1]);
+        String className = parts[2];
+        String source = new String(Base64.getDecoder().decode(parts[3]), StandardCharsets.UTF_8);
+        long start = System.nanoTime();
+
+        String key = sha256(className, source);
+        Map<String, byte[]> classes = CLASS_CACHE.get(key);
+        boolean cached = classes != null;
+        if (!cached) {
+            StringBuilder errors = new StringBuilder();
+            @SuppressWarnings("unchecked")
+            Map<String, byte[]>[] compiled = new Map[1];
+            if (!compileWithin(compileTimeoutMs, className, source, compiled, errors)) {
+                respond("TIMEOUT", -1, false, (System.nanoTime() - start) / 1_000_000, new byte[0],
+                        ("compilation timed out after " + compileTimeoutMs + " ms").getBytes(StandardCharsets.UTF_8));
+                Runtime.getRuntime().halt(3);
+            }
+            classes = compiled[0];
+            if (classes == null) {
+                respond("COMPILE_ERROR", 1, false, (System.nanoTime() - start) / 1_000_000,
+                        new byte[0], errors.toString().getBytes(StandardCharsets.UTF_8));
+                return;
+            }
+            CLASS_CACHE.put(key, classes);
+        }
+
+        ThreadGroup group = new ThreadGroup("user-code") {
+            @Override
+            public void uncaughtException(Thread t, Throwable e) {
+                // System.exit() from another thread: already recorded in trappedExit
+                if (!(e instanceof ExitTrapped)) {
+                    super.uncaughtException(t, e);
+                }
+            }
+        };
+        LimitedOutputStream out = new LimitedOutputStream(group);
+        LimitedOutputStream err = new LimitedOutputStream(group);
+        PrintStream errStream = new PrintStream(err, true, StandardCharsets.UTF_8);
+        int[] exitCode = {0};
+
+        final Map<String, byte[]> loaded = classes;
+        Thread thread = new Thread(group, () -> {
+            try {
+                Class<?> cls = new BytesClassLoader(loaded).loadClass(className);
+                Method main = cls.getMethod("main", String[].class);
+                main.invoke(null, (Object) new String[0]);
+            } catch (InvocationTargetException e) {
+                Throwable cause = e.getCause();
+                if (cause instanceof ExitTrapped) {
+                    exitCode[0] = ((ExitTrapped) cause).status;
+                } else {
+                    errStream.print("Exception in thread \"main\" ");
+                    cause.printStackTrace(errStream);
+                    exitCode[0] = 1;
+                }
+            } catch (ExitTrapped e) {
+                exitCode[0] = e.status;
+            } catch (Throwable e) {
+                errStream.print("Exception in thread \"main\" ");
+                e.printStackTrace(errStream);
+                exitCode[0] = 1;
+            }
+        }, "main");
+        // non-daemon like the launcher's main thread, so threads it starts are non-daemon too
+        thread.setDaemon(false);
+
+        System.setIn(new ByteArrayInputStream(new byte[0]));
+        trappedExit = null;
+        userGroup = group;
+        STDOUT.target = out;
+        STDERR.target = err;
+        boolean finished;
+        try {
+            thread.start();
+            finished = awaitThreads(group, System.nanoTime() + timeoutMs * 1_000_000);
+        } finally {
+            // output from daemon threads that outlive the run is dropped from here on
+            STDOUT.target = null;
+            STDERR.target = null;
+            userGroup = null;
+        }
+        long wallMs = (System.nanoTime() - start) / 1_000_000;
+
+        if (!finished) {
+            respond("TIMEOUT", -1, cached, wallMs, out.buffer.toByteArray(), err.buffer.toByteArray());
+            Runtime.getRuntime().halt(3);
+        }
+        Integer exited = trappedExit;
+        if (exited == null) {
+            // already finished; join() makes its exitCode write visible here
+            thread.join();
+        }
+        int status = exited != null ? exited : exitCode[0];
+        respond(status == 0 ? "OK" : "RUNTIME_ERROR", status, cached, wallMs,
+                out.buffer.toByteArray(), err.buffer.toByteArray());
+    }
+
+    public static void main(String[] args) throws Exception {
+        if (COMPILER == null) {
+            // running on a JRE without jdk.compiler
+            PROTOCOL.println("NO_COMPILER");
+            return;
+        }
+        standardFileManager = COMPILER.getStandardFileManager(null, null, StandardCharsets.UTF_8);
+        System.setOut(new PrintStream(STDOUT, true, StandardCharsets.UTF_8));
+        System.setErr(new PrintStream(STDERR, true, StandardCharsets.UTF_8));
+        boolean exitTrap = installExitTrap();
+        PROTOCOL.println("READY " + (exitTrap ? 1 : 0));
+
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        String line;
+        while ((line = in.readLine()) != null) {
+            if (line.isEmpty()) {
+                continue;
+            }
+            try {
+                handle(line);
+            } catch (Exception e) {
+                respond("RUNTIME_ERROR", -1, false, 0, new byte[0],
+                        ("runner daemon error: " + e).getBytes(StandardCharsets.UTF_8));
+            }
+        }
+    }
+}
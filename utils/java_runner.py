@@ -0,0 +1,182 @@
+from typing import Optional, Dict, Any
+import asyncio
+import base64
+import os
+import shlex
+import shutil
+from utils.sandbox import WorkerPool, SandboxError, sandbox_env, sandbox_dir
+from utils.tracing import span
+
+DAEMON_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "java", "RunnerDaemon.java")
+# 等待 daemon 印出 READY 的秒數，超過就停用 daemon
+JAVA_RUNNER_START_TIMEOUT = float(os.getenv("JAVA_RUNNER_START_TIMEOUT", "60"))
+
+
+class JavaDaemon:
+    """
+    單一個常駐的 RunnerDaemon JVM (utils/java/RunnerDaemon.java)
+
+    JVM 內用 javax.tools 編譯、以獨立 classloader 執行，並依 source hash 快取 bytecode
+    """
+
+    def __init__(self, java: str, options):
+        self.java = java
+        self.options = options
+        self.runs = 0
+        self.exit_trap = False
+        self.proc: Optional[asyncio.subprocess.Process] = None
+
+    async def start(self):
+        self.proc = await asyncio.create_subprocess_exec(
+            self.java,
+            *self.options,
+            DAEMON_SOURCE,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            limit=64 * 1024 * 1024,
+            env=sandbox_env(),
+            cwd=sandbox_dir(),
+        )
+        # source launcher 要先編譯 RunnerDaemon.java，第一次啟動約需 1 秒
+        try:
+            line = await asyncio.wait_for(self.proc.stdout.readline(), JAVA_RUNNER_START_TIMEOUT)
+        except asyncio.TimeoutError:
+            # 轉成 SandboxError，讓 ready() 停用 daemon 改走 subprocess
+            await self.stop()
+            raise SandboxError(f"java runner daemon did not start within {JAVA_RUNNER_START_TIMEOUT:g} seconds")
+        parts = line.decode().split()
+        if not parts or parts[0] != "READY":
+            await self.stop()
+            raise SandboxError(
+                f"java runner daemon failed to start: {line.decode().strip() or 'no output'}"
+            )
+        self.exit_trap = parts[1] == "1"
+
+    @property
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.returncode is None
+
+    async def run(
+        self, class_name: str, code: str, timeout: float, compile_timeout: float, deadline: float
+    ) -> Dict[str, Any]:
+        self.runs += 1
+        source = base64.b64encode(code.encode()).decode()
+        self.proc.stdin.write(
+            f"{int(timeout * 1000)} {int(compile_timeout * 1000)} {class_name} {source}\n".encode()
+        )
+        await self.proc.stdin.drain()
+        line = await asyncio.wait_for(self.proc.stdout.readline(), deadline)
+        if not line:
+            raise SandboxError("java runner daemon exited unexpectedly")
+        status, exit_code, cached, wall_ms, stdout, stderr = line.decode().rstrip("\n").split(" ")
+        return {
+            "status": status,
+            "returncode": int(exit_code),
+            "cached": cached == "1",
+            "wall_time": int(wall_ms) / 1000,
+            "stdout": base64.b64decode(stdout).decode(errors="replace"),
+            "stderr": base64.b64decode(stderr).decode(errors="replace"),
+        }
+
+    async def stop(self):
+        if self.alive:
+            self.proc.kill()
+            await self.proc.wait()
+
+
+class JavaRunnerPool(WorkerPool):
+    """
+    常駐 Java 編譯 / 執行 daemon 的 pool，省去每次 javac + java 兩次冷啟動 JVM
+
+    Args:
+        size (int): daemon 數量 (每個 daemon 一次只執行一段程式)
+        max_runs (int): 每個 daemon 最多執行幾次就回收
+        java (str): java 執行檔
+        options (list): 啟動 JVM 的參數
+    """
+
+    def __init__(self, size: int, max_runs: int = 200, java: str = "java", options=None):
+        super().__init__(size, max_runs)
+        self.java = java
+        self.options = options or []
+        self.available = size > 0 and shutil.which(java) is not None
+
+    def _new_worker(self):
+        return JavaDaemon(self.java, self.options)
+
+    async def ready(self, code: str) -> bool:
+        """
+        啟動 daemon (若尚未啟動) 並判斷這段程式碼能不能交給 daemon 執行
+
+        daemon 攔不到 System.exit 時 (例如 JDK 24+)，會呼叫 exit 的程式要改走 subprocess
+        """
+        if not self.available:
+            return False
+        try:
+            await self.start()
+        except SandboxError as e:
+            # 例如只有 JRE 沒有 jdk.compiler
+            print(f"Java runner disabled: {e}")
+            self.available = False
+            return False
+        if "System.exit" in code or ".halt(" in code:
+            return bool(self._workers) and all(worker.exit_trap for worker in self._workers)
+        return True
+
+    async def run(self, code: str, class_name: str, compile_timeout: float = 3, timeout: float = 1) -> Dict[str, Any]:
+        """
+        編譯並執行一段 Java 程式碼
+
+        Returns:
+            {
+                "status": "OK" | "COMPILE_ERROR" | "RUNTIME_ERROR" | "TIMEOUT",
+                "returncode": int,
+                "cached": bool,
+                "wall_time": float,
+                "stdout": str,
+                "stderr": str
+            }
+        """
+        worker = await self.acquire()
+        # 出錯或被 cancel (daemon 可能還在執行或回應到一半) 時都換一個新的
+        broken = True
+        try:
+            with span("java_sandbox", timeout=timeout):
+                result = await worker.run(class_name, code, timeout, compile_timeout, compile_timeout + timeout + 5)
+            if result["status"] == "TIMEOUT":
+                # daemon 回覆 TIMEOUT (編譯或執行逾時) 後會自行結束，等它退出再讓 release() 換新
+                await worker.proc.wait()
+            broken = False
+        except (SandboxError, asyncio.TimeoutError, ConnectionError, ValueError) as e:
+            raise SandboxError(str(e) or "java runner daemon timed out")
+        finally:
+            self.release(worker, broken)
+        return result
+
+
+_java_pool: Optional[JavaRunnerPool] = None
+
+
+def get_java_pool() -> JavaRunnerPool:
+    """
+    取得 process 內共用的 Java runner pool，依環境變數設定:
+        JAVA_RUNNER_POOL_SIZE: daemon 數量，0 代表停用 (預設 1)
+        JAVA_RUNNER_MAX_RUNS: 每個 daemon 最多執行幾次就回收 (預設 200)
+        JAVA_RUNNER_JAVA: java 執行檔 (預設 java)
+        JAVA_RUNNER_OPTS: JVM 參數 (預設允許 SecurityManager 以攔截 System.exit)
+    """
+    global _java_pool
+    if _java_pool is None:
+        _java_pool = JavaRunnerPool(
+            size=int(os.getenv("JAVA_RUNNER_POOL_SIZE", "1")),
+            max_runs=int(os.getenv("JAVA_RUNNER_MAX_RUNS", "200")),
+            java=os.getenv("JAVA_RUNNER_JAVA", "java"),
+            options=shlex.split(
+                os.getenv(
+                    "JAVA_RUNNER_OPTS",
+                    "-Djava.security.manager=allow -XX:+UseSerialGC -Xshare:auto",
+                )
+            ),
+        )
+    return _java_pool
@@ -0,0 +1,133 @@
+from typing import Optional, Dict
+from kubernetes.utils import parse_quantity
+import os
+import re
+from utils.sandbox import get_python_pool, SandboxError
+from utils.java_runner import get_java_pool
+from utils.k8s.resources import ResourceLimits, K8S_DEFAULT_CPU, K8S_DEFAULT_MEMORY
+
+# /k8s 的執行方式: k8s (全部送到叢集)、auto (依大小分流)、local (全部在本機 sandbox)
+# 本機 sandbox 與 API server 在同一台機器上，預設不使用，需要時才開啟
+EXECUTION_BACKEND = os.getenv("EXECUTION_BACKEND", "k8s")
+# auto 時可以在本機執行的程式碼大小與 timeout 上限，超過就送到叢集
+# (本機與 wet_run 共用 sandbox pool，timeout 上限要短，才不會長時間佔住 worker)
+LOCAL_MAX_CODE_BYTES = int(os.getenv("LOCAL_MAX_CODE_BYTES", "4096"))
+LOCAL_MAX_TIMEOUT = float(os.getenv("LOCAL_MAX_TIMEOUT", "3"))
+# 與 utils/k8s/resources.measured_script 的 coreutils timeout 一致
+TIMEOUT_EXIT_CODE = 124
+
+
+class ExecutionBackend:
+    """
+    執行一個 K8sJob 的方式，execute() 結束前必須呼叫 job.finish()
+
+    不論哪個 backend 執行，job 的 status / log / exit_code / metrics 格式都相同
+    """
+
+    name = ""
+
+    async def accepts(self, code: str, language: str, limits: ResourceLimits) -> bool:
+        return True
+
+    async def execute(self, job, code: str):
+        raise NotImplementedError
+
+
+class LocalBackend(ExecutionBackend):
+    """
+    在本機的 sandbox 執行 (與 wet_run 相同的 Python sandbox pool 與 Java runner daemon)
+
+    不必等 Kubernetes 排程，適合小的程式；也讓沒有叢集的開發環境可以使用 /k8s。
+    本機無法限制 CPU 配額，要求比預設更多 CPU / 記憶體的請求不會接受。
+    """
+
+    name = "local"
+
+    async def accepts(self, code: str, language: str, limits: ResourceLimits) -> bool:
+        if parse_quantity(limits.cpu) > parse_quantity(K8S_DEFAULT_CPU):
+            return False
+        if language == "python3":
+            pool = get_python_pool()
+            return pool.size > 0 and parse_quantity(limits.memory) <= pool.memory_mb * 1024 * 1024
+        if language == "java21":
+            # daemon 的 JVM 由所有程式共用，無法單獨限制記憶體
+            if parse_quantity(limits.memory) > parse_quantity(K8S_DEFAULT_MEMORY):
+                return False
+            return re.search(r"public\s+class\s+\w+", code) is not None and await get_java_pool().ready(code)
+        return False
+
+    async def execute(self, job, code: str):
+        job.set_status("Running")
+        try:
+            if job.language == "python3":
+                status, log, metrics = await self._run_python(code, job.limits)
+            else:
+                status, log, metrics = await self._run_java(code, job.limits)
+        except SandboxError as e:
+            print(f"Job {job.id} failed in local sandbox: {e}")
+            job.finish("Error", error=str(e))
+            return
+        if log:
+            await job.publish_log(log)
+        job.finish(status, log=log, exit_code=metrics["exit_code"], metrics=metrics)
+
+    async def _run_python(self, code: str, limits: ResourceLimits):
+        memory_mb = int(parse_quantity(limits.memory) / (1024 * 1024))
+        result = await get_python_pool().run(code, timeout=limits.timeout, memory_mb=memory_mb)
+        exit_code = TIMEOUT_EXIT_CODE if result["timed_out"] else result["returncode"]
+        metrics = {
+            "wall_time": round(result["wall_time"], 4),
+            "cpu_time": round(result["cpu_time"], 4),
+            "peak_memory_kb": result["max_rss_kb"],
+            "exit_code": exit_code,
+            "timed_out": result["timed_out"],
+        }
+        # 叢集上 stdout 與 stderr 會合併在 pod log 裡
+        return _phase(exit_code), result["stdout"] + result["stderr"], metrics
+
+    async def _run_java(self, code: str, limits: ResourceLimits):
+        class_name = re.search(r"public\s+class\s+(\w+)", code).group(1)
+        result = await get_java_pool().run(code, class_name, compile_timeout=3, timeout=limits.timeout)
+        if result["status"] == "TIMEOUT":
+            exit_code = TIMEOUT_EXIT_CODE
+        elif result["status"] == "COMPILE_ERROR":
+            exit_code = result["returncode"] or 1
+        else:
+            exit_code = result["returncode"]
+        # daemon 內的程式共用同一個 JVM，無法取得單次執行的 CPU 與記憶體
+        metrics = {
+            "wall_time": result["wall_time"],
+            "cpu_time": None,
+            "peak_memory_kb": None,
+            "exit_code": exit_code,
+            "timed_out": result["status"] == "TIMEOUT",
+        }
+        return _phase(exit_code), result["stdout"] + result["stderr"], metrics
+
+
+def _phase(exit_code: int) -> str:
+    return "Succeeded" if exit_code == 0 else "Failed"
+
+
+def is_small(code: str, limits: ResourceLimits) -> bool:
+    """auto 模式的分流條件: 程式碼小且 timeout 短的送到本機，其餘送到叢集"""
+    return len(code.encode()) <= LOCAL_MAX_CODE_BYTES and limits.timeout <= LOCAL_MAX_TIMEOUT
+
+
+async def select_backend(
+    backends: Dict[str, ExecutionBackend], code: str, language: str, limits: ResourceLimits, mode: str
+) -> Optional[ExecutionBackend]:
+    """
+    依 mode 選擇執行的 backend
+
+    Returns:
+        要使用的 backend；mode 為 local 但本機無法執行這個請求時回傳 None
+    """
+    local, cluster = backends["local"], backends["k8s"]
+    if mode == "k8s":
+        return cluster
+    if mode == "local":
+        return local if await local.accepts(code, language, limits) else None
+    if is_small(code, limits) and await local.accepts(code, language, limits):
+        return local
+    return cluster
@@ -0,0 +1,159 @@
+from typing import Optional, Dict, Any
+from datetime import datetime, timezone
+from kubernetes import client
+import asyncio
+import os
+import time
+
+# 這個服務建立的所有 Kubernetes 物件都帶 owner label，reaper 只會清理自己的物件
+K8S_OWNER = os.getenv("K8S_OWNER", "hack-backend")
+# Job 結束後保留多久 (ttlSecondsAfterFinished，之後連同 pod 一起刪除)
+K8S_JOB_TTL = int(os.getenv("K8S_JOB_TTL", "300"))
+# 沒有 owner 的 ConfigMap 存在超過這個秒數就視為孤兒 (需大於 K8S_JOB_TIMEOUT)
+K8S_ORPHAN_AGE = int(os.getenv("K8S_ORPHAN_AGE", "900"))
+# reaper 執行間隔秒數，0 代表停用
+K8S_REAPER_INTERVAL = float(os.getenv("K8S_REAPER_INTERVAL", "60"))
+
+OWNER_LABEL = "owner"
+REQUEST_ID_LABEL = "request-id"
+
+
+def owner_labels(request_id: Optional[str] = None) -> Dict[str, str]:
+    labels = {OWNER_LABEL: K8S_OWNER}
+    if request_id:
+        labels[REQUEST_ID_LABEL] = str(request_id)
+    return labels
+
+
+def owner_reference(job) -> Dict[str, Any]:
+    """指向 Job 的 ownerReference，Job 被刪除時 Kubernetes 會一併刪除被擁有的物件"""
+    return {
+        "apiVersion": "batch/v1",
+        "kind": "Job",
+        "name": job.metadata.name,
+        "uid": job.metadata.uid,
+        "blockOwnerDeletion": False,
+    }
+
+
+def _age(timestamp: Optional[datetime], now: datetime) -> float:
+    if timestamp is None:
+        return 0
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return (now - timestamp).total_seconds()
+
+
+def _finished_at(job) -> Optional[datetime]:
+    status = job.status
+    if status is None:
+        return None
+    for condition in status.conditions or []:
+        if condition.type in ("Complete", "Failed") and condition.status == "True":
+            return condition.last_transition_time or status.completion_time
+    return None
+
+
+class JobReaper:
+    """
+    定期清理這個服務留下的 Kubernetes 物件 (以 owner label 篩選)
+
+    - 已結束超過 K8S_JOB_TTL 的 Job (叢集沒有 TTL controller、或 label 加上之前的 Job)，pod 一併刪除
+    - 沒有 ownerReference、存在超過 K8S_ORPHAN_AGE 的 ConfigMap (process 在建立 Job 前就掛掉)
+    - 已經結束的 runner pod
+
+    Args:
+        core_api / batch_api: CoreV1Api / BatchV1Api (測試時可傳入假的 API)
+        namespace (str): 要清理的 namespace
+    """
+
+    def __init__(
+        self,
+        core_api,
+        batch_api,
+        namespace: str,
+        job_ttl: int = K8S_JOB_TTL,
+        orphan_age: int = K8S_ORPHAN_AGE,
+        interval: float = K8S_REAPER_INTERVAL,
+    ):
+        self.core_api = core_api
+        self.batch_api = batch_api
+        self.namespace = namespace
+        self.job_ttl = job_ttl
+        self.orphan_age = orphan_age
+        self.interval = interval
+        self.selector = f"{OWNER_LABEL}={K8S_OWNER}"
+        self._task: Optional[asyncio.Task] = None
+        self.metrics = {
+            "runs": 0,
+            "jobs_deleted": 0,
+            "configmaps_deleted": 0,
+            "pods_deleted": 0,
+            "errors": 0,
+            "last_run": None,
+            "last_duration": None,
+        }
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.ensure_future(self._loop())
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.reap)
+            except Exception as e:
+                self.metrics["errors"] += 1
+                print(f"Reaper failed: {e}")
+
+    def _delete(self, kind: str, delete, name: str) -> bool:
+        try:
+            delete(name=name, namespace=self.namespace, propagation_policy="Background")
+            return True
+        except client.exceptions.ApiException as e:
+            if e.status != 404:
+                self.metrics["errors"] += 1
+                print(f"Failed to delete {kind} {name}: {e}")
+            return False
+
+    def reap(self) -> Dict[str, int]:
+        """清理一輪 (blocking)，回傳這一輪刪除的數量"""
+        start = time.perf_counter()
+        now = datetime.now(timezone.utc)
+        removed = {"jobs": 0, "configmaps": 0, "pods": 0}
+
+        for job in self.batch_api.list_namespaced_job(self.namespace, label_selector=self.selector).items:
+            finished = _finished_at(job)
+            if finished is not None and _age(finished, now) > self.job_ttl:
+                removed["jobs"] += self._delete("job", self.batch_api.delete_namespaced_job, job.metadata.name)
+
+        for configmap in self.core_api.list_namespaced_config_map(self.namespace, label_selector=self.selector).items:
+            metadata = configmap.metadata
+            if not metadata.owner_references and _age(metadata.creation_timestamp, now) > self.orphan_age:
+                removed["configmaps"] += self._delete(
+                    "configmap", self.core_api.delete_namespaced_config_map, metadata.name
+                )
+
+        pods = self.core_api.list_namespaced_pod(self.namespace, label_selector=f"{self.selector},app=code-runner")
+        for pod in pods.items:
+            if pod.status is not None and pod.status.phase in ("Succeeded", "Failed"):
+                removed["pods"] += self._delete("pod", self.core_api.delete_namespaced_pod, pod.metadata.name)
+
+        self.metrics["runs"] += 1
+        self.metrics["jobs_deleted"] += removed["jobs"]
+        self.metrics["configmaps_deleted"] += removed["configmaps"]
+        self.metrics["pods_deleted"] += removed["pods"]
+        self.metrics["last_run"] = time.time()
+        self.metrics["last_duration"] = round(time.perf_counter() - start, 3)
+        if any(removed.values()):
+            print(f"Reaper removed {removed}")
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.metrics)
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
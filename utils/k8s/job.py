@@ -1,50 +1,150 @@
+from typing import Optional, Dict, Any, Callable, Tuple, List, AsyncIterator
 import yaml
 import time
-from kubernetes import client, config
+from kubernetes import client, config, watch
+from kubernetes.config import incluster_config, kube_config
 from pathlib import Path
+from utils.k8s.pool import RunnerPool, K8S_POOL_SIZE, RUNNER_LABEL
+from utils.k8s.gc import JobReaper, K8S_JOB_TTL, owner_labels, owner_reference
+from utils.k8s.resources import ResourceLimits, resolve_limits, measured_script, parse_metrics, MetricsFilter
+from utils.k8s.backends import ExecutionBackend, LocalBackend, EXECUTION_BACKEND, select_backend
+from utils.metrics import PhaseTimer, K8S_PHASE_DURATION, K8S_JOB_DURATION
+import asyncio
+import codecs
+import threading
+import uuid
 import random
 import re
 import os
 
-def load_kube_config():
-    """Load Kubernetes config."""
+K8S_NAMESPACE = os.getenv("K8S_NAMESPACE", "default")
+# 等待 pod 跑完的上限秒數 (含排程與拉 image)
+K8S_JOB_TIMEOUT = float(os.getenv("K8S_JOB_TIMEOUT", "300"))
+# 保留在記憶體中供查詢的 job 數量
+K8S_JOB_HISTORY = int(os.getenv("K8S_JOB_HISTORY", "1000"))
+# 串流 log 時每個 client 最多暫存的片段數，滿了就讓讀 log 的一方等待 (backpressure)
+K8S_LOG_QUEUE_SIZE = int(os.getenv("K8S_LOG_QUEUE_SIZE", "64"))
+# client 卡住超過這個秒數就中斷它的串流，避免拖慢 job 本身
+K8S_LOG_CLIENT_TIMEOUT = float(os.getenv("K8S_LOG_CLIENT_TIMEOUT", "30"))
+JOB_YAML_DIR = os.path.dirname(os.path.abspath(__file__))
+TERMINAL_PHASES = ("Succeeded", "Failed")
+# 與 API server 之間的 HTTP connection pool 大小
+K8S_CONNECTION_POOL_SIZE = int(os.getenv("K8S_CONNECTION_POOL_SIZE", "20"))
+
+# 長駐的 Kubernetes ApiClient，所有 helper 與 JobManager 共用同一個 connection pool
+_api_client: Optional[client.ApiClient] = None
+_api_client_credentials: Optional[Tuple] = None
+_api_client_lock = threading.Lock()
+
+
+def _credential_files() -> Tuple:
+    """kubeconfig 與 service account 憑證檔的 (路徑, mtime)，用來偵測憑證輪替"""
+    paths = os.path.expanduser(
+        os.getenv("KUBECONFIG", kube_config.KUBE_CONFIG_DEFAULT_LOCATION)
+    ).split(kube_config.ENV_KUBECONFIG_PATH_SEPARATOR)
+    paths += [incluster_config.SERVICE_TOKEN_FILENAME, incluster_config.SERVICE_CERT_FILENAME]
+    stamps = []
+    for path in paths:
+        try:
+            stamps.append((path, os.stat(path).st_mtime_ns))
+        except OSError:
+            continue
+    return tuple(stamps)
+
+
+def _load_configuration() -> client.Configuration:
+    configuration = client.Configuration()
     try:
-        config.load_kube_config()  # Use local kubeconfig
-    except:
-        config.load_incluster_config()  # Use in-cluster config if running inside GKE
+        config.load_kube_config(client_configuration=configuration)  # Use local kubeconfig
+    except (config.ConfigException, FileNotFoundError):
+        # Use in-cluster config if running inside GKE (token 過期前會自動重新讀取)
+        config.load_incluster_config(client_configuration=configuration)
+    configuration.connection_pool_maxsize = K8S_CONNECTION_POOL_SIZE
+    return configuration
+
 
-def create_configmap_from_file(configmap_name: str, code_content, language: str):
+def get_api_client() -> client.ApiClient:
     """
-    Creates a Kubernetes ConfigMap from a given file.
+    取得 process 內共用的 Kubernetes ApiClient，第一次呼叫時才讀取 kubeconfig
 
-    :param configmap_name: Name of the ConfigMap
-    :param file_path: Path to the file to be stored in the ConfigMap
-    :param language: Language of the file (default: "python")
+    之後只在 kubeconfig / service account 憑證檔變動 (憑證輪替) 時才重新載入；
+    connection pool 大小可透過 K8S_CONNECTION_POOL_SIZE 調整 (預設 20)
     """
-    load_kube_config()
-    if language == "python3":
-        filename = "user_code.py"
-    elif language == "java21":
+    global _api_client, _api_client_credentials
+    credentials = _credential_files()
+    if _api_client is not None and credentials == _api_client_credentials:
+        return _api_client
+    with _api_client_lock:
+        if _api_client is None or credentials != _api_client_credentials:
+            if _api_client is not None:
+                print("Kubernetes credentials changed, reloading config")
+            _api_client = client.ApiClient(_load_configuration())
+            _api_client_credentials = credentials
+        return _api_client
+
+
+def load_kube_config() -> client.ApiClient:
+    """Load Kubernetes config (回傳共用的 ApiClient)."""
+    return get_api_client()
+
+
+class SharedApi:
+    """
+    每次使用時都綁定目前共用 ApiClient 的 API 物件 (例如 SharedApi(client.CoreV1Api))，
+    讓長駐的 JobManager / PodWatcher 在憑證輪替後也會用到新的 client
+    """
+
+    def __init__(self, api_class):
+        self.api_class = api_class
+
+    def __getattr__(self, name):
+        return getattr(self.api_class(get_api_client()), name)
+
+
+def code_filename(code_content: str, language: str) -> str:
+    """程式碼在容器內的檔名 (Java 需與 public class 同名)"""
+    if language == "java21":
         class_pattern = r"public\s+class\s+(\w+)"
         match = re.search(class_pattern, code_content)
         if match is None:
             class_pattern = r"class\s+(\w+)"
             match = re.search(class_pattern, code_content)
         class_name = match.group(1)
-        filename = f"{class_name}.java"
+        return f"{class_name}.java"
+    return "user_code.py"
+
+
+def create_configmap_from_file(
+    configmap_name: str, code_content, language: str, core_api=None, request_id=None, namespace: str = "default"
+):
+    """
+    Creates a Kubernetes ConfigMap from a given file.
+
+    :param configmap_name: Name of the ConfigMap
+    :param file_path: Path to the file to be stored in the ConfigMap
+    :param language: Language of the file (default: "python")
+    :param core_api: CoreV1Api to use (default: the shared client)
+    :param request_id: Value of the request-id label (for garbage collection)
+    :param namespace: Namespace to create the ConfigMap in (default: "default")
+    """
+    filename = code_filename(code_content, language)
 
     # Define the ConfigMap object
     configmap = client.V1ConfigMap(
-        metadata=client.V1ObjectMeta(name=configmap_name),
+        metadata=client.V1ObjectMeta(name=configmap_name, labels=owner_labels(request_id)),
         data={filename: code_content}  # Use filename as the key
     )
 
     # Connect to Kubernetes API
-    v1 = client.CoreV1Api()
+    if core_api is None:
+        core_api = client.CoreV1Api(get_api_client())
+    v1 = core_api
 
     try:
-        v1.create_namespaced_config_map(namespace="default", body=configmap)
-        print(f"ConfigMap '{configmap_name}' created successfully in namespace default.")
+        start = time.perf_counter()
+        v1.create_namespaced_config_map(namespace=namespace, body=configmap)
+        K8S_PHASE_DURATION.labels(language, "configmap").observe(time.perf_counter() - start)
+        print(f"ConfigMap '{configmap_name}' created successfully in namespace '{namespace}'.")
     except client.exceptions.ApiException as e:
         if e.status == 409:  # Conflict: ConfigMap already exists
             print(f"ConfigMap '{configmap_name}' already exists.")
@@ -53,52 +153,84 @@ def create_configmap_from_file(configmap_name: str, code_content, language: str)
     
     return filename
 
-def deploy_job(yaml_file, new_configmap_name, code_filename, language):
-    load_kube_config()
-    """Deploy a job from a YAML file to the GKE cluster and fetch logs."""
+def build_job_manifest(yaml_file, new_configmap_name, code_filename, language, suffix=None, limits=None):
+    """
+    讀入 job yaml，填入 job 名稱、ConfigMap、執行指令與資源限制
+
+    執行指令會在輸出最後附上 cgroup 量測結果 (見 utils.k8s.resources.parse_metrics)；
+    limits 不給時套用預設的 CPU / 記憶體 / timeout
+    """
+    limits = limits or resolve_limits()
     with open(yaml_file, "r") as file:
         job_manifest = yaml.safe_load(file)
 
-    api_instance = client.BatchV1Api()
-    core_api = client.CoreV1Api()
-    namespace = job_manifest["metadata"].get("namespace", "default")
-    job_manifest["metadata"]["name"] = f"{job_manifest['metadata']['name']}-{random.randint(1, 1000000000)}"
-    job_name = job_manifest["metadata"]["name"]
+    suffix = suffix or random.randint(1, 1000000000)
+    job_manifest["metadata"]["name"] = f"{job_manifest['metadata']['name']}-{suffix}"
+    # owner / request-id label 讓 reaper 找得到；結束後由 TTL controller 連同 pod 一起刪除
+    job_manifest["metadata"]["labels"] = owner_labels(suffix)
+    job_manifest["spec"]["template"].setdefault("metadata", {})["labels"] = owner_labels(suffix)
+    job_manifest["spec"]["ttlSecondsAfterFinished"] = K8S_JOB_TTL
     job_manifest["spec"]["template"]["spec"]["volumes"][0]["configMap"]["name"] = new_configmap_name
 
+    # 整個 Job (含排程與拉 image) 的時間上限，程式本身另外以 timeout 限制
+    job_manifest["spec"]["activeDeadlineSeconds"] = limits.deadline
+    container = job_manifest["spec"]["template"]["spec"]["containers"][0]
+    container["resources"] = limits.resources()
+
     # set command based on language
     if language == "python3":
-        job_manifest["spec"]["template"]["spec"]["containers"][0]["command"] = ["python3", f"/mnt/config/{code_filename}"]
+        container["command"] = [
+            "/bin/sh", "-c",
+            measured_script(f"python3 /mnt/config/{code_filename} < /dev/null 2>&1", limits.timeout),
+        ]
     elif language == "java21":
         compiled_filename = code_filename.split(".")[0]
-        job_manifest["spec"]["template"]["spec"]["containers"][0]["command"] = [
+        container["command"] = [
             "/bin/sh", "-c",
-            f"cp /mnt/config/{code_filename} /tmp/ && cd /tmp/ && javac {code_filename} && java {compiled_filename}"
+            measured_script(
+                f"java {compiled_filename} < /dev/null 2>&1",
+                limits.timeout,
+                prepare=f"cp /mnt/config/{code_filename} /tmp/ && cd /tmp/ && javac {code_filename} 2>&1",
+            ),
         ]
+    return job_manifest
+
+
+def deploy_job(yaml_file, new_configmap_name, code_filename, language):
+    """Deploy a job from a YAML file to the GKE cluster and fetch logs (blocking)."""
+    job_manifest = build_job_manifest(yaml_file, new_configmap_name, code_filename, language)
+
+    api_instance = client.BatchV1Api(get_api_client())
+    core_api = client.CoreV1Api(get_api_client())
+    namespace = job_manifest["metadata"].get("namespace", "default")
+    job_name = job_manifest["metadata"]["name"]
 
     # Create the job
+    timer = PhaseTimer(language)
     response = api_instance.create_namespaced_job(
         body=job_manifest, namespace=namespace
     )
     print(f"Job {job_name} created in namespace {namespace}")
+    adopt_configmap(new_configmap_name, response, core_api, namespace)
 
-    # Wait for the job to start and get pod name
-    pod_name = None
-    while not pod_name:
-        time.sleep(2)
-        pod_list = core_api.list_namespaced_pod(namespace, label_selector=f"job-name={job_name}")
-        if pod_list.items:
-            pod_name = pod_list.items[0].metadata.name
-    
-    print(f"Pod {pod_name} found for job {job_name}")
-
-    # Wait for pod to complete
-    while True:
-        pod_status = core_api.read_namespaced_pod_status(pod_name, namespace)
-        phase = pod_status.status.phase
-        if phase in ["Succeeded", "Failed"]:
+    # Wait for the pod to finish (watch 事件一到就處理，不用 polling)
+    pod_name, phase = None, None
+    w = watch.Watch()
+    for event in w.stream(
+        core_api.list_namespaced_pod,
+        namespace,
+        label_selector=f"job-name={job_name}",
+        timeout_seconds=int(K8S_JOB_TIMEOUT),
+    ):
+        pod_name = event["object"].metadata.name
+        phase = event["object"].status.phase
+        if phase:
+            timer.phase(phase)
+        if phase in TERMINAL_PHASES:
+            w.stop()
             break
-        time.sleep(2)
+    if phase not in TERMINAL_PHASES:
+        raise TimeoutError(f"Job {job_name} did not finish within {K8S_JOB_TIMEOUT} seconds")
 
     print(f"Pod {pod_name} finished with status: {phase}")
 
@@ -108,29 +240,580 @@ def deploy_job(yaml_file, new_configmap_name, code_filename, language):
 
     return logs, phase
 
-def delete_configmap(configmap_name: str):
+def adopt_configmap(configmap_name: str, job, core_api=None, namespace: str = "default"):
+    """
+    讓 ConfigMap 的 ownerReference 指向 Job，
+    之後 Job 被刪除 (TTL 或 reaper) 時 Kubernetes 會一併刪掉 ConfigMap
+    """
+    if job is None or job.metadata is None or not job.metadata.uid:
+        return
+    if core_api is None:
+        core_api = client.CoreV1Api(get_api_client())
+    try:
+        core_api.patch_namespaced_config_map(
+            configmap_name, namespace, {"metadata": {"ownerReferences": [owner_reference(job)]}}
+        )
+    except client.exceptions.ApiException as e:
+        if e.status != 404:
+            print(f"Error setting owner of ConfigMap '{configmap_name}': {e}")
+
+
+def delete_configmap(configmap_name: str, core_api=None, namespace: str = "default"):
     """
     Deletes a ConfigMap from a Kubernetes cluster.
 
     :param configmap_name: Name of the ConfigMap to delete.
+    :param core_api: CoreV1Api to use (default: the shared client)
     :param namespace: Namespace where the ConfigMap exists (default: "default").
     """
-    load_kube_config()
     # Connect to Kubernetes API
-    v1 = client.CoreV1Api()
+    if core_api is None:
+        core_api = client.CoreV1Api(get_api_client())
+    v1 = core_api
 
     try:
-        v1.delete_namespaced_config_map(name=configmap_name, namespace="default")
-        print(f"ConfigMap '{configmap_name}' deleted successfully from namespace default.")
+        v1.delete_namespaced_config_map(name=configmap_name, namespace=namespace)
+        print(f"ConfigMap '{configmap_name}' deleted successfully from namespace '{namespace}'.")
     except client.exceptions.ApiException as e:
         if e.status == 404:  # ConfigMap not found
-            print(f"ConfigMap '{configmap_name}' not found in namespace default.")
+            print(f"ConfigMap '{configmap_name}' not found in namespace '{namespace}'.")
         else:
             print(f"Error deleting ConfigMap: {e}")
 
 # Example Usage:
 # delete_configmap("my-config")
 
+
+# ---------------------------------------------------------------- watch 驅動的 job 生命週期
+
+class PodWatcher:
+    """
+    用一條背景 thread 對 namespace 內符合 label_selector 的 pod 開一個 watch，
+    依 key_label 的值 (預設為 job-name) 把 phase 變化轉給登記的 callback
+    (在各自的 event loop 上執行)；pod 被刪除時 phase 為 "Deleted"。
+
+    取代每個請求各自 sleep(2) polling：事件一到就處理，等待中的請求也不佔 thread。
+
+    Args:
+        core_api: CoreV1Api (測試時可傳入假的 API)
+        namespace (str): 要 watch 的 namespace
+        watch_factory: 建立 watch 物件的函數，物件需提供 stream() 與 stop()
+        label_selector (str): 要 watch 的 pod
+        key_label (str): 用來分派事件的 label
+    """
+
+    def __init__(
+        self,
+        core_api,
+        namespace: str = K8S_NAMESPACE,
+        watch_factory=watch.Watch,
+        label_selector: str = "job-name",
+        key_label: str = "job-name",
+    ):
+        self.core_api = core_api
+        self.namespace = namespace
+        self.watch_factory = watch_factory
+        self.label_selector = label_selector
+        self.key_label = key_label
+        self._callbacks: Dict[str, Tuple[asyncio.AbstractEventLoop, Callable[[str, str], None]]] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._watch = None
+
+    def register(self, key: str, callback: Callable[[str, str], None]):
+        """
+        key_label 為 key 的 pod 每次有事件就以 callback(pod_name, phase) 通知；
+        必須在建立 job / pod 之前登記，才不會漏掉事件
+        """
+        with self._lock:
+            self._callbacks[key] = (asyncio.get_running_loop(), callback)
+        self.start()
+
+    def unregister(self, key: str):
+        with self._lock:
+            self._callbacks.pop(key, None)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="k8s-pod-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._watch is not None:
+            self._watch.stop()
+
+    def _dispatch(self, pod, deleted: bool = False):
+        labels = pod.metadata.labels or {}
+        with self._lock:
+            registered = self._callbacks.get(labels.get(self.key_label))
+        phase = "Deleted" if deleted else (pod.status.phase if pod.status is not None else None)
+        if registered is not None and phase:
+            loop, callback = registered
+            loop.call_soon_threadsafe(callback, pod.metadata.name, phase)
+
+    def _run(self):
+        resource_version = None
+        while not self._stopped.is_set():
+            try:
+                if resource_version is None:
+                    # 第一次或 watch 過期 (410) 時先 list 一次，補上中間漏掉的狀態
+                    pods = self.core_api.list_namespaced_pod(self.namespace, label_selector=self.label_selector)
+                    for pod in pods.items:
+                        self._dispatch(pod)
+                    resource_version = pods.metadata.resource_version
+
+                self._watch = self.watch_factory()
+                for event in self._watch.stream(
+                    self.core_api.list_namespaced_pod,
+                    self.namespace,
+                    label_selector=self.label_selector,
+                    resource_version=resource_version,
+                    timeout_seconds=60,
+                ):
+                    pod = event["object"]
+                    resource_version = pod.metadata.resource_version or resource_version
+                    self._dispatch(pod, deleted=event["type"] == "DELETED")
+                    if self._stopped.is_set():
+                        break
+            except client.exceptions.ApiException as e:
+                if e.status != 410:
+                    print(f"Pod watch error: {e}")
+                    self._stopped.wait(1)
+                resource_version = None
+            except Exception as e:
+                print(f"Pod watch error: {e}")
+                resource_version = None
+                self._stopped.wait(1)
+
+
+def _exit_code(pod) -> Optional[int]:
+    for status in (pod.status.container_statuses or []) if pod.status is not None else []:
+        if status.state is not None and status.state.terminated is not None:
+            return status.state.terminated.exit_code
+    return None
+
+
+class K8sJob:
+    """
+    一個 /k8s 執行請求的狀態，status 依序為 Submitted -> Pending -> Running -> Succeeded / Failed (或 Error)
+
+    執行中的 log 片段會即時轉給 events() 的訂閱者；每個訂閱者有自己的有界佇列，
+    佇列滿時讀 log 的一方會等待，而不是無限制地把 log 堆在記憶體裡。
+    """
+
+    def __init__(self, job_id: str, language: str, limits: ResourceLimits):
+        self.id = job_id
+        self.language = language
+        self.limits = limits
+        self.metrics: Optional[Dict[str, Any]] = None
+        self.backend: Optional[str] = None  # 實際執行的 backend: local / k8s
+        self.status = "Submitted"
+        self.pod: Optional[str] = None
+        self.log: Optional[str] = None
+        self.exit_code: Optional[int] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.done = asyncio.Event()
+        self.log_parts: List[str] = []
+        self._subscribers: List[asyncio.Queue] = []
+
+    @property
+    def finished(self) -> bool:
+        return self.done.is_set()
+
+    def set_status(self, status: str):
+        self.status = status
+        # 狀態事件只是提示 (最後的 result 會帶最終狀態)，佇列滿時直接略過
+        for queue in self._subscribers:
+            try:
+                queue.put_nowait(("status", {"status": status}))
+            except asyncio.QueueFull:
+                pass
+
+    async def publish_log(self, text: str):
+        """新增一段 log 並送給所有訂閱者，訂閱者的佇列滿時等待"""
+        self.log_parts.append(text)
+        for queue in list(self._subscribers):
+            try:
+                await asyncio.wait_for(queue.put(("log", {"content": text})), K8S_LOG_CLIENT_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.unsubscribe(queue)
+                queue.put_nowait(("error", {"detail": "client is too slow, log stream dropped"}))
+                queue.put_nowait(None)
+
+    def finish(
+        self,
+        status: str,
+        log: Optional[str] = None,
+        error: Optional[str] = None,
+        exit_code: Optional[int] = None,
+        metrics: Optional[Dict[str, Any]] = None,
+    ):
+        self.status = status
+        self.log = log
+        self.error = error
+        self.exit_code = exit_code
+        self.metrics = metrics
+        self.finished_at = time.time()
+        self.log_parts = []
+        self.done.set()
+
+    def subscribe(self) -> Tuple[str, asyncio.Queue]:
+        """回傳 (到目前為止的 log, 之後的事件佇列)"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=max(K8S_LOG_QUEUE_SIZE, 2))
+        self._subscribers.append(queue)
+        history = (self.log or "") if self.finished else "".join(self.log_parts)
+        return history, queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        if queue in self._subscribers:
+            self._subscribers.remove(queue)
+        # 清空佇列，讓卡在 put() 的 publish_log 可以繼續
+        while not queue.empty():
+            queue.get_nowait()
+
+    async def events(self) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        跟著 job 的進度產生事件，直到 job 結束
+
+        事件:
+            status: 狀態變化 {"status": str}
+            log: 新的 log 片段 {"content": str} (第一個片段為訂閱前已產生的 log)
+            error: 串流被中斷 {"detail": str}
+            result: 最後一個事件，to_dict() 的內容 (含 pod phase 與 exit_code)
+        """
+        history, queue = self.subscribe()
+        try:
+            yield "status", {"status": self.status}
+            if history:
+                yield "log", {"content": history}
+            while not self.finished:
+                getter = asyncio.ensure_future(queue.get())
+                waiter = asyncio.ensure_future(self.done.wait())
+                done, _ = await asyncio.wait({getter, waiter}, return_when=asyncio.FIRST_COMPLETED)
+                waiter.cancel()
+                if getter not in done:
+                    getter.cancel()
+                    break
+                if getter.result() is None:
+                    return
+                yield getter.result()
+
+            while not queue.empty():
+                item = queue.get_nowait()
+                if item is None:
+                    return
+                yield item
+            yield "result", self.to_dict()
+        finally:
+            self.unsubscribe(queue)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "language": self.language,
+            "status": self.status,
+            "backend": self.backend,
+            "pod": self.pod,
+            "finished": self.finished,
+            "exit_code": self.exit_code,
+            "limits": self.limits._asdict(),
+            "metrics": self.metrics,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class KubernetesBackend(ExecutionBackend):
+    """在叢集上執行: 有閒置的 runner pod 時直接 exec，否則建立 Job"""
+
+    name = "k8s"
+
+    def __init__(self, manager: "JobManager"):
+        self.manager = manager
+
+    async def execute(self, job: K8sJob, code: str):
+        await self.manager._run_in_cluster(job, code)
+
+
+class JobManager:
+    """
+    非阻塞的程式執行器 (/k8s 的核心)
+
+    submit() 立刻回傳 job，依 backend 設定選擇在本機 sandbox 或叢集執行 (見 utils.k8s.backends)。
+    叢集上的流程在背景 task 進行：
+    建 ConfigMap -> 建 Job -> 等 PodWatcher 通知 pod 開始執行 -> 跟著讀 log (follow) 直到結束 -> 刪 ConfigMap。
+    只有單次的 API 呼叫與讀 log 會丟到 thread 執行，等待 pod 排程與啟動的期間不佔任何 thread。
+
+    Args:
+        core_api / batch_api: CoreV1Api / BatchV1Api，不給時使用共用的 ApiClient
+            (測試時可傳入假的 API)
+        namespace (str): 執行 job 的 namespace
+        watch_factory: 傳給 PodWatcher
+        timeout (float): 等待 pod 結束的上限秒數
+        pool_size (int): 每種語言保持的閒置 runner pod 數，0 代表不使用 pool
+        executor: 傳給 RunnerPool 的 exec 實作 (測試用)
+        backend (str): auto / local / k8s，見 EXECUTION_BACKEND
+        local_backend: 本機執行的 backend (測試時可替換)
+    """
+
+    def __init__(
+        self,
+        core_api=None,
+        batch_api=None,
+        namespace: str = K8S_NAMESPACE,
+        watch_factory=watch.Watch,
+        timeout: float = K8S_JOB_TIMEOUT,
+        pool_size: int = K8S_POOL_SIZE,
+        executor=None,
+        backend: str = EXECUTION_BACKEND,
+        local_backend: Optional[ExecutionBackend] = None,
+    ):
+        if backend not in ("auto", "local", "k8s"):
+            raise ValueError(f"Unknown execution backend: {backend}")
+        self.backend = backend
+        self.backends: Dict[str, ExecutionBackend] = {
+            "local": local_backend or LocalBackend(),
+            "k8s": KubernetesBackend(self),
+        }
+        self.core_api = core_api or SharedApi(client.CoreV1Api)
+        self.batch_api = batch_api or SharedApi(client.BatchV1Api)
+        self.namespace = namespace
+        self.timeout = timeout
+        self.watcher = PodWatcher(self.core_api, namespace, watch_factory)
+        self.jobs: Dict[str, K8sJob] = {}
+        self._tasks = set()
+        # 定期清掉結束的 Job 與孤兒 ConfigMap / pod
+        self.reaper = JobReaper(self.core_api, self.batch_api, namespace)
+
+        # 預熱的 runner pod pool；沒有可用的 pod 時才走 Job
+        self.pools: Dict[str, RunnerPool] = {}
+        if pool_size > 0 and backend != "local":
+            runner_watcher = PodWatcher(
+                self.core_api, namespace, watch_factory, label_selector=RUNNER_LABEL, key_label="runner-pod"
+            )
+            self.pools = {
+                language: RunnerPool(
+                    language, self.core_api, runner_watcher, namespace, executor=executor, min_idle=pool_size
+                )
+                for language in ("python3", "java21")
+            }
+
+    async def start(self):
+        """預先建立 runner pod 並啟動 reaper"""
+        if self.backend != "local":
+            self.reaper.start()
+        for pool in self.pools.values():
+            await pool.start()
+
+    def submit(self, code: str, language: str, limits: Optional[ResourceLimits] = None) -> K8sJob:
+        """
+        建立 job 並在背景執行，立即回傳 (需在 event loop 中呼叫)
+
+        Args:
+            limits: CPU / 記憶體 / timeout，不給時使用預設值 (見 resolve_limits)
+        """
+        # 只在本機執行時沒有叢集可清理
+        if self.backend != "local":
+            self.reaper.start()
+        job = K8sJob(uuid.uuid4().hex[:12], language, limits or resolve_limits())
+        self.jobs[job.id] = job
+        self._trim()
+        task = asyncio.ensure_future(self._run(job, code))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def run(self, code: str, language: str, limits: Optional[ResourceLimits] = None) -> K8sJob:
+        """submit() 並等到 job 結束"""
+        job = self.submit(code, language, limits)
+        await job.done.wait()
+        return job
+
+    def get(self, job_id: str) -> Optional[K8sJob]:
+        return self.jobs.get(job_id)
+
+    def _trim(self):
+        # 只保留最近 K8S_JOB_HISTORY 筆，先丟掉已結束的舊 job
+        overflow = len(self.jobs) - K8S_JOB_HISTORY
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished][:max(overflow, 0)]:
+            del self.jobs[job_id]
+
+    async def _run(self, job: K8sJob, code: str):
+        try:
+            backend = await select_backend(self.backends, code, job.language, job.limits, self.backend)
+            if backend is None:
+                job.finish("Error", error=f"{job.language} with these limits cannot run on the local backend")
+                return
+            job.backend = backend.name
+            await backend.execute(job, code)
+        except Exception as e:
+            print(f"Job {job.id} failed: {e}")
+            if not job.finished:
+                job.finish("Error", error=str(e))
+        K8S_JOB_DURATION.labels(job.backend or "none", job.language, job.status).observe(
+            job.finished_at - job.created_at
+        )
+
+    async def _run_in_cluster(self, job: K8sJob, code: str):
+        pool = self.pools.get(job.language)
+        pod = await pool.acquire() if pool is not None and pool.fits(job.limits) else None
+        if pod is None:
+            await self._run_job(job, code)
+            return
+
+        job.pod = pod
+        job.set_status("Running")
+        loop = asyncio.get_running_loop()
+        output = MetricsFilter()
+
+        def on_output(text: str):
+            # 在 exec 的 thread 中呼叫；等到 client 收下才繼續讀
+            text = output.feed(text)
+            if text:
+                asyncio.run_coroutine_threadsafe(job.publish_log(text), loop).result()
+
+        try:
+            phase, logs, metrics = await pool.execute(
+                pod, code, code_filename(code, job.language), job.limits.timeout, on_output
+            )
+            print(f"Runner pod {pod} finished with status: {phase}")
+            job.finish(phase, log=logs, exit_code=(metrics or {}).get("exit_code"), metrics=metrics)
+        except Exception as e:
+            print(f"Job {job.id} failed in runner pod {pod}: {e}")
+            job.finish("Error", error=str(e))
+
+    async def _run_job(self, job: K8sJob, code: str):
+        configmap_name = f"configmap-{job.id}"
+        job_name = None
+        loop = asyncio.get_running_loop()
+        started = loop.create_future()
+        finished = loop.create_future()
+        log_stream: Dict[str, Any] = {"output": MetricsFilter()}
+
+        def on_phase(pod_name: str, phase: str):
+            # Job controller 會自己補 pod，被刪掉的 pod 不代表 job 結束
+            if finished.done() or phase == "Deleted":
+                return
+            timer.phase(phase)
+            job.pod = pod_name
+            if phase != job.status:
+                job.set_status(phase)
+            if phase != "Pending" and not started.done():
+                started.set_result(pod_name)
+            if phase in TERMINAL_PHASES:
+                finished.set_result(phase)
+
+        async def follow() -> str:
+            # container 開始執行後就跟著讀 log，container 結束時串流會自己關閉
+            await started
+            try:
+                await asyncio.to_thread(self._follow_logs, job, loop, log_stream)
+            except Exception as e:
+                print(f"Following logs of {job.pod} failed: {e}")
+            return await finished
+
+        try:
+            filename = await asyncio.to_thread(
+                create_configmap_from_file, configmap_name, code, job.language, self.core_api, job.id, self.namespace
+            )
+            yaml_file = os.path.join(
+                JOB_YAML_DIR, "python3-job.yaml" if job.language == "python3" else "java21-job.yaml"
+            )
+            manifest = build_job_manifest(
+                yaml_file, configmap_name, filename, job.language, suffix=job.id, limits=job.limits
+            )
+            manifest["metadata"]["namespace"] = self.namespace
+            job_name = manifest["metadata"]["name"]
+
+            # 各階段從建立 Job 開始計時
+            timer = PhaseTimer(job.language)
+            self.watcher.register(job_name, on_phase)
+            created = await asyncio.to_thread(
+                self.batch_api.create_namespaced_job, body=manifest, namespace=self.namespace
+            )
+            print(f"Job {job_name} created in namespace {self.namespace}")
+            await asyncio.to_thread(adopt_configmap, configmap_name, created, self.core_api, self.namespace)
+
+            phase = await asyncio.wait_for(follow(), min(self.timeout, job.limits.deadline))
+            print(f"Pod {job.pod} finished with status: {phase}")
+            if log_stream["output"].raw:
+                logs, metrics = log_stream["output"].result()
+            else:
+                logs, metrics = parse_metrics(await asyncio.to_thread(
+                    self.core_api.read_namespaced_pod_log, name=job.pod, namespace=self.namespace
+                ))
+            pod = await asyncio.to_thread(self.core_api.read_namespaced_pod, name=job.pod, namespace=self.namespace)
+            job.finish(phase, log=logs, exit_code=_exit_code(pod), metrics=metrics)
+        except asyncio.TimeoutError:
+            job.finish("Error", error=f"Job did not finish within {min(self.timeout, job.limits.deadline)} seconds")
+        except Exception as e:
+            print(f"Job {job.id} failed: {e}")
+            job.finish("Error", error=str(e))
+        finally:
+            if "response" in log_stream:
+                # 逾時時讀 log 的 thread 可能還卡在 read()，關掉連線讓它結束
+                log_stream["response"].close()
+            if job_name is not None:
+                self.watcher.unregister(job_name)
+            await asyncio.to_thread(delete_configmap, configmap_name, self.core_api, self.namespace)
+
+    def _follow_logs(self, job: K8sJob, loop: asyncio.AbstractEventLoop, log_stream: Dict[str, Any]):
+        """以 follow=True 分段讀取 pod log 並轉給訂閱者 (blocking，在 thread 中執行)"""
+        response = self.core_api.read_namespaced_pod_log(
+            name=job.pod, namespace=self.namespace, follow=True, _preload_content=False
+        )
+        log_stream["response"] = response
+        output: MetricsFilter = log_stream["output"]
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        for chunk in response.stream(4096):
+            text = output.feed(decoder.decode(chunk))
+            if text:
+                # 等到訂閱者收下才讀下一段 (backpressure 一路傳回 API server 的連線)
+                asyncio.run_coroutine_threadsafe(job.publish_log(text), loop).result()
+        output.feed(decoder.decode(b"", final=True))
+        text = output.flush()
+        if text:
+            asyncio.run_coroutine_threadsafe(job.publish_log(text), loop).result()
+
+    async def close(self):
+        self.watcher.stop()
+        self.reaper.close()
+        for pool in self.pools.values():
+            await pool.close()
+            pool.watcher.stop()
+        for task in list(self._tasks):
+            task.cancel()
+
+
+_job_manager: Optional[JobManager] = None
+
+
+def get_job_manager() -> JobManager:
+    """取得 process 內共用的 JobManager，第一次呼叫時才連線 Kubernetes"""
+    global _job_manager
+    if _job_manager is None:
+        _job_manager = JobManager()
+    return _job_manager
+
+
+async def close_job_manager():
+    global _job_manager, _api_client
+    if _job_manager is not None:
+        await _job_manager.close()
+        _job_manager = None
+    if _api_client is not None:
+        _api_client.close()
+        _api_client = None
+
+
 if __name__ == "__main__":
     print("Running job.py")
     # load_kube_config()
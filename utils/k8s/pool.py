@@ -0,0 +1,340 @@
+from typing import Optional, Dict, Any, Callable, Tuple, List
+from collections import deque
+from kubernetes import client
+from kubernetes.stream import stream
+import asyncio
+import os
+import shlex
+import time
+import uuid
+import yaml
+from utils.k8s.gc import owner_labels
+from utils.k8s.resources import ResourceLimits, resolve_limits, measured_script, parse_metrics
+
+# 每種語言平常保持的閒置 runner pod 數，0 代表停用 pool (全部走 Job)
+K8S_POOL_SIZE = int(os.getenv("K8S_POOL_SIZE", "0"))
+# 每種語言 runner pod 的上限 (依排隊的請求數自動擴充到這裡)
+K8S_POOL_MAX_SIZE = int(os.getenv("K8S_POOL_MAX_SIZE", "10"))
+# 一個 pod 執行幾次使用者程式後就換掉，1 代表每次用完就換
+K8S_POOL_MAX_RUNS = int(os.getenv("K8S_POOL_MAX_RUNS", "1"))
+# 沒有閒置 pod 時最多等多久，超過就改走 Job
+K8S_POOL_ACQUIRE_TIMEOUT = float(os.getenv("K8S_POOL_ACQUIRE_TIMEOUT", "2"))
+# 超過 K8S_POOL_SIZE 的閒置 pod 閒置多久後縮掉
+K8S_POOL_IDLE_TTL = float(os.getenv("K8S_POOL_IDLE_TTL", "60"))
+
+RUNNER_LABEL = "app=code-runner"
+JOB_YAML_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def exec_in_pod(
+    core_api,
+    pod: str,
+    namespace: str,
+    command: List[str],
+    stdin: str,
+    timeout: float,
+    on_output: Optional[Callable[[str], None]] = None,
+) -> Tuple[int, str, bool]:
+    """
+    在 pod 內執行指令並把 stdin 寫進去 (blocking)
+
+    Args:
+        on_output: 每收到一段輸出就呼叫一次 (串流 log 用)
+
+    Returns:
+        (returncode, stdout + stderr, timed_out)
+    """
+    resp = stream(
+        core_api.connect_get_namespaced_pod_exec,
+        pod,
+        namespace,
+        command=command,
+        stdin=True,
+        stdout=True,
+        stderr=True,
+        tty=False,
+        _preload_content=False,
+    )
+    output = []
+    deadline = time.monotonic() + timeout
+    try:
+        resp.write_stdin(stdin)
+        while resp.is_open():
+            if time.monotonic() > deadline:
+                return -1, "".join(output), True
+            resp.update(timeout=1)
+            for peek, read in ((resp.peek_stdout, resp.read_stdout), (resp.peek_stderr, resp.read_stderr)):
+                if peek():
+                    text = read()
+                    output.append(text)
+                    if on_output is not None:
+                        on_output(text)
+    finally:
+        resp.close()
+    return resp.returncode or 0, "".join(output), False
+
+
+def run_command(language: str, filename: str, size: int, timeout: float) -> List[str]:
+    """
+    runner pod 內的執行指令: 從 stdin 讀入剛好 size bytes 的程式碼到暫存目錄再執行
+    (exec 的 stdin 無法單獨關閉，所以用長度而不是 EOF 判斷結尾)，輸出最後附上量測結果
+    """
+    name = shlex.quote(filename)
+    prepare = f'd=$(mktemp -d) && trap \'rm -rf "$d"\' EXIT && head -c {size} > "$d"/{name} && cd "$d"'
+    if language == "java21":
+        prepare += f" && javac {name} 2>&1"
+        run = f"java {shlex.quote(filename.rsplit('.', 1)[0])} < /dev/null 2>&1"
+    else:
+        run = f"python3 {name} < /dev/null 2>&1"
+    return ["/bin/sh", "-c", measured_script(run, timeout, prepare=prepare)]
+
+
+class RunnerPool:
+    """
+    一種語言的預熱 runner pod pool
+
+    pod 以 job yaml 的 image 啟動後待命 (sleep)，請求到來時透過 exec 送入程式碼執行，
+    省掉建立 ConfigMap / Job、排程與啟動容器的時間。
+    每個 pod 跑滿 max_runs 次 (或執行失敗、逾時) 後就刪掉換新的；
+    pool 大小依排隊的請求數在 min_idle 與 max_size 之間調整。
+
+    Args:
+        language (str): "python3" 或 "java21"
+        core_api: CoreV1Api (測試時可傳入假的 API)
+        watcher (PodWatcher): 以 runner-pod label 分派事件的 watcher
+        namespace (str): pod 所在的 namespace
+        executor: exec_in_pod 的替代實作 (測試用)
+    """
+
+    def __init__(
+        self,
+        language: str,
+        core_api,
+        watcher,
+        namespace: str,
+        executor: Callable[..., Tuple[int, str, bool]] = exec_in_pod,
+        min_idle: int = K8S_POOL_SIZE,
+        max_size: int = K8S_POOL_MAX_SIZE,
+        max_runs: int = K8S_POOL_MAX_RUNS,
+        acquire_timeout: float = K8S_POOL_ACQUIRE_TIMEOUT,
+        idle_ttl: float = K8S_POOL_IDLE_TTL,
+    ):
+        self.language = language
+        self.core_api = core_api
+        self.watcher = watcher
+        self.namespace = namespace
+        self.executor = executor
+        self.min_idle = min_idle
+        self.max_size = max(max_size, min_idle)
+        self.max_runs = max(1, max_runs)
+        self.acquire_timeout = acquire_timeout
+        self.idle_ttl = idle_ttl
+        # pool 的 pod 以預設的資源限制啟動，要求其他限制的請求改走 Job
+        self.limits = resolve_limits()
+
+        self.idle: deque = deque()  # (pod, 閒置開始時間)
+        self.busy = set()
+        self.starting = set()
+        self.runs: Dict[str, int] = {}
+        self._waiters: deque = deque()
+        self._maintainer: Optional[asyncio.Task] = None
+        self.stats_counters = {"runs": 0, "fallbacks": 0, "created": 0, "recycled": 0}
+
+    @property
+    def size(self) -> int:
+        return len(self.idle) + len(self.busy) + len(self.starting)
+
+    def _manifest(self, name: str) -> Dict[str, Any]:
+        with open(os.path.join(JOB_YAML_DIR, f"{self.language}-job.yaml")) as file:
+            container = yaml.safe_load(file)["spec"]["template"]["spec"]["containers"][0]
+        return {
+            "apiVersion": "v1",
+            "kind": "Pod",
+            "metadata": {
+                "name": name,
+                "labels": {
+                    **owner_labels(),
+                    "app": "code-runner",
+                    "runner-language": self.language,
+                    "runner-pod": name,
+                },
+            },
+            "spec": {
+                "restartPolicy": "Never",
+                "terminationGracePeriodSeconds": 0,
+                "containers": [{
+                    "name": container["name"],
+                    "image": container["image"],
+                    "command": ["/bin/sh", "-c", "while true; do sleep 3600; done"],
+                    "resources": self.limits.resources(),
+                }],
+            },
+        }
+
+    async def start(self):
+        """建立最少的閒置 pod 並開始定期縮減多餘的 pod"""
+        self._scale()
+        if self._maintainer is None:
+            self._maintainer = asyncio.ensure_future(self._maintain())
+
+    async def _maintain(self):
+        while True:
+            await asyncio.sleep(max(self.idle_ttl / 2, 1))
+            self._scale()
+
+    def _scale(self):
+        # 目標: 執行中 + 排隊中 + 平常保留的閒置數
+        desired = min(self.max_size, len(self.busy) + len(self._waiters) + self.min_idle)
+        for _ in range(desired - self.size):
+            asyncio.ensure_future(self._create_pod())
+
+        # 閒置太久且超過 min_idle 的 pod 縮掉 (最舊的先縮)
+        now = time.monotonic()
+        while len(self.idle) > self.min_idle and now - self.idle[0][1] > self.idle_ttl:
+            pod, _ = self.idle.popleft()
+            self._delete(pod)
+
+    async def _create_pod(self):
+        name = f"{self.language}-runner-{uuid.uuid4().hex[:10]}"
+        self.starting.add(name)
+        self.watcher.register(name, self._on_phase)
+        try:
+            await asyncio.to_thread(
+                self.core_api.create_namespaced_pod, namespace=self.namespace, body=self._manifest(name)
+            )
+            self.stats_counters["created"] += 1
+        except Exception as e:
+            print(f"Failed to create runner pod {name}: {e}")
+            self.starting.discard(name)
+            self.watcher.unregister(name)
+
+    def _on_phase(self, pod: str, phase: str):
+        if phase == "Running" and pod in self.starting:
+            self.starting.discard(pod)
+            self.runs[pod] = 0
+            self._make_available(pod)
+        elif phase in ("Succeeded", "Failed", "Deleted"):
+            # pod 自己結束或被外部刪除
+            self.starting.discard(pod)
+            self.busy.discard(pod)
+            self.idle = deque(entry for entry in self.idle if entry[0] != pod)
+            self.runs.pop(pod, None)
+            self.watcher.unregister(pod)
+            self._scale()
+
+    def _make_available(self, pod: str):
+        # 有人在等就直接交給他
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.busy.add(pod)
+                waiter.set_result(pod)
+                return
+        self.idle.append((pod, time.monotonic()))
+
+    def _delete(self, pod: str) -> asyncio.Future:
+        self.runs.pop(pod, None)
+        self.watcher.unregister(pod)
+
+        async def delete():
+            try:
+                await asyncio.to_thread(
+                    self.core_api.delete_namespaced_pod, name=pod, namespace=self.namespace, grace_period_seconds=0
+                )
+            except client.exceptions.ApiException as e:
+                if e.status != 404:
+                    print(f"Failed to delete runner pod {pod}: {e}")
+
+        return asyncio.ensure_future(delete())
+
+    def fits(self, limits: ResourceLimits) -> bool:
+        """pool 的 pod 是否符合這個請求要的 CPU / 記憶體 (timeout 每次執行時各自套用)"""
+        return (limits.cpu, limits.memory) == (self.limits.cpu, self.limits.memory)
+
+    async def acquire(self) -> Optional[str]:
+        """
+        取得一個閒置 pod；acquire_timeout 內都沒有可用的 pod 時回傳 None (改走 Job)
+        """
+        if self.idle:
+            pod, _ = self.idle.pop()  # 最近用過的先用，讓舊的閒置 pod 有機會被縮掉
+            self.busy.add(pod)
+            # 補上被取走的閒置 pod
+            self._scale()
+            return pod
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._scale()
+        try:
+            return await asyncio.wait_for(waiter, self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.stats_counters["fallbacks"] += 1
+            return None
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(self, pod: str, healthy: bool = True):
+        self.busy.discard(pod)
+        if pod not in self.runs:
+            # 執行期間 pod 已經不見了
+            return
+        self.runs[pod] += 1
+        if not healthy or self.runs[pod] >= self.max_runs:
+            self.stats_counters["recycled"] += 1
+            self._delete(pod)
+        else:
+            self._make_available(pod)
+        self._scale()
+
+    async def execute(
+        self,
+        pod: str,
+        code: str,
+        filename: str,
+        timeout: float,
+        on_output: Optional[Callable[[str], None]] = None,
+    ) -> Tuple[str, str, Optional[Dict[str, Any]]]:
+        """
+        在 pod 內執行程式碼，執行完歸還 (或回收) pod
+
+        Returns:
+            (phase, log, metrics): phase 為 "Succeeded" 或 "Failed"，與 Job 的結果一致；
+            metrics 為 parse_metrics() 的量測結果 (exec 本身逾時時為 None)
+        """
+        healthy = False
+        reused = self.runs.get(pod, 0) > 0
+        try:
+            data = code if code.endswith("\n") else code + "\n"
+            command = run_command(self.language, filename, len(data.encode()), timeout)
+            returncode, output, timed_out = await asyncio.to_thread(
+                self.executor, self.core_api, pod, self.namespace, command, data, timeout + 5, on_output
+            )
+            healthy = not timed_out
+            self.stats_counters["runs"] += 1
+            log, metrics = parse_metrics(output)
+            if metrics is not None and reused:
+                # cgroup 的記憶體峰值包含這個 pod 之前的執行，不是這次的
+                metrics["peak_memory_kb"] = None
+            return ("Succeeded" if returncode == 0 else "Failed"), log, metrics
+        finally:
+            self.release(pod, healthy)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "language": self.language,
+            "idle": len(self.idle),
+            "busy": len(self.busy),
+            "starting": len(self.starting),
+            "waiting": len(self._waiters),
+            **self.stats_counters,
+        }
+
+    async def close(self):
+        if self._maintainer is not None:
+            self._maintainer.cancel()
+        pods = [pod for pod, _ in self.idle] + list(self.busy) + list(self.starting)
+        self.idle.clear()
+        self.busy.clear()
+        self.starting.clear()
+        await asyncio.gather(*(self._delete(pod) for pod in pods))
@@ -0,0 +1,157 @@
+from typing import Optional, Dict, Any, Tuple, NamedTuple
+from kubernetes.utils import parse_quantity
+import math
+import os
+import re
+
+# 沒有指定時套用的資源限制，與可以要求的上限
+K8S_DEFAULT_CPU = os.getenv("K8S_DEFAULT_CPU", "500m")
+K8S_DEFAULT_MEMORY = os.getenv("K8S_DEFAULT_MEMORY", "256Mi")
+K8S_DEFAULT_TIMEOUT = float(os.getenv("K8S_DEFAULT_TIMEOUT", "30"))
+K8S_MAX_CPU = os.getenv("K8S_MAX_CPU", "2")
+K8S_MAX_MEMORY = os.getenv("K8S_MAX_MEMORY", "2Gi")
+K8S_MAX_TIMEOUT = float(os.getenv("K8S_MAX_TIMEOUT", "120"))
+# activeDeadlineSeconds 在程式 timeout 之外再留給排程、拉 image 與編譯的時間
+K8S_STARTUP_GRACE = int(os.getenv("K8S_STARTUP_GRACE", "60"))
+
+
+class ResourceLimits(NamedTuple):
+    cpu: str  # Kubernetes quantity，例如 "500m"
+    memory: str  # 例如 "256Mi"
+    timeout: float  # 使用者程式本身的執行秒數上限
+
+    @property
+    def deadline(self) -> int:
+        """Job 的 activeDeadlineSeconds"""
+        return int(self.timeout) + K8S_STARTUP_GRACE
+
+    def resources(self) -> Dict[str, Any]:
+        # requests 與 limits 相同 (Guaranteed QoS)，量測結果比較不受同節點其他 pod 影響
+        quantities = {"cpu": self.cpu, "memory": self.memory}
+        return {"requests": dict(quantities), "limits": dict(quantities)}
+
+
+def _quantity(name: str, value: str, cap: str):
+    try:
+        quantity = parse_quantity(value)
+    except ValueError:
+        raise ValueError(f"Invalid {name}: {value!r}")
+    if quantity <= 0:
+        raise ValueError(f"{name} must be positive: {value!r}")
+    if quantity > parse_quantity(cap):
+        raise ValueError(f"{name} {value} exceeds the server limit of {cap}")
+    return quantity
+
+
+def resolve_limits(
+    cpu: Optional[str] = None, memory: Optional[str] = None, timeout: Optional[float] = None
+) -> ResourceLimits:
+    """
+    套用預設值並檢查是否超過伺服器設定的上限
+
+    Raises:
+        ValueError: 格式錯誤或超過上限
+    """
+    limits = ResourceLimits(
+        cpu=str(cpu or K8S_DEFAULT_CPU),
+        memory=str(memory or K8S_DEFAULT_MEMORY),
+        timeout=float(timeout or K8S_DEFAULT_TIMEOUT),
+    )
+    _quantity("cpu", limits.cpu, K8S_MAX_CPU)
+    _quantity("memory", limits.memory, K8S_MAX_MEMORY)
+    if not 0 < limits.timeout <= K8S_MAX_TIMEOUT:
+        raise ValueError(f"timeout must be between 0 and {K8S_MAX_TIMEOUT} seconds")
+    return limits
+
+
+# ---------------------------------------------------------------- 容器內的量測
+
+METRICS_MARKER = "__K8S_METRICS__"
+METRICS_PATTERN = re.compile(r"\n" + METRICS_MARKER + r"([^\n]*)\n?$")
+
+
+def measured_script(run: str, timeout: float, prepare: Optional[str] = None) -> str:
+    """
+    包住執行指令的 shell script: 先執行 prepare (例如 javac)，再以 timeout 執行 run，
+    結束後從 cgroup 讀出 CPU 與記憶體峰值，以一行 METRICS_MARKER 附在輸出最後
+
+    CPU 與 wall time 只算 run 的部分；記憶體峰值是整個容器的 (包含 prepare)。
+    同時支援 cgroup v2 (cpu.stat / memory.peak) 與 v1 (cpuacct.usage / memory.max_usage_in_bytes)。
+    """
+    return "\n".join([
+        f"{prepare} || exit $?" if prepare else ":",
+        "cpu_usec() {",
+        "  if [ -f /sys/fs/cgroup/cpu.stat ]; then sed -n 's/^usage_usec //p' /sys/fs/cgroup/cpu.stat;",
+        "  else echo $(( $(cat /sys/fs/cgroup/cpuacct/cpuacct.usage 2>/dev/null || echo 0) / 1000 )); fi",
+        "}",
+        "cpu_start=$(cpu_usec); start=$(date +%s%N)",
+        f"timeout {max(1, math.ceil(timeout))} {run}",
+        "rc=$?",
+        "end=$(date +%s%N); cpu_end=$(cpu_usec)",
+        "peak=$(cat /sys/fs/cgroup/memory.peak 2>/dev/null || cat /sys/fs/cgroup/memory/memory.max_usage_in_bytes 2>/dev/null)",
+        f"printf '\\n{METRICS_MARKER} wall_ns=%s cpu_usec=%s peak_bytes=%s exit_code=%s\\n' "
+        '"$((${end:-0} - ${start:-0}))" "$((${cpu_end:-0} - ${cpu_start:-0}))" "$peak" "$rc"',
+        "exit $rc",
+    ])
+
+
+def _number(fields: Dict[str, str], key: str) -> Optional[int]:
+    value = fields.get(key, "")
+    return int(value) if value.lstrip("-").isdigit() else None
+
+
+def parse_metrics(output: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """
+    從輸出中取出 measured_script() 附上的量測結果
+
+    Returns:
+        (去掉量測行的輸出, {"wall_time", "cpu_time", "peak_memory_kb", "exit_code", "timed_out"} 或 None)
+    """
+    match = METRICS_PATTERN.search(output)
+    if match is None:
+        return output, None
+    fields = dict(item.split("=", 1) for item in match.group(1).split() if "=" in item)
+    wall_ns, cpu_usec, peak = _number(fields, "wall_ns"), _number(fields, "cpu_usec"), _number(fields, "peak_bytes")
+    exit_code = _number(fields, "exit_code")
+    metrics = {
+        "wall_time": round(wall_ns / 1e9, 4) if wall_ns is not None and wall_ns >= 0 else None,
+        "cpu_time": round(cpu_usec / 1e6, 4) if cpu_usec is not None and cpu_usec >= 0 else None,
+        "peak_memory_kb": peak // 1024 if peak else None,
+        "exit_code": exit_code,
+        # coreutils timeout 逾時的 exit code
+        "timed_out": exit_code == 124,
+    }
+    return output[:match.start()], metrics
+
+
+class MetricsFilter:
+    """
+    串流 log 時濾掉量測行: 可能是量測行開頭的尾端先暫存，確定不是才送出
+    """
+
+    def __init__(self):
+        self._pending = ""
+        self.raw = []
+
+    def feed(self, text: str) -> str:
+        self.raw.append(text)
+        self._pending += text
+        marker = self._pending.find("\n" + METRICS_MARKER)
+        if marker >= 0:
+            ready, self._pending = self._pending[:marker], self._pending[marker:]
+            return ready
+        newline = self._pending.rfind("\n")
+        if newline >= 0 and METRICS_MARKER.startswith(self._pending[newline + 1:]):
+            ready, self._pending = self._pending[:newline], self._pending[newline:]
+            return ready
+        ready, self._pending = self._pending, ""
+        return ready
+
+    def flush(self) -> str:
+        ready, _ = parse_metrics(self._pending)
+        self._pending = ""
+        return ready
+
+    def result(self) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """(去掉量測行的完整輸出, 量測結果)"""
+        return parse_metrics("".join(self.raw))
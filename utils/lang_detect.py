@@ -0,0 +1,79 @@
+from typing import Tuple
+import ast
+import re
+
+# (pattern, weight) — 命中一次就加分，不重複計算
+PYTHON_FEATURES = [
+    (re.compile(r"^\s*def\s+\w+\s*\(.*\)\s*(->\s*[^:]+)?:\s*$", re.M), 2),
+    (re.compile(r"^\s*class\s+\w+(\(.*\))?\s*:\s*$", re.M), 2),
+    (re.compile(r"^\s*(from\s+[\w.]+\s+)?import\s+[\w., ]+\s*$", re.M), 1),
+    (re.compile(r"^\s*(elif|except|finally|with)\b.*:\s*$", re.M), 2),
+    (re.compile(r"if\s+__name__\s*==\s*['\"]__main__['\"]"), 3),
+    (re.compile(r"\bprint\s*\("), 1),
+    (re.compile(r"\b(self|None|True|False|lambda)\b"), 1),
+    (re.compile(r"^\s*(for|while|if)\b[^{;]*:\s*$", re.M), 1),
+]
+
+JAVA_FEATURES = [
+    (re.compile(r"\bpublic\s+static\s+void\s+main\s*\(\s*String"), 4),
+    (re.compile(r"\b(public|private|protected)?\s*(final\s+)?class\s+\w+[^:]*\{"), 3),
+    (re.compile(r"\bSystem\.(out|err)\.print"), 3),
+    (re.compile(r"^\s*import\s+java(x)?\.[\w.*]+;", re.M), 3),
+    (re.compile(r"^\s*package\s+[\w.]+;", re.M), 2),
+    (re.compile(r"\b(public|private|protected)\s+(static\s+)?[\w<>\[\]]+\s+\w+\s*\("), 2),
+    (re.compile(r"\b(int|long|double|boolean|String|var)(\[\])?\s+\w+\s*=[^=]"), 1),
+    (re.compile(r"\bnew\s+\w+(<.*>)?\s*\("), 1),
+    (re.compile(r";\s*$", re.M), 1),
+]
+
+# 其他語言的特徵，命中時傾向回傳 "unknown"
+OTHER_FEATURES = [
+    (re.compile(r"^\s*#include\s*[<\"]", re.M), 4),
+    (re.compile(r"\bconsole\.log\s*\("), 4),
+    (re.compile(r"^\s*(function\s+\w+|const\s+\w+\s*=|let\s+\w+\s*=)", re.M), 2),
+    (re.compile(r"^\s*(package\s+main|func\s+\w+\s*\()", re.M), 4),
+    (re.compile(r"\bfn\s+\w+\s*\(|\blet\s+mut\b"), 4),
+    (re.compile(r"<\?php"), 4),
+    (re.compile(r"^\s*using\s+System\s*;", re.M), 4),
+    (re.compile(r"\b(std::|cout\s*<<|printf\s*\()"), 3),
+    (re.compile(r"^\s*(SELECT|INSERT|UPDATE|CREATE\s+TABLE)\b", re.M | re.I), 3),
+]
+
+
+def _score(code: str, features) -> int:
+    return sum(weight for pattern, weight in features if pattern.search(code))
+
+
+def classify_language(code: str) -> Tuple[str, float]:
+    """
+    不呼叫 LLM，用關鍵字 / 語法特徵與 ast.parse 判斷程式語言
+
+    Args:
+        code (str): 要判斷的程式碼
+
+    Returns:
+        (language, confidence): language 為 "python" / "java" / "unknown"，
+        confidence 介於 0-1，越高代表越確定
+    """
+    if not code.strip():
+        return "unknown", 1.0
+
+    scores = {
+        "python": _score(code, PYTHON_FEATURES),
+        "java": _score(code, JAVA_FEATURES),
+        "unknown": _score(code, OTHER_FEATURES),
+    }
+
+    # 能被 Python parser 接受是很強的證據 (Java / C 系語法幾乎不可能通過)
+    try:
+        ast.parse(code)
+        scores["python"] += 3
+    except (SyntaxError, ValueError):
+        scores["python"] = max(scores["python"] - 2, 0)
+
+    language = max(scores, key=scores.get)
+    total = sum(scores.values())
+    if scores[language] == 0:
+        return "unknown", 0.0
+    # +1 讓只有微弱證據時的信心不會直接到 1
+    return language, scores[language] / (total + 1)
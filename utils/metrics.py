@@ -0,0 +1,135 @@
+from typing import Callable, Awaitable, Any, Dict
+from prometheus_client import Counter, Histogram, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+import functools
+import time
+from utils.tracing import span
+
+# 熱路徑上只做 Histogram.observe / Counter.inc (各約 1µs)；
+# token 與排程器的統計本來就有累計，抓取 /metrics 時才讀取 (見 LLMCollector)
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template (streaming responses: time until headers are sent)",
+    ["method", "route", "status"],
+)
+NODE_DURATION = Histogram(
+    "langgraph_node_duration_seconds",
+    "Duration of LangGraph node executions",
+    ["graph", "node"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160),
+)
+LLM_DURATION = Histogram(
+    "llm_call_duration_seconds",
+    "LLM call latency including scheduler queueing and retries",
+    ["route", "outcome"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120),
+)
+EXECUTION_DURATION = Histogram(
+    "code_execution_duration_seconds",
+    "wet_run execution time of generated code (cache hits excluded)",
+    ["language", "outcome"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10),
+)
+K8S_PHASE_DURATION = Histogram(
+    "k8s_job_phase_duration_seconds",
+    "Time spent in each stage of a Kubernetes job: configmap (create call), "
+    "scheduled (job created -> pod seen), running (pod seen -> container running), "
+    "completed (running -> terminal phase)",
+    ["language", "phase"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 40, 80, 160, 320),
+)
+CHAT_EXECUTION_RETRIES = Counter(
+    "llm_execution_retries",
+    "chat() calls re-asked because the generated code failed to execute",
+    ["route"],
+)
+K8S_JOB_DURATION = Histogram(
+    "k8s_job_duration_seconds",
+    "End-to-end duration of /k8s runs by execution backend",
+    ["backend", "language", "status"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 40, 80, 160, 320),
+)
+
+
+def observe_request(method: str, route: str, status: int, seconds: float):
+    REQUEST_DURATION.labels(method, route, str(status)).observe(seconds)
+
+
+def timed_node(graph: str, name: str, node: Callable[[Any], Awaitable[Any]]):
+    """包住一個 async LangGraph node，記錄每次執行的耗時 (開啟 profiling 的請求另外記錄成 span)"""
+    histogram = NODE_DURATION.labels(graph, name)
+
+    @functools.wraps(node)
+    async def wrapper(state):
+        start = time.perf_counter()
+        try:
+            with span(f"node:{name}", graph=graph):
+                return await node(state)
+        finally:
+            histogram.observe(time.perf_counter() - start)
+
+    return wrapper
+
+
+class PhaseTimer:
+    """
+    依 pod phase 事件記錄 k8s job 各階段的耗時 (K8S_PHASE_DURATION)
+
+    建立後呼叫 phase() 餵入每個 pod phase；每個階段只記錄第一次，
+    直接從 Pending 跳到結束的 pod 其 running 與 completed 會在同一時間記錄
+    """
+
+    def __init__(self, language: str):
+        self.language = language
+        self.last = time.perf_counter()
+        self.seen = set()
+
+    def mark(self, stage: str):
+        if stage in self.seen:
+            return
+        now = time.perf_counter()
+        K8S_PHASE_DURATION.labels(self.language, stage).observe(now - self.last)
+        self.last = now
+        self.seen.add(stage)
+
+    def phase(self, phase: str):
+        self.mark("scheduled")
+        if phase != "Pending":
+            self.mark("running")
+        if phase in ("Succeeded", "Failed"):
+            self.mark("completed")
+
+
+class LLMCollector:
+    """抓取時才讀取 TokenMetrics 與 LLM 排程器的累計值，呼叫 LLM 時不增加任何成本"""
+
+    def collect(self):
+        from utils.tokens import get_token_metrics
+        from utils.scheduler import get_scheduler
+
+        stats = get_token_metrics().stats()
+        tokens = CounterMetricFamily("llm_tokens", "LLM tokens by route and kind", labels=["route", "kind"])
+        calls = CounterMetricFamily("llm_calls", "LLM calls by route", labels=["route"])
+        rejections = CounterMetricFamily(
+            "llm_budget_rejections", "LLM calls rejected by the per-request token budget", labels=["route"]
+        )
+        for route, route_stats in stats["routes"].items():
+            route = route or "unknown"
+            for kind in ("input", "output", "saved"):
+                tokens.add_metric([route, kind], route_stats[f"{kind}_tokens"])
+            calls.add_metric([route], route_stats["calls"])
+            rejections.add_metric([route], route_stats["budget_rejections"])
+        yield tokens
+        yield calls
+        yield rejections
+
+        scheduler: Dict[str, Any] = get_scheduler().stats()
+        yield CounterMetricFamily("llm_retries", "LLM call retries (429 / 5xx)", value=scheduler["retries"])
+        yield CounterMetricFamily("llm_throttled", "LLM calls throttled with 429", value=scheduler["throttled"])
+        yield CounterMetricFamily("llm_failures", "LLM calls that failed after retries", value=scheduler["failures"])
+        yield GaugeMetricFamily("llm_queue_depth", "LLM calls waiting for quota", value=scheduler["queue_depth"])
+        yield GaugeMetricFamily("llm_in_flight", "LLM calls in flight", value=scheduler["in_flight"])
+
+
+REGISTRY.register(LLMCollector())
@@ -0,0 +1,276 @@
+from typing import Optional, Dict, Any, List
+import asyncio
+import json
+import os
+import tempfile
+from utils.tracing import span
+
+WORKER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sandbox_worker.py")
+# 所有 worker 都在忙時最多等多久，超過就 raise SandboxError (呼叫端改走 subprocess)
+SANDBOX_ACQUIRE_TIMEOUT = float(os.getenv("SANDBOX_ACQUIRE_TIMEOUT", "30"))
+# 傳給 sandbox worker / Java daemon 的環境變數，其餘 (API key 等) 一律不傳
+SANDBOX_ENV_KEYS = ("PATH", "LANG", "LC_ALL", "JAVA_HOME")
+
+_sandbox_dir: Optional[str] = None
+
+
+def sandbox_env() -> Dict[str, str]:
+    """sandbox 行程的最小環境變數"""
+    env = {key: os.environ[key] for key in SANDBOX_ENV_KEYS if key in os.environ}
+    env["HOME"] = sandbox_dir()
+    return env
+
+
+def sandbox_dir() -> str:
+    """sandbox 行程的工作目錄: 一個空的暫存目錄，不在專案目錄裡"""
+    global _sandbox_dir
+    if _sandbox_dir is None:
+        _sandbox_dir = tempfile.mkdtemp(prefix="sandbox-")
+    return _sandbox_dir
+
+
+class SandboxError(Exception):
+    """sandbox worker 沒有回傳結果 (crash 或無回應)"""
+
+
+class SandboxWorker:
+    """單一個常駐的 sandbox_worker.py 行程，透過 stdin / stdout pipe 溝通"""
+
+    def __init__(self, python: str):
+        self.python = python
+        self.runs = 0
+        self.proc: Optional[asyncio.subprocess.Process] = None
+
+    async def start(self):
+        # -I: 忽略 PYTHON* 環境變數與使用者 site-packages
+        self.proc = await asyncio.create_subprocess_exec(
+            self.python,
+            "-I",
+            WORKER_PATH,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            limit=64 * 1024 * 1024,
+            env=sandbox_env(),
+            cwd=sandbox_dir(),
+        )
+        # 等 worker 載入完成、回報 ready 後才算啟動完成
+        line = await self.proc.stdout.readline()
+        if not line:
+            raise SandboxError("sandbox worker failed to start")
+
+    @property
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.returncode is None
+
+    async def run(self, request: Dict[str, Any], deadline: float) -> Dict[str, Any]:
+        self.runs += 1
+        self.proc.stdin.write((json.dumps(request) + "\n").encode())
+        await self.proc.stdin.drain()
+        line = await asyncio.wait_for(self.proc.stdout.readline(), deadline)
+        if not line:
+            raise SandboxError("sandbox worker exited unexpectedly")
+        return json.loads(line)
+
+    async def stop(self):
+        if self.alive:
+            self.proc.kill()
+            await self.proc.wait()
+
+
+class WorkerPool:
+    """
+    常駐 worker 行程的共用 pool 邏輯: 懶啟動、借還、回收與 crash 後補位
+
+    子類別實作 _new_worker()，worker 需要有 start() / stop() / alive / runs
+
+    Args:
+        size (int): worker 數量
+        max_runs (int): 每個 worker 最多執行幾次就回收
+        acquire_timeout (float): 借不到 worker 時最多等待的秒數
+    """
+
+    def __init__(self, size: int, max_runs: int = 100, acquire_timeout: float = SANDBOX_ACQUIRE_TIMEOUT):
+        self.size = size
+        self.max_runs = max_runs
+        self.acquire_timeout = acquire_timeout
+        self.recycled = 0
+        self._spawning = 0
+        self._idle: Optional[asyncio.Queue] = None
+        self._workers: List[Any] = []
+        self._loop = None
+        self._ready: Optional[asyncio.Event] = None
+
+    def _new_worker(self):
+        raise NotImplementedError
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            await self._ready.wait()
+            return
+        if self._loop is not None:
+            # 換了 event loop (例如測試)，舊的 pipe 不能再用
+            self._kill_all()
+        self._loop = loop
+        self._ready = asyncio.Event()
+        self._idle = asyncio.Queue()
+        self._workers = []
+        self._spawning = 0
+        try:
+            await asyncio.gather(*(self._spawn() for _ in range(self.size)))
+        finally:
+            self._ready.set()
+
+    async def _spawn(self):
+        self._spawning += 1
+        try:
+            worker = self._new_worker()
+            await worker.start()
+        finally:
+            self._spawning -= 1
+        self._workers.append(worker)
+        self._idle.put_nowait(worker)
+
+    async def _replace(self, worker):
+        self.recycled += 1
+        if worker in self._workers:
+            self._workers.remove(worker)
+        await worker.stop()
+        try:
+            await self._spawn()
+        except Exception as e:
+            print(f"Worker restart failed: {e}")
+
+    def _kill_all(self):
+        for worker in self._workers:
+            if worker.alive:
+                worker.proc.kill()
+        self._workers = []
+
+    async def close(self):
+        for worker in self._workers:
+            await worker.stop()
+        self._workers = []
+        self._loop = None
+
+    async def acquire(self):
+        """
+        借出一個閒置的 worker (必要時先啟動 pool)
+
+        之前補位失敗讓 pool 小於 size 時先補一個；acquire_timeout 內借不到時 raise SandboxError
+        """
+        await self.start()
+        if self._idle.empty() and len(self._workers) + self._spawning < self.size:
+            try:
+                await self._spawn()
+            except Exception as e:
+                print(f"Worker restart failed: {e}")
+                if not self._workers and not self._spawning:
+                    raise SandboxError(f"no sandbox worker available: {e}")
+        try:
+            return await asyncio.wait_for(self._idle.get(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise SandboxError(f"no sandbox worker became available within {self.acquire_timeout} seconds")
+
+    def release(self, worker, broken: bool = False):
+        """歸還 worker；壞掉或執行次數用完的 worker 會在背景換新"""
+        if broken or worker.runs >= self.max_runs or not worker.alive:
+            asyncio.ensure_future(self._replace(worker))
+        else:
+            self._idle.put_nowait(worker)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": self.size,
+            "workers": len(self._workers),
+            "idle": self._idle.qsize() if self._idle is not None else 0,
+            "recycled": self.recycled,
+        }
+
+
+class PythonSandboxPool(WorkerPool):
+    """
+    預先啟動的 Python sandbox worker pool
+
+    每個 worker 是一個暖好的直譯器，收到程式碼後 fork 子行程執行 (見 sandbox_worker.py)，
+    所以每次執行不必再付 python3 啟動成本。worker 執行 max_runs 次或 crash / 無回應時會被換掉。
+
+    Args:
+        size (int): worker 數量
+        max_runs (int): 每個 worker 最多執行幾次就回收
+        memory_mb (int): 每次執行的 RLIMIT_AS 上限
+        python (str): 啟動 worker 用的直譯器
+    """
+
+    def __init__(self, size: int, max_runs: int = 100, memory_mb: int = 512, python: str = "python3"):
+        super().__init__(size, max_runs)
+        self.memory_mb = memory_mb
+        self.python = python
+
+    def _new_worker(self):
+        return SandboxWorker(self.python)
+
+    async def run(
+        self, code: str, timeout: float = 2, max_output: int = 1024 * 1024, memory_mb: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        在 sandbox 裡執行一段 Python 程式碼
+
+        Args:
+            memory_mb (int): 這次執行的 RLIMIT_AS 上限，不給時使用 pool 的設定
+
+        Returns:
+            {
+                "returncode": int,
+                "stdout": str,
+                "stderr": str,
+                "timed_out": bool,
+                "wall_time": float,
+                "cpu_time": float,
+                "max_rss_kb": int
+            }
+        """
+        worker = await self.acquire()
+        request = {
+            "code": code,
+            "timeout": timeout,
+            "memory_mb": memory_mb or self.memory_mb,
+            "max_output": max_output,
+        }
+        try:
+            # worker 自己會在 timeout 時 kill 子行程，這裡多給一點緩衝以偵測 worker 卡死
+            with span("python_sandbox", timeout=timeout):
+                result = await worker.run(request, timeout + 5)
+        except (SandboxError, asyncio.TimeoutError, ConnectionError, json.JSONDecodeError) as e:
+            self.release(worker, broken=True)
+            raise SandboxError(str(e) or "sandbox worker timed out")
+        except BaseException:
+            # 例如 client 斷線時被 cancel: pipe 停在回應中間，不能再給下一個請求使用
+            self.release(worker, broken=True)
+            raise
+
+        self.release(worker)
+        return result
+
+
+_python_pool: Optional[PythonSandboxPool] = None
+
+
+def get_python_pool() -> PythonSandboxPool:
+    """
+    取得 process 內共用的 Python sandbox pool，依環境變數設定:
+        SANDBOX_POOL_SIZE: worker 數量，0 代表停用 pool (預設為 CPU 數)
+        SANDBOX_MAX_RUNS: 每個 worker 最多執行幾次就回收 (預設 100)
+        SANDBOX_MEMORY_MB: 每次執行的記憶體上限 (預設 512)
+        SANDBOX_PYTHON: worker 使用的直譯器 (預設 python3)
+    """
+    global _python_pool
+    if _python_pool is None:
+        _python_pool = PythonSandboxPool(
+            size=int(os.getenv("SANDBOX_POOL_SIZE", str(os.cpu_count() or 2))),
+            max_runs=int(os.getenv("SANDBOX_MAX_RUNS", "100")),
+            memory_mb=int(os.getenv("SANDBOX_MEMORY_MB", "512")),
+            python=os.getenv("SANDBOX_PYTHON", "python3"),
+        )
+    return _python_pool
@@ -0,0 +1,163 @@
+"""
+常駐的 Python sandbox worker，由 utils/sandbox.py 啟動
+
+從 stdin 一行讀一個 JSON 請求，每個請求 fork 出一個子行程執行程式碼:
+子行程有自己的 session、工作目錄、rlimit 與全新的 __main__ namespace，
+父行程只負責計時與收集結果，再從 stdout 一行回傳一個 JSON 結果。
+
+請求:
+    {"code": str, "timeout": float, "memory_mb": int, "max_output": int}
+
+結果:
+    {"returncode": int, "stdout": str, "stderr": str, "timed_out": bool,
+     "wall_time": float, "cpu_time": float, "max_rss_kb": int}
+"""
+import builtins
+import json
+import math
+import os
+import resource
+import select
+import signal
+import sys
+import tempfile
+import time
+import traceback
+
+# 預先載入常用模組，fork 出的子行程就不必再 import 一次
+import collections  # noqa: F401
+import functools  # noqa: F401
+import heapq  # noqa: F401
+import bisect  # noqa: F401
+import itertools  # noqa: F401
+import random  # noqa: F401
+import re  # noqa: F401
+import typing  # noqa: F401
+import dataclasses  # noqa: F401
+
+
+def _set_limit(limit, value):
+    try:
+        resource.setrlimit(limit, (value, value))
+    except (ValueError, OSError):
+        pass
+
+
+def _child(code, workdir, out_fd, err_fd, timeout, memory_mb, max_output):
+    """在 fork 出的子行程裡執行，永遠不會 return"""
+    exit_code = 0
+    try:
+        os.setsid()
+        os.chdir(workdir)
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.dup2(out_fd, 1)
+        os.dup2(err_fd, 2)
+        sys.stdin = open(os.devnull)
+
+        _set_limit(resource.RLIMIT_CPU, math.ceil(timeout) + 1)
+        _set_limit(resource.RLIMIT_FSIZE, max_output)
+        _set_limit(resource.RLIMIT_NOFILE, 64)
+        if memory_mb:
+            _set_limit(resource.RLIMIT_AS, memory_mb * 1024 * 1024)
+
+        script = os.path.join(workdir, "script.py")
+        with open(script, "w") as f:
+            f.write(code)
+        sys.argv = [script]
+        sys.path[0:0] = [workdir]
+        namespace = {"__name__": "__main__", "__file__": script, "__builtins__": builtins}
+        exec(compile(code, script, "exec"), namespace)
+    except SystemExit as e:
+        if e.code is None:
+            exit_code = 0
+        elif isinstance(e.code, int):
+            exit_code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            exit_code = 1
+    except BaseException:
+        traceback.print_exc()
+        exit_code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(exit_code)
+
+
+def _read(f, max_output):
+    f.seek(0)
+    return f.read(max_output).decode(errors="replace")
+
+
+def run(request):
+    code = request["code"]
+    timeout = float(request.get("timeout", 2))
+    memory_mb = int(request.get("memory_mb", 512))
+    max_output = int(request.get("max_output", 1024 * 1024))
+
+    with tempfile.TemporaryDirectory() as workdir, tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        # 子行程結束時 write end 會被關閉，用 select 等待可同時處理 timeout
+        done_r, done_w = os.pipe()
+        sys.stdout.flush()
+        start = time.monotonic()
+        pid = os.fork()
+        if pid == 0:
+            os.close(done_r)
+            _child(code, workdir, out.fileno(), err.fileno(), timeout, memory_mb, max_output)
+        os.close(done_w)
+
+        ready, _, _ = select.select([done_r], [], [], timeout)
+        timed_out = not ready
+        if timed_out:
+            try:
+                os.killpg(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        _, status, usage = os.wait4(pid, 0)
+        wall_time = time.monotonic() - start
+        os.close(done_r)
+
+        if os.WIFEXITED(status):
+            returncode = os.WEXITSTATUS(status)
+        else:
+            returncode = -os.WTERMSIG(status)
+
+        return {
+            "returncode": returncode,
+            "stdout": _read(out, max_output),
+            "stderr": _read(err, max_output),
+            "timed_out": timed_out,
+            "wall_time": wall_time,
+            "cpu_time": usage.ru_utime + usage.ru_stime,
+            "max_rss_kb": usage.ru_maxrss,
+        }
+
+
+def main():
+    protocol = sys.stdout
+    protocol.write(json.dumps({"ready": True}) + "\n")
+    protocol.flush()
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            result = run(json.loads(line))
+        except Exception as e:
+            result = {
+                "returncode": -1,
+                "stdout": "",
+                "stderr": f"sandbox worker error: {e}",
+                "timed_out": False,
+                "wall_time": 0.0,
+                "cpu_time": 0.0,
+                "max_rss_kb": 0,
+            }
+        protocol.write(json.dumps(result) + "\n")
+        protocol.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+from typing import Optional, Dict, Any, Awaitable, Callable
+from contextvars import ContextVar
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import time
+from utils.tracing import span
+
+# 數字越小越優先，互動式的 /detect 排在批次的 /optimize、/batch 之前
+ROUTE_PRIORITIES = {
+    "/detect": 0,
+    "/k8s": 1,
+    "/correct": 1,
+    "/convert": 2,
+    "/upgrade": 2,
+    "/optimize": 3,
+    "/batch": 4,
+}
+DEFAULT_PRIORITY = 2
+
+# 目前請求的 LLM 優先順序 (由 middleware 依 route 設定)
+llm_priority: ContextVar[int] = ContextVar("llm_priority", default=DEFAULT_PRIORITY)
+
+
+def priority_for_path(path: str) -> int:
+    for prefix, priority in ROUTE_PRIORITIES.items():
+        if path == prefix or path.startswith(prefix + "/"):
+            return priority
+    return DEFAULT_PRIORITY
+
+
+class TokenBucket:
+    """
+    以每分鐘配額補充的 token bucket
+
+    Args:
+        rate_per_minute (float): 每分鐘補充量，0 代表不限制
+        capacity (float): 最多可累積的量 (允許的 burst)
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: float):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """還要等幾秒才能取出 amount (0 代表現在就可以)"""
+        if self.rate <= 0:
+            return 0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount: float, now: float):
+        """取出 amount；也可傳入負數把多估的量還回去"""
+        if self.rate <= 0:
+            return
+        self._refill(now)
+        self.level = min(self.capacity, self.level - min(amount, self.capacity))
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def _is_retryable(error: Exception) -> bool:
+    status = _status_code(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    # 連線中斷 / 逾時 (openai.APIConnectionError、httpx.TransportError 等)
+    name = type(error).__name__
+    return isinstance(error, (ConnectionError, asyncio.TimeoutError)) or name in (
+        "APIConnectionError",
+        "APITimeoutError",
+        "ConnectError",
+        "ReadTimeout",
+        "RemoteProtocolError",
+    )
+
+
+def _retry_after(error: Exception) -> float:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after", 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+class LLMScheduler:
+    """
+    所有 LLM 呼叫前的排程器
+
+    - requests / tokens 兩個 token bucket 對應每分鐘的配額 (RPM / TPM)
+    - 等待中的呼叫依優先順序 (再依到達順序) 放行
+    - 429 / 5xx / 連線錯誤以 exponential backoff + jitter 重試；
+      429 時整個排程器暫停放行，避免其他請求一起撞上限
+
+    Args:
+        rpm (float): 每分鐘請求數上限，0 代表不限制
+        tpm (float): 每分鐘 token 數上限，0 代表不限制
+        max_retries (int): 單次呼叫最多重試幾次
+        burst_seconds (float): bucket 容量相當於幾秒的配額
+        backoff_base (float): 第一次重試的基本等待秒數
+        backoff_max (float): 重試等待秒數上限
+    """
+
+    def __init__(
+        self,
+        rpm: float,
+        tpm: float,
+        max_retries: int = 5,
+        burst_seconds: float = 10,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30,
+    ):
+        self.requests = TokenBucket(rpm, max(1, rpm * burst_seconds / 60))
+        self.tokens = TokenBucket(tpm, max(1, tpm * burst_seconds / 60))
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.in_flight = 0
+        self.completed = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failures = 0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._paused_until = 0.0
+
+    async def acquire(self, priority: int, tokens: float):
+        """等到配額允許且輪到這個優先順序時才返回"""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), tokens, future))
+        self._dispatch()
+        await future
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        now = time.monotonic()
+        while self._waiters:
+            priority, seq, tokens, future = self._waiters[0]
+            if future.done():
+                # 等待中被取消 (例如 client 斷線)
+                heapq.heappop(self._waiters)
+                continue
+            wait = max(
+                self._paused_until - now,
+                self.requests.wait_time(1, now),
+                self.tokens.wait_time(tokens, now),
+            )
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            heapq.heappop(self._waiters)
+            self.requests.consume(1, now)
+            self.tokens.consume(tokens, now)
+            future.set_result(None)
+
+    def record_usage(self, estimated: float, actual: float):
+        """以實際 token 用量修正 TPM bucket (多估的還回去，少估的補扣)"""
+        self.tokens.consume(actual - estimated, time.monotonic())
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+        # equal jitter: 一半固定、一半隨機，避免同時失敗的請求同時重試
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        return max(delay, _retry_after(error))
+
+    async def run(
+        self,
+        call: Callable[[], Awaitable[Any]],
+        tokens: float,
+        priority: Optional[int] = None,
+    ) -> Any:
+        """
+        依配額與優先順序執行一次 LLM 呼叫，遇到可重試的錯誤會自動重試
+
+        Args:
+            call: 回傳 awaitable 的函數，每次重試都會重新呼叫
+            tokens (float): 預估這次呼叫會用到的 token 數
+            priority (Optional[int]): 優先順序，預設取目前請求的 llm_priority
+        """
+        if priority is None:
+            priority = llm_priority.get()
+
+        attempt = 0
+        while True:
+            with span("llm_queue", priority=priority):
+                await self.acquire(priority, tokens)
+            self.in_flight += 1
+            try:
+                with span("llm_attempt", attempt=attempt):
+                    result = await call()
+                self.completed += 1
+                return result
+            except Exception as e:
+                if not _is_retryable(e) or attempt >= self.max_retries:
+                    self.failures += 1
+                    raise
+                attempt += 1
+                self.retries += 1
+                delay = self._backoff(attempt, e)
+                if _status_code(e) == 429:
+                    self.throttled += 1
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                print(f"LLM call failed ({e}), retry {attempt}/{self.max_retries} in {delay:.2f}s")
+            finally:
+                self.in_flight -= 1
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        depth: Dict[int, int] = {}
+        for priority, _, _, future in self._waiters:
+            if not future.done():
+                depth[priority] = depth.get(priority, 0) + 1
+        now = time.monotonic()
+        self.requests._refill(now)
+        self.tokens._refill(now)
+        return {
+            "queue_depth": sum(depth.values()),
+            "queue_depth_by_priority": depth,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "failures": self.failures,
+            "paused_for": max(0.0, self._paused_until - now),
+            "request_budget": self.requests.level,
+            "token_budget": self.tokens.level,
+        }
+
+
+_scheduler: Optional[LLMScheduler] = None
+
+
+def get_scheduler() -> LLMScheduler:
+    """
+    取得 process 內共用的 LLM 排程器，依環境變數設定:
+        LLM_RPM: 每分鐘請求數配額 (預設 2000，0 代表不限制)
+        LLM_TPM: 每分鐘 token 配額 (預設 4000000，0 代表不限制)
+        LLM_MAX_RETRIES: 429 / 5xx 最多重試次數 (預設 5)
+        LLM_BURST_SECONDS: 允許一次用掉幾秒份的配額 (預設 10)
+    """
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = LLMScheduler(
+            rpm=float(os.getenv("LLM_RPM", "2000")),
+            tpm=float(os.getenv("LLM_TPM", "4000000")),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", "5")),
+            burst_seconds=float(os.getenv("LLM_BURST_SECONDS", "10")),
+        )
+    return _scheduler
@@ -0,0 +1,334 @@
+from typing import Dict, Any, List, Optional
+import ast
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from utils.chat import run_subprocess
+
+Issue = Dict[str, Any]
+
+
+def _issue(start: int, end: Optional[int], tag: str, description: str) -> Issue:
+    return {
+        "start_line": start,
+        "end_line": end if end is not None and end >= start else start,
+        "tag": tag,
+        "description": description,
+    }
+
+
+# ---------------------------------------------------------------- Python
+
+SCOPE_NODES = (ast.Module, ast.FunctionDef, ast.AsyncFunctionDef)
+NESTED_NODES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)
+LOOP_NODES = (ast.For, ast.AsyncFor, ast.While)
+
+
+def _walk_scope(node):
+    """走訪 node 底下的節點，但不進入巢狀的 function / class"""
+    for child in ast.iter_child_nodes(node):
+        yield child
+        if not isinstance(child, NESTED_NODES):
+            yield from _walk_scope(child)
+
+
+def _is_call(node, name: str) -> bool:
+    return isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == name
+
+
+def _is_method_call(node, name: str) -> bool:
+    return isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == name
+
+
+def _stored_names(node) -> set:
+    return {n.id for n in _walk_scope(node) if isinstance(n, ast.Name) and isinstance(n.ctx, ast.Store)}
+
+
+def _loaded_names(node) -> set:
+    names = {n.id for n in ast.walk(node) if isinstance(n, ast.Name)}
+    if isinstance(node, ast.Name):
+        names.add(node.id)
+    return names
+
+
+def _end_index(node) -> Optional[int]:
+    """subscript 是 [0] 或 [-1] 時回傳該值，否則 None"""
+    index = node.slice
+    if isinstance(index, ast.Index):  # Python 3.8
+        index = index.value
+    if isinstance(index, ast.Constant) and index.value == 0:
+        return 0
+    if (
+        isinstance(index, ast.UnaryOp)
+        and isinstance(index.op, ast.USub)
+        and isinstance(index.operand, ast.Constant)
+        and index.operand.value == 1
+    ):
+        return -1
+    return None
+
+
+def _check_scope(scope, issues: List[Issue]):
+    nodes = list(_walk_scope(scope))
+
+    # 在迴圈裡的節點 -> 該迴圈內會被改寫的變數
+    in_loop: Dict[int, set] = {}
+    for node in nodes:
+        if isinstance(node, LOOP_NODES):
+            changed = _stored_names(node)
+            for child in _walk_scope(node):
+                in_loop.setdefault(id(child), set()).update(changed)
+
+    sorted_calls: Dict[str, List[ast.Call]] = {}
+    sorted_vars: Dict[str, ast.Assign] = {}
+    for node in nodes:
+        if _is_call(node, "sorted") and node.args:
+            sorted_calls.setdefault(ast.dump(node.args[0]), []).append(node)
+
+            changed = in_loop.get(id(node))
+            if changed is not None and not (_loaded_names(node.args[0]) & changed):
+                issues.append(_issue(
+                    node.lineno, node.end_lineno, "optimize",
+                    f"sorted({ast.unparse(node.args[0])}) runs on every loop iteration but its input "
+                    "does not change inside the loop; sort once before the loop",
+                ))
+
+        elif isinstance(node, ast.Subscript) and _is_call(node.value, "sorted") and _end_index(node) is not None:
+            func = "min" if _end_index(node) == 0 else "max"
+            issues.append(_issue(
+                node.lineno, node.end_lineno, "optimize",
+                f"Sorting only to read one end of the result is O(n log n); use {func}() which is O(n)",
+            ))
+
+        elif (
+            isinstance(node, ast.Assign)
+            and len(node.targets) == 1
+            and isinstance(node.targets[0], ast.Name)
+            and _is_call(node.value, "sorted")
+        ):
+            sorted_vars[node.targets[0].id] = node
+
+        elif id(node) in in_loop and (_is_method_call(node, "pop") or _is_method_call(node, "insert")):
+            first = node.args[0] if node.args else None
+            if isinstance(first, ast.Constant) and first.value == 0:
+                issues.append(_issue(
+                    node.lineno, node.end_lineno, "optimize",
+                    f"list.{node.func.attr}(0) inside a loop is O(n) per call; use collections.deque",
+                ))
+
+        elif (
+            id(node) in in_loop
+            and isinstance(node, ast.AugAssign)
+            and isinstance(node.op, ast.Add)
+            and isinstance(node.target, ast.Name)
+            and (
+                isinstance(node.value, ast.JoinedStr)
+                or (isinstance(node.value, ast.Constant) and isinstance(node.value.value, str))
+            )
+        ):
+            issues.append(_issue(
+                node.lineno, node.end_lineno, "optimize",
+                f"Building string '{node.target.id}' with += inside a loop copies it every time; "
+                "collect the parts in a list and use ''.join()",
+            ))
+
+        elif (
+            id(node) in in_loop
+            and isinstance(node, ast.Compare)
+            and any(isinstance(op, (ast.In, ast.NotIn)) for op in node.ops)
+            and any(isinstance(c, (ast.List, ast.ListComp)) for c in node.comparators)
+        ):
+            issues.append(_issue(
+                node.lineno, node.end_lineno, "optimize",
+                "Membership test against a list inside a loop is O(n) per check; use a set",
+            ))
+
+        elif (
+            isinstance(node, ast.While)
+            and isinstance(node.test, ast.Constant)
+            and node.test.value is True
+            and not any(isinstance(n, (ast.Break, ast.Return, ast.Raise)) for n in _walk_scope(node))
+            and not any(_is_call(n, "exit") or _is_method_call(n, "exit") for n in _walk_scope(node))
+        ):
+            issues.append(_issue(
+                node.lineno, node.lineno, "error",
+                "Infinite loop: while True has no break, return, raise or exit",
+            ))
+
+        elif (
+            isinstance(node, ast.BinOp)
+            and isinstance(node.op, (ast.Div, ast.FloorDiv, ast.Mod))
+            and isinstance(node.right, ast.Constant)
+            and node.right.value == 0
+        ):
+            issues.append(_issue(node.lineno, node.end_lineno, "error", "Division by zero"))
+
+    # 同一份資料被排序好幾次 (A3-5 題型)
+    for calls in sorted_calls.values():
+        if len(calls) > 1:
+            issues.append(_issue(
+                calls[0].lineno, calls[-1].end_lineno, "optimize",
+                f"sorted({ast.unparse(calls[0].args[0])}) is computed {len(calls)} times on the same data; "
+                "sort once and reuse the result",
+            ))
+
+    # sorted_data = sorted(data) 之後只讀 [0] / [-1]
+    for name, assign in sorted_vars.items():
+        uses = [
+            n for n in nodes
+            if isinstance(n, ast.Name) and n.id == name and isinstance(n.ctx, ast.Load)
+        ]
+        parents = {
+            id(n.value): n for n in nodes
+            if isinstance(n, ast.Subscript) and isinstance(n.value, ast.Name) and n.value.id == name
+        }
+        if uses and all(id(use) in parents and _end_index(parents[id(use)]) is not None for use in uses):
+            issues.append(_issue(
+                assign.lineno, assign.end_lineno, "optimize",
+                f"'{name}' is only used for its smallest / largest element; "
+                "use min() / max() instead of sorting (O(n) instead of O(n log n))",
+            ))
+
+
+def analyze_python(code: str) -> List[Issue]:
+    try:
+        compile(code, "<code>", "exec")
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        line = e.lineno or 1
+        return [_issue(line, getattr(e, "end_lineno", None), "error", f"SyntaxError: {e.msg}")]
+    except ValueError as e:
+        return [_issue(1, 1, "error", str(e))]
+
+    issues: List[Issue] = []
+    for scope in [tree] + [n for n in ast.walk(tree) if isinstance(n, SCOPE_NODES[1:])]:
+        _check_scope(scope, issues)
+    return issues
+
+
+# ---------------------------------------------------------------- Java
+
+JAVAC_LINE = re.compile(r"^.*?\.java:(\d+): (error|warning): (.*)$")
+JAVA_STRING_COMPARE = re.compile(r"(\"[^\"]*\"\s*[!=]=|[!=]=\s*\"[^\"]*\")")
+JAVA_SORT = re.compile(r"\b(?:Collections|Arrays)\.sort\s*\(\s*(\w+)")
+
+
+def _check_java_braces(lines: List[str]) -> List[Issue]:
+    # 去掉字串、字元與註解後檢查括號是否成對
+    stack = []
+    in_block_comment = False
+    for number, line in enumerate(lines, 1):
+        if in_block_comment:
+            if "*/" not in line:
+                continue
+            line = line.split("*/", 1)[1]
+            in_block_comment = False
+        line = re.sub(r"\"(\\.|[^\"\\])*\"|'(\\.|[^'\\])*'", "", line)
+        line = line.split("//", 1)[0]
+        if "/*" in line:
+            before, _, after = line.partition("/*")
+            if "*/" in after:
+                line = before + after.split("*/", 1)[1]
+            else:
+                line = before
+                in_block_comment = True
+        for char in line:
+            if char in "({[":
+                stack.append((char, number))
+            elif char in ")}]":
+                if not stack or "({[".index(stack[-1][0]) != ")}]".index(char):
+                    return [_issue(number, number, "error", f"Unmatched '{char}'")]
+                stack.pop()
+    if stack:
+        char, number = stack[-1]
+        return [_issue(number, number, "error", f"'{char}' is never closed")]
+    return []
+
+
+def analyze_java_rules(code: str, braces: bool = True) -> List[Issue]:
+    lines = code.splitlines()
+    issues = _check_java_braces(lines) if braces else []
+
+    sorts: Dict[str, List[int]] = {}
+    for number, line in enumerate(lines, 1):
+        if line.strip().startswith("//"):
+            continue
+        if JAVA_STRING_COMPARE.search(line):
+            issues.append(_issue(
+                number, number, "error",
+                "Strings compared with == / != compare references; use equals()",
+            ))
+        for match in JAVA_SORT.finditer(line):
+            sorts.setdefault(match.group(1), []).append(number)
+
+    for name, numbers in sorts.items():
+        if len(numbers) > 1:
+            issues.append(_issue(
+                numbers[0], numbers[-1], "optimize",
+                f"'{name}' is sorted {len(numbers)} times; sort once and reuse the result",
+            ))
+    return issues
+
+
+async def analyze_java_javac(code: str) -> Optional[List[Issue]]:
+    """用 javac -Xlint:all 編譯；沒有 javac 時回傳 None"""
+    javac = os.getenv("JAVAC", "javac")
+    if shutil.which(javac) is None:
+        return None
+    match = re.search(r"public\s+(?:final\s+|abstract\s+)*(?:class|interface|enum|record)\s+(\w+)", code)
+    class_name = match.group(1) if match else "Main"
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        java_file = os.path.join(temp_dir, f"{class_name}.java")
+        with open(java_file, "w") as f:
+            f.write(code)
+        try:
+            result = await run_subprocess(
+                [javac, "-Xlint:all", "-proc:none", "-d", temp_dir, java_file], timeout=10
+            )
+        except subprocess.TimeoutExpired:
+            return None
+
+    issues = []
+    for line in result.stderr.splitlines():
+        match = JAVAC_LINE.match(line)
+        if match:
+            number = int(match.group(1))
+            # -Xlint 的警告 (unchecked、deprecation...) 多半不是效能問題，另外標成 warning
+            tag = match.group(2)
+            issues.append(_issue(number, number, tag, match.group(3)))
+    return issues
+
+
+# ----------------------------------------------------------------
+
+async def analyze(code: str, language: str) -> Dict[str, Any]:
+    """
+    不呼叫 LLM 的靜態分析，行號是精確的
+
+    Args:
+        code (str): 程式碼
+        language (str): "python" / "java" / 其他 (其他語言不分析)
+
+    Returns:
+        {
+            "issues": List[CodeIssue dict],
+            "checked": List[str]  # 已經由靜態分析完整檢查過的類別 ("syntax", "compilation")
+        }
+    """
+    if language == "python":
+        return {"issues": analyze_python(code), "checked": ["syntax", "compilation"]}
+
+    if language == "java":
+        compiled = await analyze_java_javac(code)
+        if compiled is None:
+            return {"issues": analyze_java_rules(code), "checked": []}
+        # 括號不成對 javac 已經會回報
+        return {
+            "issues": compiled + analyze_java_rules(code, braces=False),
+            "checked": ["syntax", "compilation"],
+        }
+
+    return {"issues": [], "checked": []}
@@ -0,0 +1,110 @@
+from typing import Optional, Dict, Any, Awaitable, Callable, AsyncIterator
+from contextvars import ContextVar
+import asyncio
+import json
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from utils.tracing import span
+
+# 串流請求的事件佇列；非串流請求為 None，emit() 直接略過
+stream_queue: ContextVar[Optional[asyncio.Queue]] = ContextVar("stream_queue", default=None)
+# 附加在這個 context 送出的每個事件上的欄位，例如平行產生的候選編號 {"candidate": 1}
+# (在各自的 task 裡設定，才不會影響其他並行的呼叫)
+event_tags: ContextVar[Optional[Dict[str, Any]]] = ContextVar("event_tags", default=None)
+
+
+def streaming() -> bool:
+    return stream_queue.get() is not None
+
+
+def emit(event: str, data: Dict[str, Any]):
+    """送出一個進度事件給目前的串流請求 (非串流請求時不做任何事)"""
+    queue = stream_queue.get()
+    if queue is not None:
+        tags = event_tags.get()
+        queue.put_nowait((event, {**data, **tags} if tags else data))
+
+
+def sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def run_graph(chain, state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    以 async 方式執行 LangGraph，每個 node 完成時送出 node 事件
+
+    Returns:
+        最後的 state
+    """
+    final_state = dict(state)
+    with span("graph"):
+        async for update in chain.astream(state, stream_mode="updates"):
+            for node, node_state in update.items():
+                if node_state:
+                    final_state.update(node_state)
+                emit("node", {"node": node, "status": "completed"})
+    return final_state
+
+
+async def sse_events(run: Callable[[], Awaitable[BaseModel]]) -> AsyncIterator[str]:
+    """
+    執行 run() 並把過程中的事件轉成 Server-Sent Events
+
+    事件:
+        start: 開始處理
+        token: LLM 產生的文字片段 {"content": str}
+        node: LangGraph node 完成 {"node": str, "status": "completed"}
+        execution: 產生的程式碼試跑結果 (wet_run 的回傳)
+        (平行產生多個候選時，token 與 execution 另外帶 "candidate": 候選編號，見 event_tags)
+        result: 最終結果，格式與非串流 route 的 response model 相同
+        error: 失敗原因 {"detail": str}
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    token = stream_queue.set(queue)
+    try:
+        # task 會複製目前的 context，裡面的 emit() 都會寫進這個 queue
+        task = asyncio.ensure_future(run())
+    finally:
+        stream_queue.reset(token)
+
+    yield sse("start", {})
+    try:
+        while True:
+            getter = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                event, data = getter.result()
+                yield sse(event, data)
+                continue
+            getter.cancel()
+            break
+
+        while not queue.empty():
+            event, data = queue.get_nowait()
+            yield sse(event, data)
+
+        error = task.exception()
+        if error is None:
+            yield sse("result", task.result().model_dump())
+        elif isinstance(error, HTTPException):
+            yield sse("error", {"detail": error.detail})
+        else:
+            yield sse("error", {"detail": str(error)})
+    finally:
+        # client 中途斷線時取消背景工作
+        if not task.done():
+            task.cancel()
+
+
+def sse_stream(events: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        # X-Accel-Buffering: 叫 nginx 不要緩衝，事件才會即時送到 client
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def sse_response(run: Callable[[], Awaitable[BaseModel]]) -> StreamingResponse:
+    return sse_stream(sse_events(run))
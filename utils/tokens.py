@@ -0,0 +1,263 @@
+from typing import Optional, Dict, Any, NamedTuple
+from contextvars import ContextVar
+import math
+import os
+import re
+import threading
+
+# ---------------------------------------------------------------- 計數
+
+WORD_PATTERN = re.compile(r"[A-Za-z0-9_]+|[^\sA-Za-z0-9_]")
+CJK_PATTERN = re.compile(r"[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+
+def count_tokens(text: str) -> int:
+    """
+    粗估 token 數，不需要下載 tokenizer
+
+    英數單字約每 4 個字元 1 個 token、標點與符號各 1 個、中日韓文字每字 1 個；
+    與 Gemini / OpenAI 的實際數字誤差通常在 10-15% 以內，足夠拿來做預算與比較
+    """
+    tokens = 0
+    for word in WORD_PATTERN.findall(text):
+        if CJK_PATTERN.match(word):
+            tokens += 1
+        else:
+            tokens += max(1, math.ceil(len(word) / 4))
+    return tokens
+
+
+# ---------------------------------------------------------------- 壓縮
+
+class PromptPolicy(NamedTuple):
+    compact: bool = True  # 去掉裝飾用的 emoji / markdown、多餘的縮排與空行
+    strip_comments: bool = False  # 去掉程式碼區塊中整行的註解
+    budget: int = 0  # 單一請求所有 LLM 呼叫合計的 token 上限，0 代表不限制
+
+
+# /detect 要保留註解 (行號與註解中的問題都要回報)，/convert、/upgrade 要讓註解跟著轉換；
+# /batch 的每個項目依自己的 operation 使用對應 route 的設定 (見 api/routes/batch.py)
+ROUTE_PROMPT_POLICIES = {
+    "/optimize": PromptPolicy(strip_comments=True),
+}
+
+
+def _default_policy() -> PromptPolicy:
+    return PromptPolicy(
+        compact=os.getenv("LLM_PROMPT_COMPACTION", "1") != "0",
+        budget=int(os.getenv("LLM_REQUEST_TOKEN_BUDGET", "0")),
+    )
+
+
+def policy_for_path(path: str) -> PromptPolicy:
+    default = _default_policy()
+    for prefix, policy in ROUTE_PROMPT_POLICIES.items():
+        if path == prefix or path.startswith(prefix + "/"):
+            return policy._replace(
+                compact=policy.compact and default.compact,
+                budget=policy.budget or default.budget,
+            )
+    return default
+
+
+# keycap 數字 (1️⃣) 換成 "1."，其餘 emoji 與 markdown 粗體直接去掉
+KEYCAP_PATTERN = re.compile(r"(\d)\ufe0f?\u20e3")
+EMOJI_PATTERN = re.compile(r"[\U0001F000-\U0001FAFF\u2600-\u27bf\u2b00-\u2bff\ufe0f\u20e3]")
+DECORATION_PATTERN = re.compile(r"[\U0001F000-\U0001FAFF\u2600-\u27bf\u2b00-\u2bff\ufe0f\u20e3]|\*\*")
+# 成對的粗體 (**Output**)；x ** 2 這種運算子前後有空白，不會被當成粗體
+BOLD_PATTERN = re.compile(r"\*\*[^\s*][^*]*?\*\*")
+CODE_CHARS_PATTERN = re.compile(r"[=;{}\[\]()\"'`]")
+SEPARATOR_PATTERN = re.compile(r"^\s*(-{3,}|={3,})\s*$")
+HEADING_PATTERN = re.compile(r"^#{1,6}\s+")
+# shebang 與 C 的前置處理指令不是註解
+COMMENT_PATTERN = re.compile(r"^\s*(#(?!!|include|define|pragma|if|endif|else|elif|undef)|//)")
+
+
+def _indent(line: str) -> int:
+    return len(line) - len(line.lstrip())
+
+
+def _is_markdown(line: str) -> bool:
+    """
+    程式碼區塊外的這一行是不是提示詞本身的 markdown (有 emoji 或成對粗體)；
+    不是的話可能是沒有用 ``` 包起來的程式碼，原樣保留
+    """
+    if EMOJI_PATTERN.search(line):
+        return True
+    return BOLD_PATTERN.search(line) is not None and CODE_CHARS_PATTERN.search(line) is None
+
+
+def _removable_comment(lines, index: int) -> bool:
+    """
+    整行註解能不能拿掉: 後面第一個程式行的縮排至少跟註解一樣深才行，
+    否則註解可能是 Python block 裡唯一的內容 (拿掉會變成語法錯誤)
+    """
+    line = lines[index]
+    if not COMMENT_PATTERN.match(line):
+        return False
+    for following in lines[index + 1:]:
+        if following.strip().startswith("```"):
+            return False
+        if following.strip() and not COMMENT_PATTERN.match(following):
+            return _indent(following) >= _indent(line)
+    return False
+
+
+def compact_prompt(prompt: str, strip_comments: bool = False) -> str:
+    """
+    壓縮提示詞，不改變語意
+
+    - 程式碼區塊 (```) 外: 去掉共同的縮排、分隔線與連續空行；
+      只有 markdown 的行 (有 emoji 或粗體) 才去掉 emoji、粗體與標題符號，
+      其他行可能是沒有包在 ``` 裡的程式碼，保留原本的內容與相對縮排
+    - 程式碼區塊內: 保留縮排，只去掉行尾空白與連續空行；
+      strip_comments 時再去掉整行的 # / // 註解
+    """
+    lines = prompt.splitlines()
+    # 區塊外各行共同的縮排 (f-string 裡的提示詞通常整段縮排)
+    outside = []
+    in_code = False
+    for line in lines:
+        if line.strip().startswith("```"):
+            in_code = not in_code
+        elif not in_code and line.strip():
+            outside.append(_indent(line))
+    margin = min(outside, default=0)
+
+    output = []
+    in_code = False
+    blank = False
+    # 目前是不是在提示詞的文字裡 (沒包起來的程式碼中的連續空行要保留)
+    prose = True
+    for index, line in enumerate(lines):
+        if line.strip().startswith("```"):
+            in_code = not in_code
+            output.append(line.strip())
+            blank = False
+            prose = True
+            continue
+
+        if in_code:
+            line = line.rstrip()
+            if strip_comments and _removable_comment(lines, index):
+                continue
+        elif _is_markdown(line):
+            line = DECORATION_PATTERN.sub("", KEYCAP_PATTERN.sub(r"\1.", line)).strip()
+            line = HEADING_PATTERN.sub("", line)
+            prose = True
+        elif SEPARATOR_PATTERN.match(line):
+            prose = True
+            continue
+        elif line.strip():
+            line = line[margin:].rstrip()
+            prose = False
+
+        if not line.strip():
+            if blank and (in_code or prose):
+                continue
+            blank = True
+            line = ""
+        else:
+            blank = False
+        output.append(line)
+    return "\n".join(output).strip()
+
+
+# ---------------------------------------------------------------- 用量
+
+class TokenBudgetExceeded(Exception):
+    """這個請求的 LLM token 用量超過預算"""
+
+
+class TokenUsage:
+    """
+    單一請求的 LLM token 用量 (由 middleware 建立，每次 LLM 呼叫累加)
+
+    Args:
+        route (str): 請求路徑，用來彙整 metrics
+        policy (PromptPolicy): 這個 route 的壓縮與預算設定
+    """
+
+    def __init__(self, route: str, policy: PromptPolicy):
+        self.route = route
+        self.policy = policy
+        self.calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.saved_tokens = 0
+
+    @property
+    def total(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    def check(self, prompt_tokens: int):
+        """送出前檢查預算 (已用量 + 這次的輸入)"""
+        budget = self.policy.budget
+        if budget and self.total + prompt_tokens > budget:
+            get_token_metrics().record_rejection(self.route)
+            raise TokenBudgetExceeded(
+                f"token budget exceeded: {self.total} used + {prompt_tokens} requested > {budget}"
+            )
+
+    def add(self, input_tokens: int, output_tokens: int, saved_tokens: int):
+        self.calls += 1
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        self.saved_tokens += saved_tokens
+        get_token_metrics().record(self.route, input_tokens, output_tokens, saved_tokens)
+
+    def headers(self) -> Dict[str, str]:
+        return {
+            "X-LLM-Calls": str(self.calls),
+            "X-LLM-Input-Tokens": str(self.input_tokens),
+            "X-LLM-Output-Tokens": str(self.output_tokens),
+        }
+
+
+# 目前請求的用量累加器；不在請求中 (例如 script 直接呼叫) 時為 None
+token_usage: ContextVar[Optional[TokenUsage]] = ContextVar("token_usage", default=None)
+
+
+class TokenMetrics:
+    """process 內各 route 的累計 token 用量"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes: Dict[str, Dict[str, int]] = {}
+
+    def _route(self, route: str) -> Dict[str, int]:
+        return self._routes.setdefault(
+            route,
+            {"calls": 0, "input_tokens": 0, "output_tokens": 0, "saved_tokens": 0, "budget_rejections": 0},
+        )
+
+    def record(self, route: str, input_tokens: int, output_tokens: int, saved_tokens: int):
+        with self._lock:
+            stats = self._route(route)
+            stats["calls"] += 1
+            stats["input_tokens"] += input_tokens
+            stats["output_tokens"] += output_tokens
+            stats["saved_tokens"] += saved_tokens
+
+    def record_rejection(self, route: str):
+        with self._lock:
+            self._route(route)["budget_rejections"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            routes = {route: dict(stats) for route, stats in self._routes.items()}
+        totals = {
+            key: sum(stats[key] for stats in routes.values())
+            for key in ("calls", "input_tokens", "output_tokens", "saved_tokens", "budget_rejections")
+        }
+        return {**totals, "routes": routes}
+
+
+_token_metrics: Optional[TokenMetrics] = None
+
+
+def get_token_metrics() -> TokenMetrics:
+    global _token_metrics
+    if _token_metrics is None:
+        _token_metrics = TokenMetrics()
+    return _token_metrics
@@ -0,0 +1,254 @@
+from typing import Optional, Dict, Any, List, AsyncIterator
+from collections import Counter
+from contextvars import ContextVar
+import functools
+import os
+import sys
+import threading
+import time
+import uuid
+from utils.cache import LRUCache
+
+# 每個請求可用 `X-Profile: 1` header 或 `?profile=1` 開啟 (值為 spans 時只記錄 span、不取樣)
+PROFILE_HEADER = "x-profile"
+PROFILE_QUERY = "profile"
+# 取樣間隔毫秒數
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+# 取樣最多持續的秒數 (client 斷線沒收完串流時也會停止)
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "300"))
+PROFILE_MAX_DEPTH = 64
+# 保留幾筆 trace 供 GET /traces/{id} 查詢，與保留秒數
+TRACE_HISTORY = int(os.getenv("TRACE_HISTORY", "100"))
+TRACE_TTL = float(os.getenv("TRACE_TTL", "3600"))
+
+# 目前的 span；沒有開啟 profiling 的請求為 None，span() 直接回傳不做事的 _NOOP
+current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    """一段計時區間，巢狀的 span 組成 trace 的樹狀結構"""
+
+    __slots__ = ("trace", "name", "attrs", "start", "end", "error", "children", "_token")
+
+    def __init__(self, trace: "Trace", name: str, attrs: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+        self.start = 0.0
+        self.end: Optional[float] = None
+        self.error: Optional[str] = None
+        self.children: List["Span"] = []
+        self._token = None
+
+    def set(self, key: str, value: Any):
+        self.attrs[key] = value
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        parent = current_span.get()
+        if parent is not None:
+            parent.children.append(self)
+        self._token = current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.perf_counter()
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        try:
+            current_span.reset(self._token)
+        except ValueError:
+            # 在另一個 context 結束 (例如跨 yield 的 async generator)，由原本的 context 自行回收
+            pass
+        return False
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        data = {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round((self.end - self.start) * 1000, 3) if self.end is not None else None,
+        }
+        if self.attrs:
+            data["attrs"] = self.attrs
+        if self.error:
+            data["error"] = self.error
+        if self.children:
+            data["children"] = [child.to_dict(origin) for child in self.children]
+        return data
+
+
+class _NoopSpan:
+    """沒有開啟 profiling 時的 span，所有操作都不做事"""
+
+    def set(self, key: str, value: Any):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str, **attrs):
+    """
+    記錄一段區間: `with span("chat", retry=1): ...`
+
+    目前的請求沒有開啟 profiling 時只多一次 ContextVar 查詢，回傳共用的 _NOOP
+    """
+    parent = current_span.get()
+    if parent is None:
+        return _NOOP
+    return Span(parent.trace, name, attrs)
+
+
+def annotate(key: str, value: Any):
+    """在目前的 span 加上屬性 (沒有開啟 profiling 時不做事)"""
+    current = current_span.get()
+    if current is not None:
+        current.set(key, value)
+
+
+class SamplingProfiler:
+    """
+    背景 thread 定期取樣所有 thread 的 call stack，累計成 collapsed stack (flamegraph 格式)
+
+    取樣的是整個 process，同時間有其他請求時也會出現在結果裡；
+    event loop thread 停在 select() 代表在等 I/O (例如 LLM 回應)。
+    閒置的 worker thread (停在 threading / queue 的等待) 不計入。
+    """
+
+    def __init__(self, interval: float, max_seconds: float, loop_thread: int):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.loop_thread = loop_thread
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        deadline = time.monotonic() + self.max_seconds
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                if thread_id != self.loop_thread and frame.f_code.co_filename.endswith(("threading.py", "queue.py")):
+                    continue
+                stack = []
+                while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append("event-loop" if thread_id == self.loop_thread else names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def to_dict(self, limit: int = 200) -> Dict[str, Any]:
+        return {
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "stacks": [{"stack": stack, "count": count} for stack, count in self.stacks.most_common(limit)],
+        }
+
+    def collapsed(self) -> str:
+        """flamegraph.pl / speedscope 可以直接讀的格式: 每行 `frame;frame;... count`"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class Trace:
+    """一個開啟 profiling 的請求: span 樹與 (選用的) 取樣結果"""
+
+    def __init__(self, name: str, sample: bool):
+        self.id = uuid.uuid4().hex[:16]
+        self.created_at = time.time()
+        self.root = Span(self, name, {})
+        self.profiler: Optional[SamplingProfiler] = None
+        if sample:
+            self.profiler = SamplingProfiler(PROFILE_INTERVAL_MS / 1000, PROFILE_MAX_SECONDS, threading.get_ident())
+        self.finished = False
+
+    def start(self):
+        self.root.start = time.perf_counter()
+        current_span.set(self.root)
+        if self.profiler is not None:
+            self.profiler.start()
+        get_trace_store().set(self.id, self)
+
+    def finish(self, **attrs):
+        if self.finished:
+            return
+        self.finished = True
+        self.root.attrs.update(attrs)
+        self.root.end = time.perf_counter()
+        if self.profiler is not None:
+            self.profiler.stop()
+
+    async def wrap(self, body: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """包住 response body，送完 (或 client 斷線) 時結束 trace，串流回應也會完整記錄"""
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            self.finish()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "created_at": self.created_at,
+            "finished": self.finished,
+            "spans": self.root.to_dict(self.root.start),
+            "profile": self.profiler.to_dict() if self.profiler is not None else None,
+        }
+
+
+def profiling_requested(headers, query_params) -> Optional[str]:
+    """回傳請求要求的 profiling 模式 ("spans" 或 "full")，沒有要求時為 None"""
+    value = (headers.get(PROFILE_HEADER) or query_params.get(PROFILE_QUERY) or "").strip().lower()
+    if value in ("", "0", "false", "off", "no"):
+        return None
+    return "spans" if value == "spans" else "full"
+
+
+def start_trace(name: str, mode: str) -> Trace:
+    """開始記錄目前的請求 (之後在這個 context 裡的 span() 都會記錄到這個 trace)"""
+    trace = Trace(name, sample=mode == "full")
+    trace.start()
+    return trace
+
+
+_trace_store: Optional[LRUCache] = None
+
+
+def get_trace_store() -> LRUCache:
+    global _trace_store
+    if _trace_store is None:
+        _trace_store = LRUCache(max_entries=TRACE_HISTORY, ttl=TRACE_TTL)
+    return _trace_store
+
+
+def traced(name: str):
+    """async 函數的 decorator: 整個呼叫記錄成一個 span (沒有開啟 profiling 時直接呼叫)"""
+
+    def decorate(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if current_span.get() is None:
+                return await func(*args, **kwargs)
+            with span(name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate